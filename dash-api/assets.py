@@ -0,0 +1,52 @@
+import logging
+import os
+
+from PIL import Image, ImageEnhance
+
+from .cache import LruCache
+
+logger = logging.getLogger(__name__)
+
+
+class IconCache:
+    """
+    Bounded LRU cache of processed (darkened and resized) icons that are ready
+    to paste onto the dashboard (reported in the cache-* metrics as "icons").
+    Entries are keyed on the source path, file mtime, target size and brightness
+    so a new icon written by fetch-weather (new mtime) is picked up automatically
+    (and the entries for the old icon are evicted once they're no longer used).
+    """
+
+    _cache: LruCache[Image.Image]
+
+    def __init__(self, max_entries: int = 64):
+        self._cache = LruCache[Image.Image](
+            max_entries=max_entries,
+            size_of=lambda icon: icon.width * icon.height * len(icon.getbands()),
+            name="icons",
+        )
+
+    def _load(self, path: str, size: tuple[int, int], brightness: float) -> Image.Image:
+        icon = Image.open(path)
+        if brightness != 1.0:
+            icon = ImageEnhance.Brightness(icon).enhance(brightness)
+        icon = icon.resize(size)
+        icon.load()
+        return icon
+
+    def get(self, path: str, size: tuple[int, int], brightness: float = 1.0) -> Image.Image:
+        """Get the processed icon. The returned image is shared so must not be modified"""
+        mtime = os.stat(path).st_mtime_ns
+        key = f"{path}:{mtime}:{size[0]}x{size[1]}:{brightness}"
+        icon = self._cache.get(key)
+        if icon is None:
+            logger.debug("icon-cache: loading %s", key)
+            icon = self._load(path, size, brightness)
+            self._cache.set(key, icon)
+        return icon
+
+    def clear(self):
+        self._cache.clear()
+
+
+icons = IconCache()
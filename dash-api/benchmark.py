@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+"""
+Render micro-benchmarks for dashboard.py
+
+Times generate_dashboard_image end to end for a set of synthetic DashboardData fixtures,
+along with drawing each tile of each device profile, encoding and get_image_hash.
+Also times parsing the input files and get_dashboard_data, and measures the memory
+they allocate (the alloc[...] stages, in KiB).
+The median timings are compared against the baseline file and the run fails
+if any stage is slower (or allocates more) than the baseline by more than the tolerance.
+
+Usage:
+    python benchmark.py                   # compare against benchmark-baseline.json
+    python benchmark.py --update-baseline # save the results as the new baseline
+
+NOTE: the baseline should be generated on the target hardware (i.e. the Pi)
+"""
+
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# local import fix (see main.py)
+parent_path = pathlib.Path(__file__).parent
+__package__ = parent_path.name
+sys.path.append(str(parent_path.absolute().parent))
+
+# The input files for the parsing benchmarks (and the databases) are written to a private
+# folder, which is deleted on exit, so that the benchmark never touches the live files
+_input_dir = tempfile.TemporaryDirectory(prefix="dash-api-benchmark-")
+os.environ["DASHBOARD_INPUT_DIR"] = _input_dir.name
+os.environ["SKIP_DOTENV"] = "1"
+for name in ["MESSAGES_FILE", "MESSAGES_DB", "ETAG_DB", "TEMPERATURE_HISTORY_DIR"]:
+    os.environ.pop(name, None)
+
+from PIL import Image, ImageDraw
+
+from . import config
+from .assets import icons
+from .dashboard import (
+    Action,
+    DashboardData,
+    generate_dashboard_image,
+    get_dashboard_data,
+    get_image_hash,
+)
+from .fonts import fit_text, fonts
+from .change_policy import DEFAULT_POLICY, compile_policy
+from .etag_store import EtagStore
+from .formats import FORMATS
+from .layout import CompiledLayout
+from .leaf import LEAF_ICON_CHARGING, LEAF_ICON_NOT_PLUGGED_IN, LeafData, get_leaf_data, leaf_summary_snapshot
+from .profiles import DEFAULT_PROFILE, PROFILES
+from .temperature import TemperatureData
+from .weather import (
+    WeatherData, WeatherDataPoint, get_display_weather_data, get_weather_data,
+    weather_projection_snapshot, weather_summary_snapshot,
+)
+
+DEFAULT_BASELINE_FILE = os.path.join(config.script_dir, "benchmark-baseline.json")
+
+WEATHER_ICONS = [
+    f"{code}{time_of_day}"
+    for code in ["01", "02", "03", "04", "09", "10", "11", "13", "50"]
+    for time_of_day in ["d", "n"]
+]
+
+
+def create_placeholder_icons(icon_dir: str):
+    """Create stand-in icons (same size and mode as the OpenWeatherMap @2x icons)"""
+    os.makedirs(icon_dir, exist_ok=True)
+    for i, icon in enumerate(WEATHER_ICONS):
+        image = Image.new("RGBA", (100, 100), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(image)
+        draw.ellipse((10 + i, 10, 90, 90 - i), fill=(120 + i * 5, 120, 200, 220))
+        image.save(os.path.join(icon_dir, f"{icon}.png"))
+
+
+def create_weather_point(icon_dir: str, icon: str, time_text: str) -> WeatherDataPoint:
+    return WeatherDataPoint(
+        time=time_text,
+        description="light rain",
+        temperature=12,
+        feels_like=10,
+        icon_path=os.path.join(icon_dir, f"{icon}.png"),
+        wind_speed_mph=8,
+        wind_gust_mph=15,
+        humidity=81,
+    )
+
+
+def create_fixtures(icon_dir: str) -> dict[str, DashboardData]:
+    def create_data(
+        leaf_icon=LEAF_ICON_CHARGING,
+        message="Have a great day!",
+        weather_icon: str | None = "10d",
+    ):
+        weather = None
+        if weather_icon:
+            weather = WeatherData(
+                current=create_weather_point(icon_dir, weather_icon, "Now"),
+                forecast=[
+                    create_weather_point(icon_dir, weather_icon, "12:00"),
+                    create_weather_point(icon_dir, weather_icon, "15:00"),
+                ],
+            )
+        return DashboardData(
+            leaf=LeafData(
+                is_plugged_in=leaf_icon != LEAF_ICON_NOT_PLUGGED_IN,
+                is_charging=leaf_icon == LEAF_ICON_CHARGING,
+                cruising_range_ac_off_miles=123,
+                cruising_range_ac_on_miles=110,
+                icon_path=os.path.join(config.leaf_image_dir, leaf_icon),
+            ),
+            date_string="Wednesday, 30 September 2026",
+            message=message,
+            weather=weather,
+            pistat0=TemperatureData(reported_at=None, temperature=20.4, humidity=55.2),
+            actions=[Action(id="refresh", display_text="Refresh")],
+            generated_date=datetime.now(timezone.utc),
+        )
+
+    fixtures = {
+        "default": create_data(),
+        "long-message": create_data(
+            message="This is a very long message that will not fit on a single line of the dashboard at the largest size so has to be wrapped and shrunk"
+        ),
+        "no-weather": create_data(weather_icon=None),
+        "not-plugged-in": create_data(leaf_icon=LEAF_ICON_NOT_PLUGGED_IN),
+    }
+    for icon in WEATHER_ICONS:
+        fixtures[f"weather-{icon}"] = create_data(weather_icon=icon)
+    return fixtures
+
+
+def write_input_files(icon_dir: str, forecast_count: int = 40):
+    """Write input files like those from fetch-weather (a 5 day/3 hour forecast) and leaf-api"""
+    input_dir = config.dashboard_input_dir
+    forecast = [
+        {
+            "time": f"{(i * 3) % 24:02}:00",
+            "description": "light rain",
+            "temperature": 12.34 + i / 10,
+            "feels_like": 10.9,
+            "icon_path": os.path.join(icon_dir, f"{WEATHER_ICONS[i % len(WEATHER_ICONS)]}.png"),
+            "wind_speed_mph": 8.4,
+            "wind_gust_mph": 15.2 if i % 2 else None,
+            "humidity": 81,
+        }
+        for i in range(forecast_count)
+    ]
+    with open(os.path.join(input_dir, "weather-summary.json"), "w") as f:
+        json.dump({"current": {**forecast[0], "time": "Now"}, "forecast": forecast[1:]}, f, indent=2)
+    # the projection has the next day's forecasts, starting with one that is already past
+    first_forecast_time = int(time.time()) - 60 * 60
+    with open(os.path.join(input_dir, "weather-dashboard.json"), "w") as f:
+        json.dump({
+            "version": 1,
+            "current": {**get_rounded_forecast(forecast[0]), "time": "Now"},
+            "forecast_times": [first_forecast_time + i * 3 * 60 * 60 for i in range(8)],
+            "forecast": [get_rounded_forecast(w) for w in forecast[1:9]],
+        }, f, separators=(",", ":"))
+    with open(os.path.join(input_dir, "leaf-summary.json"), "w") as f:
+        json.dump({
+            "is_connected": True,
+            "charging_status": "NORMAL_CHARGING",
+            "cruising_range_ac_off_miles": 123.4,
+            "cruising_range_ac_on_miles": 110.2,
+        }, f)
+    with open(os.path.join(input_dir, "temperatures.json"), "w") as f:
+        json.dump({"temperatures": {"pistat-0": {
+            "reported_at": "2026-09-30T10:00:00", "temperature": 20.43, "humidity": 55.2}}}, f)
+
+
+def get_rounded_forecast(forecast: dict) -> dict:
+    return {key: round(value) if isinstance(value, float) else value for key, value in forecast.items()}
+
+
+def measure_allocations(func, setup=None) -> float:
+    """Get the peak memory allocated by func (after a warm-up call) in KiB"""
+    if setup:
+        setup()
+    func()
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+def invalidate_input_files():
+    leaf_summary_snapshot.invalidate()
+    weather_summary_snapshot.invalidate()
+    weather_projection_snapshot.invalidate()
+
+
+def reset_render_caches(profile: CompiledLayout):
+    """
+    Reset the caches that a render uses to how they are when a render worker has started:
+    no cached layers or fitted text and only the known icons loaded (the fonts are loaded
+    when the worker starts too so are kept)
+    """
+    profile.renderer.invalidate()
+    fit_text.cache_clear()
+    icons.clear()
+    profile.preload()
+
+
+def time_stage(func, iterations: int, setup=None) -> float:
+    """Run func iterations times (after a warm-up call) and return the median time in seconds"""
+    if setup:
+        setup()
+    func()
+    timings = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def tile_stage(tile, data):
+    """Create a stage that renders the tile for data onto a new image"""
+    value = tile.key(data)
+
+    def run():
+        image = Image.new(mode="RGBA", size=tile.size, color=(0, 0, 0, 0))
+        tile.draw(image, ImageDraw.Draw(image), value)
+    return run
+
+
+def run_benchmarks(fixtures: dict[str, DashboardData], iterations: int) -> dict[str, float]:
+    results = {}
+    renderer = DEFAULT_PROFILE.renderer
+
+    # end to end for each fixture (cold, see reset_render_caches)
+    for name, data in fixtures.items():
+        results[f"generate_dashboard_image[{name}]"] = time_stage(
+            lambda: generate_dashboard_image(data), iterations, setup=lambda: reset_render_caches(DEFAULT_PROFILE)
+        )
+
+    data = fixtures["default"]
+    results["generate_dashboard_image[default,warm]"] = time_stage(
+        lambda: generate_dashboard_image(data), iterations
+    )
+
+    # individual stages (the draw_* functions are the tiles of each profile)
+    for profile in PROFILES.values():
+        if profile is not DEFAULT_PROFILE:
+            results[f"generate_dashboard_image[default,{profile.name}]"] = time_stage(
+                lambda: generate_dashboard_image(data, profile), iterations,
+                setup=lambda: reset_render_caches(profile),
+            )
+        for tile in profile.renderer.tiles:
+            results[f"draw[{profile.name},{tile.name}]"] = time_stage(tile_stage(tile, data), iterations)
+
+    long_message_data = fixtures["long-message"]
+    for tile in renderer.tiles:
+        if tile.name == "message":
+            results["draw[long-message]"] = time_stage(tile_stage(tile, long_message_data), iterations)
+
+    frame = DEFAULT_PROFILE.render(data)
+    for image_format in FORMATS.values():
+        results[f"encode[{image_format.name}]"] = time_stage(
+            lambda: image_format.encode(frame), iterations)
+
+    image_buf = generate_dashboard_image(data)
+    results["get_image_hash"] = time_stage(lambda: get_image_hash(image_buf), iterations)
+
+    # loading the data (cold means that the input files are parsed)
+    results["parse[weather-summary]"] = time_stage(
+        get_weather_data, iterations, setup=weather_summary_snapshot.invalidate)
+    results["parse[weather-dashboard]"] = time_stage(
+        lambda: get_display_weather_data(2), iterations, setup=weather_projection_snapshot.invalidate)
+    results["get_display_weather_data[warm]"] = time_stage(lambda: get_display_weather_data(2), iterations)
+    results["parse[leaf-summary]"] = time_stage(
+        get_leaf_data, iterations, setup=leaf_summary_snapshot.invalidate)
+    results["get_dashboard_data[cold]"] = time_stage(
+        get_dashboard_data, iterations, setup=invalidate_input_files)
+    results["get_dashboard_data[warm]"] = time_stage(get_dashboard_data, iterations)
+
+    # deciding whether a device's image can be reused (all of the rules are checked when nothing has changed)
+    check_cached_data = compile_policy(DEFAULT_POLICY)
+    results["check_cached_data"] = time_stage(lambda: check_cached_data(data, data), iterations)
+    results["alloc[check_cached_data]"] = measure_allocations(lambda: check_cached_data(data, data))
+
+    # the ETag store (the db lookups are what a worker that didn't issue the ETag, or a restarted worker, does)
+    etag_db = os.path.join(config.dashboard_input_dir, "etags-benchmark.db")
+    store = EtagStore(etag_db, ttl=60)
+    db_store = EtagStore(etag_db, ttl=60, memory_max_entries=0)
+    results["etag_store.set"] = time_stage(lambda: store.set("etag", data), iterations)
+    results["etag_store.get[memory]"] = time_stage(lambda: store.get("etag"), iterations)
+    results["etag_store.get[db]"] = time_stage(lambda: db_store.get("etag"), iterations)
+    results["etag_store.get[miss]"] = time_stage(lambda: db_store.get("unknown-etag"), iterations)
+
+    results["alloc[parse[weather-summary]]"] = measure_allocations(
+        get_weather_data, setup=weather_summary_snapshot.invalidate)
+    results["alloc[parse[weather-dashboard]]"] = measure_allocations(
+        lambda: get_display_weather_data(2), setup=weather_projection_snapshot.invalidate)
+    results["alloc[get_dashboard_data[cold]]"] = measure_allocations(
+        get_dashboard_data, setup=invalidate_input_files)
+    results["alloc[get_dashboard_data[warm]]"] = measure_allocations(get_dashboard_data)
+
+    return results
+
+
+def format_value(stage: str, value: float) -> str:
+    """Format the result for the stage (KiB for the alloc stages, otherwise ms)"""
+    if stage.startswith("alloc["):
+        return f"{value:.1f} KiB"
+    return f"{value * 1000:.3f} ms"
+
+
+def compare_to_baseline(results: dict[str, float], baseline: dict[str, float], tolerance: float) -> list[str]:
+    """Print the results against the baseline and return the stages that have regressed"""
+    regressions = []
+    print(f"{'stage':<45} {'median':>14} {'baseline':>14} {'change':>8}")
+    for stage, value in results.items():
+        baseline_value = baseline.get(stage)
+        if baseline_value:
+            change = (value - baseline_value) / baseline_value
+            change_text = f"{change:+.0%}"
+            if change > tolerance:
+                regressions.append(stage)
+                change_text += " !"
+            print(f"{stage:<45} {format_value(stage, value):>14} "
+                  f"{format_value(stage, baseline_value):>14} {change_text:>8}")
+        else:
+            print(f"{stage:<45} {format_value(stage, value):>14} {'-':>14} {'':>8}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dashboard render benchmarks")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="fail if a stage is slower than the baseline by more than this fraction")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--icon-dir", help="use real weather icons from this folder instead of placeholders")
+    args = parser.parse_args()
+
+    fonts.preload()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        icon_dir = args.icon_dir
+        if not icon_dir:
+            icon_dir = os.path.join(temp_dir, "weather-icons")
+            create_placeholder_icons(icon_dir)
+
+        fixtures = create_fixtures(icon_dir)
+        write_input_files(icon_dir)
+        results = run_benchmarks(fixtures, args.iterations)
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Wrote baseline: {args.baseline}")
+        return
+
+    if regressions:
+        print(f"ERROR: {len(regressions)} stage(s) regressed by more than {args.tolerance:.0%}:")
+        for stage in regressions:
+            print(f"  {stage}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        _input_dir.cleanup()
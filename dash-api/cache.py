@@ -1,96 +1,412 @@
-from datetime import datetime, timezone
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
 import functools
+import inspect
 import logging
+import sys
+import threading
 import time
-from typing import Any
+from typing import Any, Callable
+
+from opentelemetry.metrics import CallbackOptions, Observation
+
+from .telemetry import meter
 
 logger = logging.getLogger(__name__)
 
-def cache_for(ttl: int = 60):
+
+def get_size(value) -> int:
+    """Estimate the memory used by value (the length of bytes-like values, otherwise the shallow size)"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+class _CacheItem[T]:
+    __slots__ = ("value", "size", "expires_at")
+
+    def __init__(self, value: T, size: int, expires_at: float):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+
+
+class Cache[T]:
     """
-    Cache the result of a function for a given time-to-live (TTL) in seconds.
-    Pass skip_cache=True to skip the cache.
+    A thread-safe cache with a time-to-live and LRU eviction.
+    An item expires ttl seconds after it was last used (never if ttl is None), or if sliding
+    is False ttl seconds after it was set (or after the ttl passed to set), and once
+    there are more than max_entries items or their total size is more than max_bytes
+    the least recently used items are evicted (an item larger than max_bytes isn't kept).
+    As every item has the same ttl the least recently used item is usually the first to
+    expire, so the items are kept in order of use and expiring only looks at the oldest,
+    making each operation O(1) (amortised). Items that expire out of order (i.e. with a
+    fixed expiry) are expired when they are next looked up, or once they are the oldest.
+    Times are from the monotonic clock. Caches with a name are reported in the cache-* metrics
     """
-    last_result = None
-    next_call_time = 0
 
-    def cache_for_decorator(func):
-        @functools.wraps(func)
-        def decorator(*args, **kwargs):
-            nonlocal last_result, ttl, next_call_time
-            if "skip_cache" in kwargs:
-                next_call_time = 0
-                kwargs.pop("skip_cache")
-            now = time.time()
-            if now > next_call_time:
-                last_result = func(*args, **kwargs)
-                next_call_time = now + ttl
-            return last_result
-        return decorator
-    return cache_for_decorator
+    _ttl: float | None
+    _sliding: bool
+    _max_entries: int | None
+    _max_bytes: int | None
+    _size_of: Callable[[T], int]
+    _name: str | None
+    _items: OrderedDict[str, _CacheItem[T]]
+    _bytes: int
+    _lock: threading.Lock
+    _hits: int
+    _misses: int
+    _expirations: int
+    _evictions: int
+    _rejections: int
 
+    def __init__(
+        self,
+        ttl: float | None = 60,
+        max_entries: int | None = None,
+        max_bytes: int | None = None,
+        size_of: Callable[[T], int] = get_size,
+        name: str | None = None,
+        sliding: bool = True,
+    ):
+        self._ttl = ttl
+        self._sliding = sliding
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._size_of = size_of
+        self._name = name
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._expirations = 0
+        self._evictions = 0
+        self._rejections = 0
+        if name:
+            _named_caches.append(self)
 
-class _CacheItem[T]:
-    _key: str
-    _value: T
-    _last_touched: datetime
+    @property
+    def name(self) -> str | None:
+        return self._name
+
+    @property
+    def hits(self) -> int:
+        return self._hits
 
-    def __init__(self, key: str, value: T):
-        self._key = key
-        self._value = value
-        self._last_touched = datetime.now(timezone.utc)
+    @property
+    def misses(self) -> int:
+        return self._misses
 
     @property
-    def key(self):
-        return self._key
+    def expirations(self) -> int:
+        return self._expirations
 
     @property
-    def value(self) -> T:
-        return self._value
+    def evictions(self) -> int:
+        """The number of items evicted to stay within max_entries/max_bytes"""
+        return self._evictions
 
-    def older_than(self, seconds: int):
-        return (datetime.now(timezone.utc) - self._last_touched).total_seconds() > seconds
+    @property
+    def rejections(self) -> int:
+        """The number of items not kept as they were larger than max_bytes"""
+        return self._rejections
 
-    def touch(self):
-        self._last_touched = datetime.now(timezone.utc)
+    @property
+    def bytes(self) -> int:
+        """The estimated total size of the items"""
+        return self._bytes
 
+    def __len__(self) -> int:
+        return len(self._items)
 
-class Cache[T]:
-    _ttl: int
-    _cache: dict[str, _CacheItem[T]]
+    def _get_expiry(self, now: float) -> float:
+        return now + self._ttl if self._ttl is not None else 0
+
+    def _expire(self, now: float):
+        while self._items:
+            item = next(iter(self._items.values()))
+            if item.expires_at > now:
+                break
+            key, _ = self._items.popitem(last=False)
+            self._bytes -= item.size
+            self._expirations += 1
+            logger.debug("Expired cache item: %s", key)
+
+    def _evict(self):
+        while self._items and (
+            (self._max_entries is not None and len(self._items) > self._max_entries)
+            or (self._max_bytes is not None and self._bytes > self._max_bytes)
+        ):
+            _, item = self._items.popitem(last=False)
+            self._bytes -= item.size
+            self._evictions += 1
+
+    def get(self, key: str) -> T | None:
+        with self._lock:
+            now = 0
+            if self._ttl is not None:
+                now = time.monotonic()
+                self._expire(now)
+            item = self._items.get(key)
+            if item is not None and self._ttl is not None and item.expires_at <= now:
+                del self._items[key]
+                self._bytes -= item.size
+                self._expirations += 1
+                item = None
+            if item is None:
+                self._misses += 1
+                return None
+            self._items.move_to_end(key)
+            if self._ttl is not None and self._sliding:
+                item.expires_at = self._get_expiry(now)
+            self._hits += 1
+            return item.value
+
+    def set(self, key: str, value: T, ttl: float | None = None):
+        """Set the item, with a ttl other than the cache's if given (for a cache that has a ttl)"""
+        size = self._size_of(value)
+        with self._lock:
+            now = 0
+            if self._ttl is not None:
+                now = time.monotonic()
+                self._expire(now)
+            old_item = self._items.pop(key, None)
+            if old_item is not None:
+                self._bytes -= old_item.size
+            if self._max_bytes is not None and size > self._max_bytes:
+                # (rather than evicting every other item before evicting it)
+                self._rejections += 1
+                return
+            expires_at = now + ttl if ttl is not None else self._get_expiry(now)
+            self._items[key] = _CacheItem(value, size, expires_at)
+            self._bytes += size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+
+class LruCache[T](Cache[T]):
+    """
+    A bounded cache that evicts the least recently used item once max_entries is reached
+    (a Cache with no ttl)
+    """
+
+    def __init__(self, max_entries: int = 32, **kwargs):
+        super().__init__(ttl=None, max_entries=max_entries, **kwargs)
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    hits: int  # calls that got a fresh result
+    stale_hits: int  # calls that got the expired result while another call was updating it
+    waits: int  # calls that had no result so waited for another call's update
+    misses: int  # calls that called the function
+    entries: int
+
+
+class _Memo:
+    __slots__ = ("value", "fresh_until")
 
-    def __init__(self, ttl: int = 60):
+    def __init__(self, value, fresh_until: float):
+        self.value = value
+        self.fresh_until = fresh_until
+
+
+_KWARGS_MARK = object()
+
+
+def _make_key(args: tuple, kwargs: dict) -> tuple:
+    if not kwargs:
+        return args
+    return args + (_KWARGS_MARK,) + tuple(sorted(kwargs.items()))
+
+
+class _Memoizer:
+    """
+    The results of a function decorated with cache_for, keyed on the arguments.
+    Only one call at a time updates the result for a key: other calls get the expired
+    result if there is one (stale-while-revalidate) or otherwise wait for the update
+    """
+
+    _ttl: float
+    _results: LruCache[_Memo]
+    _in_flight: dict[tuple, Any]  # the update for each key (a Future or asyncio.Task)
+    _lock: threading.Lock
+    _hits: int
+    _stale_hits: int
+    _waits: int
+    _misses: int
+
+    def __init__(self, ttl: float, max_entries: int):
         self._ttl = ttl
-        self._cache = {}
-
-    def _purge(self):
-        for key in list(self._cache.keys()):
-            if self._cache[key].older_than(self._ttl):
-                logger.info("Purging cache item: %s", key)
-                del self._cache[key]
-
-    def get(self, key: str) -> T:
-        self._purge()
-        value = self._cache.get(key, None)
-        if value is None:
-            return None
-
-        value.touch()
-        return value.value
-
-    def set(self, key: str, value: T):
-        self._cache[key] = _CacheItem[T](key, value)
-
-
-if __name__ == "__main__":
-    @cache_for(ttl=5)
-    def foo():
-        return time.time()
-
-    print(foo())
-    print(foo())
-    print(foo(skip_cache=True))
-    print(foo())
-    time.sleep(5)
-    print(foo())
-    print(foo())
+        self._results = LruCache(max_entries=max_entries)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._stale_hits = 0
+        self._waits = 0
+        self._misses = 0
+
+    def begin(self, key: tuple, skip_cache: bool, create_future: Callable[[], Any]) -> tuple[bool, Any, Any]:
+        """
+        Returns (found, result, update):
+        found is True if result is the result to use, otherwise if update is None
+        result is the future of the update to wait for, otherwise update is the new
+        update from create_future, which calls the function and passes itself to end (or fail)
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if not skip_cache:
+                memo = self._results.get(key)
+                if memo is not None:
+                    if time.monotonic() < memo.fresh_until:
+                        self._hits += 1
+                        return True, memo.value, None
+                    if future is not None:
+                        self._stale_hits += 1
+                        return True, memo.value, None
+                if future is not None:
+                    self._waits += 1
+                    return False, future, None
+            self._misses += 1
+            update = create_future()
+            if future is None:
+                # (a skip_cache call while another call is updating isn't waited for)
+                self._in_flight[key] = update
+            return False, None, update
+
+    def end(self, key: tuple, update, value):
+        with self._lock:
+            self._results.set(key, _Memo(value, time.monotonic() + self._ttl))
+            if self._in_flight.get(key) is update:
+                del self._in_flight[key]
+
+    def fail(self, key: tuple, update):
+        """The update failed (any previous result is kept)"""
+        with self._lock:
+            if self._in_flight.get(key) is update:
+                del self._in_flight[key]
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self._hits,
+            stale_hits=self._stale_hits,
+            waits=self._waits,
+            misses=self._misses,
+            entries=len(self._results),
+        )
+
+    def clear(self):
+        self._results.clear()
+
+
+def _retrieve_exception(task: asyncio.Task):
+    # (the calls waiting for an update may all have been cancelled)
+    if not task.cancelled():
+        task.exception()
+
+
+def cache_for(ttl: float = 60, max_entries: int = 128):
+    """
+    Cache the results of a function (sync or async) for ttl seconds, keyed on its
+    (hashable) arguments. Once a result has expired the next call updates it while
+    concurrent calls get the expired result rather than also calling the function.
+    Pass skip_cache=True to call the function regardless.
+    The decorated function has cache_stats() and cache_clear()
+    """
+
+    def cache_for_decorator(func):
+        memoizer = _Memoizer(ttl, max_entries)
+
+        if inspect.iscoroutinefunction(func):
+            async def update_result(key: tuple, args: tuple, kwargs: dict):
+                update = asyncio.current_task()
+                try:
+                    value = await func(*args, **kwargs)
+                except BaseException:
+                    memoizer.fail(key, update)
+                    raise
+                memoizer.end(key, update, value)
+                return value
+
+            @functools.wraps(func)
+            async def decorator(*args, skip_cache: bool = False, **kwargs):
+                key = _make_key(args, kwargs)
+
+                def start_update() -> asyncio.Task:
+                    task = asyncio.ensure_future(update_result(key, args, kwargs))
+                    task.add_done_callback(_retrieve_exception)
+                    return task
+
+                found, result, update = memoizer.begin(key, skip_cache, start_update)
+                if found:
+                    return result
+                # the update runs in its own task, which every call (including the one that
+                # started it) awaits shielded, so that a call being cancelled doesn't cancel it
+                return await asyncio.shield(update if update is not None else result)
+        else:
+            @functools.wraps(func)
+            def decorator(*args, skip_cache: bool = False, **kwargs):
+                key = _make_key(args, kwargs)
+                found, result, update = memoizer.begin(key, skip_cache, Future)
+                if found:
+                    return result
+                if update is None:
+                    return result.result()
+                try:
+                    value = func(*args, **kwargs)
+                except BaseException as e:
+                    memoizer.fail(key, update)
+                    update.set_exception(e)
+                    raise
+                memoizer.end(key, update, value)
+                update.set_result(value)
+                return value
+
+        decorator.cache_stats = memoizer.stats
+        decorator.cache_clear = memoizer.clear
+        return decorator
+    return cache_for_decorator
+
+
+# The caches reported in the metrics
+_named_caches: list[Cache] = []
+
+
+def _observe(get_value: Callable[[Cache], int]):
+    def observe(options: CallbackOptions):
+        for cache in _named_caches:
+            yield Observation(get_value(cache), {"cache": cache.name})
+    return observe
+
+
+meter.create_observable_counter(
+    "cache-hits", [_observe(lambda cache: cache.hits)], "count", "Number of cache lookups that found an item"
+)
+meter.create_observable_counter(
+    "cache-misses", [_observe(lambda cache: cache.misses)], "count", "Number of cache lookups that found no item"
+)
+meter.create_observable_counter(
+    "cache-expirations", [_observe(lambda cache: cache.expirations)], "count",
+    "Number of cache items removed as they had not been used within the time-to-live"
+)
+meter.create_observable_counter(
+    "cache-evictions", [_observe(lambda cache: cache.evictions)], "count",
+    "Number of cache items evicted to keep the cache within its size bounds"
+)
+meter.create_observable_counter(
+    "cache-rejections", [_observe(lambda cache: cache.rejections)], "count",
+    "Number of items not cached as they were larger than the cache's max size"
+)
+meter.create_observable_gauge(
+    "cache-entries", [_observe(len)], "count", "Number of items in the cache"
+)
+meter.create_observable_gauge(
+    "cache-bytes", [_observe(lambda cache: cache.bytes)], "By", "Estimated size of the items in the cache"
+)
@@ -0,0 +1,147 @@
+"""
+Change detection for conditional requests.
+
+When a device sends If-None-Match the data its image was rendered from is
+compared with the current data to decide whether it needs a new image. The
+policy is a list of rules, checked in order, and the first rule that matches
+names the reason for the new image (which is reported in the metrics). The
+policy is compiled into a list of field comparisons so that checking it
+doesn't serialise or copy the data.
+"""
+
+from dataclasses import dataclass, fields
+from datetime import datetime, timedelta, timezone
+import operator
+from typing import Any, Callable
+
+from . import config
+from .dashboard import DashboardData
+
+
+@dataclass(frozen=True)
+class MaxAge:
+    """Matches if the cached value of the (datetime) field is older than max_age"""
+    rule: str
+    field: str
+    max_age: timedelta
+
+
+@dataclass(frozen=True)
+class Changed:
+    """Matches if any of the fields are not equal"""
+    rule: str
+    fields: tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class Threshold:
+    """Matches if the (numeric) field has gone up or down by more than threshold"""
+    rule: str
+    field: str
+    threshold: float
+
+
+Rule = MaxAge | Changed | Threshold
+
+# Fields are dotted paths from DashboardData (e.g. leaf.is_charging). A field that
+# is under a source that is None (i.e. has never loaded, in which case it is stale
+# in both) doesn't match
+DEFAULT_POLICY: list[Rule] = [
+    MaxAge("too-old", "generated_date", timedelta(seconds=config.change_max_age)),
+    # the stale indicator has changed
+    Changed("stale", ("stale",)),
+    Changed("leaf-charging", ("leaf.is_charging",)),
+    Changed("leaf-plugged-in", ("leaf.is_plugged_in",)),
+    Threshold("leaf-range", "leaf.cruising_range_ac_off_miles", config.change_leaf_range_miles),
+    Changed("message", ("message",)),
+    Threshold("temperature", "pistat0.temperature", config.change_temperature),
+    Threshold("humidity", "pistat0.humidity", config.change_humidity),
+]
+
+_MISSING = object()
+
+Comparison = Callable[[DashboardData, DashboardData], bool]
+
+
+def _compile_getter(path: str) -> Callable[[Any], Any]:
+    names = path.split(".")
+    if names[0] not in {f.name for f in fields(DashboardData)}:
+        raise ValueError(f"Unknown DashboardData field: {path}")
+    getters = [operator.attrgetter(name) for name in names]
+    if len(getters) == 1:
+        return getters[0]
+    parent_getters, value_getter = getters[:-1], getters[-1]
+
+    def get(value):
+        for getter in parent_getters:
+            value = getter(value)
+            if value is None:
+                return _MISSING
+        return value_getter(value)
+    return get
+
+
+def _compile_max_age(rule: MaxAge) -> Comparison:
+    get = _compile_getter(rule.field)
+    max_age = rule.max_age
+
+    def compare(cached: DashboardData, current: DashboardData) -> bool:
+        generated = get(cached)
+        if generated is None or generated is _MISSING:
+            return True
+        return datetime.now(timezone.utc) - generated > max_age
+    return compare
+
+
+def _compile_changed(rule: Changed) -> Comparison:
+    getters = [_compile_getter(field) for field in rule.fields]
+
+    def compare(cached: DashboardData, current: DashboardData) -> bool:
+        for get in getters:
+            cached_value = get(cached)
+            current_value = get(current)
+            if cached_value is _MISSING or current_value is _MISSING:
+                continue
+            if cached_value != current_value:
+                return True
+        return False
+    return compare
+
+
+def _compile_threshold(rule: Threshold) -> Comparison:
+    get = _compile_getter(rule.field)
+    threshold = rule.threshold
+
+    def compare(cached: DashboardData, current: DashboardData) -> bool:
+        cached_value = get(cached)
+        current_value = get(current)
+        if cached_value is None or current_value is None or cached_value is _MISSING or current_value is _MISSING:
+            return False
+        return abs(current_value - cached_value) > threshold
+    return compare
+
+
+def _compile_rule(rule: Rule) -> Comparison:
+    if isinstance(rule, MaxAge):
+        return _compile_max_age(rule)
+    if isinstance(rule, Changed):
+        return _compile_changed(rule)
+    if isinstance(rule, Threshold):
+        return _compile_threshold(rule)
+    raise ValueError(f"Unknown change policy rule: {rule}")
+
+
+def compile_policy(policy: list[Rule]) -> Callable[[DashboardData, DashboardData], str | None]:
+    """
+    Compile the policy into a function that returns the first rule that matches
+    (i.e. that requires a new image), or None if the cached data is still good enough
+    """
+    # (each rule is compiled before its name is read so that an unknown rule raises a ValueError)
+    compiled = [(_compile_rule(rule), rule.rule) for rule in policy]
+
+    def check(cached: DashboardData, current: DashboardData) -> str | None:
+        for compare, name in compiled:
+            if compare(cached, current):
+                return name
+        return None
+    return check
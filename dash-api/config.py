@@ -8,9 +8,13 @@ if "SKIP_DOTENV" not in os.environ:
 
 app_insights_connection_string = os.getenv(
     "APPLICATIONINSIGHTS_CONNECTION_STRING")
+# Used when there is no App Insights connection string: console or otlp
+telemetry_exporter = os.getenv("TELEMETRY_EXPORTER")
+telemetry_export_interval_ms = int(os.getenv("TELEMETRY_EXPORT_INTERVAL_MS", "60000"))
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 leaf_image_dir = os.path.join(script_dir, "leaf_images")
+font_dir = os.getenv("FONT_DIR") or os.path.join(script_dir, "fonts")
 
 
 dashboard_input_dir = os.getenv("DASHBOARD_INPUT_DIR")
@@ -18,5 +22,47 @@ dashboard_input_dir = os.getenv("DASHBOARD_INPUT_DIR")
 messages_file = os.getenv("MESSAGES_FILE") or os.path.join(
     dashboard_input_dir, "messages.json"
 )
-print(f"Using messages file: {messages_file}")
+# The messages file is imported into the database whenever it has changed since it was last imported
+messages_db = os.getenv("MESSAGES_DB") or os.path.splitext(messages_file)[0] + ".db"
 
+# The thresholds for a device's image to be replaced (see change_policy.py):
+# the max age of the image and how much the leaf range, temperature and humidity can change
+change_max_age = float(os.getenv("CHANGE_MAX_AGE_SECONDS", str(30 * 60)))
+change_leaf_range_miles = float(os.getenv("CHANGE_LEAF_RANGE_MILES", "3"))
+change_temperature = float(os.getenv("CHANGE_TEMPERATURE", "0.5"))
+change_humidity = float(os.getenv("CHANGE_HUMIDITY", "2"))
+
+# The dashboard data for each ETag that has been issued (shared by the workers and kept across restarts)
+etag_db = os.getenv("ETAG_DB") or os.path.join(dashboard_input_dir, "etags.db")
+# Data older than the change max age is never reused so by default there's no point keeping it longer
+etag_ttl = float(os.getenv("ETAG_TTL_SECONDS", str(change_max_age)))
+
+
+
+# How often the input files are polled if watchfiles isn't available
+# (and the interval for the safety-net refresh when watching)
+input_poll_interval = float(os.getenv("INPUT_POLL_INTERVAL_SECONDS", "5"))
+
+# temperatures.json (and the history) are written every interval or once this many updates are pending
+temperature_flush_interval = float(os.getenv("TEMPERATURE_FLUSH_INTERVAL_SECONDS", "10"))
+temperature_flush_batch_size = int(os.getenv("TEMPERATURE_FLUSH_BATCH_SIZE", "50"))
+
+# Folder for the temperature history files (one per sensor)
+temperature_history_dir = os.getenv("TEMPERATURE_HISTORY_DIR") or os.path.join(
+    dashboard_input_dir, "temperature-history"
+)
+
+# The deadline for loading each data source before falling back to its last-known-good value
+data_source_timeout = float(os.getenv("DATA_SOURCE_TIMEOUT_SECONDS", "2"))
+
+# How often the background renderer checks for changed inputs, and the max time between renders
+prerender_interval = float(os.getenv("PRERENDER_INTERVAL_SECONDS", "10"))
+prerender_rebuild_interval = float(os.getenv("PRERENDER_REBUILD_INTERVAL_SECONDS", str(5 * 60)))
+
+# The number of worker processes used to render images (0 to render in the API process)
+render_workers = int(os.getenv("RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# /dashboard-image-diff returns 304 if less than this fraction of the pixels have changed
+diff_changed_fraction_threshold = float(os.getenv("DIFF_CHANGED_FRACTION_THRESHOLD", "0.001"))
+# the difference in grey level (0-255) for a pixel to count as changed
+diff_pixel_threshold = int(os.getenv("DIFF_PIXEL_THRESHOLD", "32"))
@@ -0,0 +1,33 @@
+"""
+config.py reads the environment when it is imported, so the input files (and the
+databases) are pointed at a temporary folder before any of the modules are imported.
+The folder's name isn't a valid package name (see the local import fix in main.py),
+so the tests import the modules from the dash_api package registered here
+"""
+
+import importlib.util
+import os
+import sys
+import tempfile
+
+_input_dir = tempfile.TemporaryDirectory(prefix="dash-api-test-")
+os.environ["DASHBOARD_INPUT_DIR"] = _input_dir.name
+os.environ["SKIP_DOTENV"] = "1"
+os.environ["RENDER_WORKERS"] = "0"
+for name in [
+    "MESSAGES_FILE", "MESSAGES_DB", "ETAG_DB", "TEMPERATURE_HISTORY_DIR",
+    "APPLICATIONINSIGHTS_CONNECTION_STRING", "TELEMETRY_EXPORTER",
+]:
+    os.environ.pop(name, None)
+
+_package_dir = os.path.dirname(os.path.abspath(__file__))
+_spec = importlib.util.spec_from_file_location(
+    "dash_api", os.path.join(_package_dir, "__init__.py"), submodule_search_locations=[_package_dir]
+)
+_package = importlib.util.module_from_spec(_spec)
+sys.modules["dash_api"] = _package
+_spec.loader.exec_module(_package)
+
+
+def pytest_unconfigure(config):
+    _input_dir.cleanup()
@@ -1,349 +1,191 @@
 import hashlib
 import json
 from io import BytesIO
-import itertools
-import json
 from datetime import datetime, timezone
 
 
-from dataclasses import asdict, dataclass, is_dataclass
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance
+from dataclasses import asdict, dataclass, field, is_dataclass, replace
+import logging
+from PIL import Image
 
-from .cache import Cache, cache_for
-from .leaf import LeafData, get_leaf_data
+from . import config
+from .cache import cache_for
+from .formats import FORMATS, ImageFormat
+from .layout import CompiledLayout
+from .leaf import LeafData, get_leaf_data, leaf_summary_snapshot
 from .messages import get_message
-from .stocks import StockData, get_stock_data
+from .profiles import DEFAULT_PROFILE
+from .sources import DataSource, LoadedValue, SourceGatherer
+from .telemetry import stage
 from .temperature import TemperatureData, get_all_temperature_data
-from .weather import WeatherData, get_rounded_weather_data, get_weather_data
+from .weather import WeatherData, read_display_weather_data
+
+logger = logging.getLogger(__name__)
 
 
 def hash_data(data):
+    """
+    Get a stable digest of the parts of the data that affect the rendered image.
+    Unlike hash(), this is the same across processes and restarts
+    """
     if is_dataclass(data):
         data = asdict(data)
-    data_string = json.dumps(data)
-    data_hash = hash(data_string)
-    return data_hash
+    if isinstance(data, dict):
+        # the generated/reported dates change on every call but aren't shown on the dashboard
+        data = {k: v for k, v in data.items() if k != "generated_date"}
+        if data.get("pistat0"):
+            data["pistat0"] = {k: v for k, v in data["pistat0"].items() if k != "reported_at"}
+    data_string = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(data_string.encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class RenderedImage:
+    content: bytes
+    etag: str
+
+
+@dataclass(frozen=True)
+class RenderResult:
+    image: RenderedImage
+    frame: Image.Image  # greyscale (e.g. for diffing)
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class Action:
     id: str
     display_text: str
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class DashboardData:
     leaf: LeafData
     date_string: str
     message: str
     weather: WeatherData | None
-    # stocks: list[StockData]
     pistat0: TemperatureData
     actions: list[Action] = None
     generated_date: datetime= None
-
-@dataclass
-class TemperatureReading:
-    temperature: float
-    humidity: float
-
-# @dataclass
-# class TemperatureData:
-#     pistat0 : TemperatureReading
+    # the sources that are showing their last-known-good data
+    stale: list[str] = field(default_factory=list)
 
 def get_dashboard_data():
-    leaf_data = get_leaf_data()
-    # stock_data = get_stock_data()
-
-    pistat0 = get_temperature_data()
-
-    weather = get_weather_data()
-    if weather:
-        # take up to three weather forecast entries
-        forecast = list(itertools.islice(weather.forecast, 2))
-        forecast = [get_rounded_weather_data(w) for w in forecast]
-        current = get_rounded_weather_data(weather.current)
-        weather = WeatherData(current=current, forecast=forecast)
-
-    dashboard_data = DashboardData(
-        leaf=leaf_data,
-        date_string=datetime.now().strftime("%A, %d %B %Y"),
-        message=get_message(datetime.now().date()),
-        weather=weather,
-        # stocks=stock_data,
-        pistat0=pistat0,
-        actions=[
-            Action(id="refresh", display_text="Refresh"),
-        ],
-        generated_date=datetime.now(timezone.utc),
-    )
+    with stage("get-dashboard-data"):
+        gathered = _sources.gather()
+        if gathered.stale:
+            logger.warning("dashboard: using last-known-good data for %s", gathered.stale)
+
+        dashboard_data = DashboardData(
+            leaf=gathered.values["leaf"],
+            date_string=datetime.now().strftime("%A, %d %B %Y"),
+            message=gathered.values["message"],
+            weather=gathered.values["weather"],
+            # stocks=stock_data,
+            pistat0=gathered.values["temperature"],
+            actions=[
+                Action(id="refresh", display_text="Refresh"),
+            ],
+            generated_date=datetime.now(timezone.utc),
+            stale=gathered.stale,
+        )
 
     return dashboard_data
 
-@cache_for(ttl=15*60) # only update every 15 minutes in dashboard
-def get_temperature_data(skip_cache: bool = False):
-    pistat0 = get_all_temperature_data().get("pistat-0", None)
-    if pistat0:
-        pistat0.temperature = round(pistat0.temperature, 1)
-        pistat0.humidity = round(pistat0.humidity, 1)
-    return pistat0
-
 
-def yes_no(value: bool):
-    return "Yes" if value else "No"
+def _load_weather() -> LoadedValue:
+    # the current weather and up to two upcoming forecast entries
+    # (only the file that was read decides whether the weather is stale, as the summary
+    # isn't used while there is a projection)
+    weather, snapshot = read_display_weather_data(forecast_count=2)
+    return LoadedValue(weather, (snapshot,))
 
 
-def pure_pil_alpha_to_color_v2(image, color=(255, 255, 255)):
-    """Alpha composite an RGBA Image with a specified color.
+def _load_message() -> str:
+    return get_message(datetime.now().date())
 
-    Simpler, faster version than the solutions above.
 
-    Source: http://stackoverflow.com/a/9459208/284318
+@cache_for(ttl=15*60) # only update every 15 minutes in dashboard
+def get_temperature_data(skip_cache: bool = False):
+    temperatures = get_all_temperature_data()
+    if temperatures is None:
+        return None
+    pistat0 = temperatures.get("pistat-0", None)
+    if pistat0:
+        # copy as the temperature data is shared with the file snapshot
+        pistat0 = replace(
+            pistat0, temperature=round(pistat0.temperature, 1), humidity=round(pistat0.humidity, 1))
+    return pistat0
 
-    Keyword Arguments:
-    image -- PIL RGBA Image object
-    color -- Tuple r, g, b (default 255, 255, 255)
 
-    """
-    # from: https://stackoverflow.com/questions/9166400/convert-rgba-png-to-rgb-with-pil
-    image.load()  # needed for split()
-    background = Image.new("RGB", image.size, color)
-    background.paste(image, mask=image.split()[3])  # 3 is the alpha channel
-    return background
+# The sources are loaded concurrently (see sources.py)
+_sources = SourceGatherer([
+    DataSource("leaf", get_leaf_data, config.data_source_timeout, (leaf_summary_snapshot,)),
+    DataSource("temperature", get_temperature_data, config.data_source_timeout),
+    DataSource("weather", _load_weather, config.data_source_timeout),
+    DataSource("message", _load_message, config.data_source_timeout),
+])
 
 
 def get_image_hash(image_buf):
+    return get_content_hash(image_buf.getvalue())
+
+
+def get_content_hash(content: bytes):
     hash_md5 = hashlib.md5()
-    hash_md5.update(image_buf.getvalue())
+    hash_md5.update(content)
     image_hash = hash_md5.hexdigest()
     return image_hash
 
 
-def generate_dashboard_image(dashboard_data: DashboardData):
-    image = Image.new(mode="RGBA", size=(800, 480), color=(255, 255, 255))
-    draw = ImageDraw.Draw(image)
+def render_image(
+    dashboard_data: DashboardData,
+    image_format: ImageFormat,
+    profile: CompiledLayout = DEFAULT_PROFILE,
+) -> RenderResult:
+    """Render and encode the image for the data (bypassing the profile's image cache)"""
+    with stage("render", profile=profile.name):
+        frame = profile.render(dashboard_data)
+    with stage("encode", format=image_format.name):
+        content = image_format.encode(frame)
+    with stage("hash-image"):
+        etag = get_content_hash(content)
+    return RenderResult(image=RenderedImage(content=content, etag=etag), frame=frame.convert("L"))
 
-    draw_heading(image, draw, dashboard_data)
 
-    draw_leaf_info(image, draw, dashboard_data.leaf)
+def get_image_cache_key(dashboard_data: DashboardData, image_format: ImageFormat) -> str:
+    with stage("hash-data"):
+        return f"{hash_data(dashboard_data)}:{image_format.name}"
 
-    draw_weather(image, draw, dashboard_data.weather,
-                 weather_left=30, weather_top=130)
-    
-    draw_pistat(dashboard_data, draw, left=330, top=275)
 
-    # stock_left = 30
-    # stock_top = 340
+def get_rendered_image(
+    dashboard_data: DashboardData,
+    image_format: ImageFormat | None = None,
+    profile: CompiledLayout = DEFAULT_PROFILE,
+) -> RenderedImage:
+    """
+    Get the encoded image for the data, rendering it if it isn't in the profile's image cache.
+    Uses the profile's default format if image_format is None
+    """
+    if image_format is None:
+        image_format = FORMATS[profile.default_format]
+    cache_key = get_image_cache_key(dashboard_data, image_format)
+    rendered_image = profile.image_cache.get(cache_key)
+    if rendered_image is None:
+        rendered_image = render_image(dashboard_data, image_format, profile).image
+        profile.image_cache.set(cache_key, rendered_image)
+    return rendered_image
 
-    # stock_font = ImageFont.truetype("fonts/FiraCode-Regular.ttf", 20)
-    # top = stock_top
-    # left = stock_left
-    # for stock in dashboard_data.stocks:
-    #     draw.text(
-    #         (left, top),
-    #         f"{stock.symbol}: {stock.price} {stock.currency}",
-    #         fill=(0, 0, 0),
-    #         font=stock_font,
-    #     )
-    #     left += 250
 
-    draw_actions(dashboard_data.actions, dashboard_data.message, image, draw)
+def get_frame(dashboard_data: DashboardData, profile: CompiledLayout = DEFAULT_PROFILE) -> Image.Image:
+    """Get the rendered frame as a greyscale image (e.g. for diffing)"""
+    return profile.render(dashboard_data).convert("L")
 
-    # handle the alpha channel (needed for PNGs from OpenWeatherMap)
-    image = pure_pil_alpha_to_color_v2(image)
+
+def generate_dashboard_image(dashboard_data: DashboardData, profile: CompiledLayout = DEFAULT_PROFILE):
+    with stage("render", profile=profile.name):
+        image = profile.render(dashboard_data)
 
     image_buf = BytesIO()
-    image.save(image_buf, "JPEG")
+    with stage("encode", format="jpeg"):
+        image.save(image_buf, "JPEG")
     image_buf.seek(0)
     return image_buf
-
-def draw_actions(actions: list[Action], message : str, image: Image, draw: ImageDraw):
-    # draw lines and text for buttons
-    action_font = ImageFont.truetype("fonts/FiraCode-Regular.ttf", 15)
-    for i, x in enumerate([80, 240, 400, 560, 720]):
-        draw.line((x, 460, x, 490), fill=(0, 0, 0))
-        if actions and len(actions) > i:
-            action = actions[i]
-            draw_centred(
-                draw,
-                (x + 5, 440),
-                action.display_text,
-                font=action_font,
-            )
-
-    message_font_size = 25
-    while message_font_size > 10:
-        message_font = ImageFont.truetype(
-            "fonts/FiraCode-Regular.ttf", message_font_size
-        )
-        message_width = draw.textlength(message, font=message_font)
-        if message_width < image.width - 20:
-            message_x = (image.width - message_width) / 2
-            draw.text((message_x, 400), message,
-                      fill=(0, 0, 0), font=message_font)
-            break
-        message_font_size -= 1
-
-def draw_pistat(dashboard_data: DashboardData, draw: ImageDraw, left: int, top: int):
-    if dashboard_data.pistat0 is not None:
-        temp_font = ImageFont.truetype("fonts/FiraCode-Regular.ttf", 15)
-        draw.text(
-            (left, top),
-            f"pistat-0: {dashboard_data.pistat0.temperature}°C ({dashboard_data.pistat0.humidity}%)",
-            fill=(0, 0, 0),
-            font=temp_font,
-        )
-
-
-def draw_centred(draw, xy, text, font):
-    """Draw text centred on the x coordinate.
-    Returns the width of the text drawn."""
-    x = xy[0]
-    y = xy[1]
-    text_width = draw.textlength(text, font=font)
-    text_x = x - (text_width) / 2
-    draw.text((text_x, y), text, fill=(0, 0, 0), font=font)
-    return text_width
-
-
-def draw_weather(image, draw, weather, weather_left, weather_top):
-    weather_font = ImageFont.truetype("fonts/FiraCode-Regular.ttf", 20)
-    weather_font_temp_main = ImageFont.truetype(
-        "fonts/FiraCode-Regular.ttf", 30)
-    weather_font_temp_feels_like = ImageFont.truetype(
-        "fonts/FiraCode-Regular.ttf", 20)
-    weather_font_description = ImageFont.truetype(
-        "fonts/FiraCode-Regular.ttf", 15)
-    weather_width = 200
-
-    if weather:
-        weather_list = [weather.current] + weather.forecast
-        for idx, weather in enumerate(weather_list):
-            # load weather icon
-            weather_icon = Image.open(weather.icon_path)
-
-            # darken the image as light clouds etc are hard to see on the eink display
-            enhancer = ImageEnhance.Brightness(weather_icon)
-            weather_icon = enhancer.enhance(0.65)
-
-            if idx == 0:
-                weather_icon = weather_icon.resize((150, 150))
-                weather_font = ImageFont.truetype(
-                    "fonts/FiraCode-Regular.ttf", 20)
-                weather_font_temp_main = ImageFont.truetype(
-                    "fonts/FiraCode-Regular.ttf", 30
-                )
-                weather_font_temp_feels_like = ImageFont.truetype(
-                    "fonts/FiraCode-Regular.ttf", 20
-                )
-                weather_font_description = ImageFont.truetype(
-                    "fonts/FiraCode-Regular.ttf", 20
-                )
-                weather_width = 250
-                weather_x_offset = 50
-                temp_offset = 35
-                feels_like_offset = 35
-                description_offset = 50
-                wind_offset = 25
-                image_offset = -5
-            else:
-                weather_icon = weather_icon.resize((85, 85))
-                weather_font = ImageFont.truetype(
-                    "fonts/FiraCode-Regular.ttf", 17)
-                weather_font_temp_main = ImageFont.truetype(
-                    "fonts/FiraCode-Regular.ttf", 25
-                )
-                weather_font_temp_feels_like = ImageFont.truetype(
-                    "fonts/FiraCode-Regular.ttf", 17.5
-                )
-                weather_font_description = ImageFont.truetype(
-                    "fonts/FiraCode-Regular.ttf", 15
-                )
-                weather_x_offset = 10
-                weather_width = 200
-                temp_offset = 25
-                feels_like_offset = 35
-                description_offset = 30
-                wind_offset = 20
-                image_offset = 5
-
-            current_y = weather_top
-            image.paste(weather_icon, box=(weather_left, current_y + image_offset))
-            draw_centred(
-                draw,
-                (weather_left + (weather_width / 2), current_y),
-                weather.time,
-                font=weather_font,
-            )
-
-            current_y += temp_offset
-            draw.text(
-                (weather_left + weather_icon.width, current_y),
-                f"{weather.temperature:.0f}°C",
-                fill=(0, 0, 0),
-                font=weather_font_temp_main,
-            )
-
-            current_y += feels_like_offset
-            draw.text(
-                (weather_left + weather_icon.width, current_y),
-                f"{weather.feels_like:.0f}°C, {weather.humidity}%",
-                fill=(0, 0, 0),
-                font=weather_font_temp_feels_like,
-            )
-
-            current_y += description_offset
-            draw_centred(
-                draw,
-                (weather_left + weather_width / 2, current_y),
-                weather.description,
-                font=weather_font_description,
-            )
-
-            current_y += wind_offset
-            wind_speed_text = f"{weather.wind_speed_mph:.0f}" if weather.wind_speed_mph else "n/a"
-            wind_gust_text = f"{weather.wind_gust_mph:.0f}" if weather.wind_gust_mph else "n/a"
-            draw_centred(
-                draw,
-                (weather_left + weather_width / 2, current_y),
-                f"{wind_speed_text} mph ({wind_gust_text} mph gusts)",
-                font=weather_font_description,
-            )
-            weather_left += weather_width + weather_x_offset
-
-
-def draw_leaf_info(image: Image, image_draw: ImageDraw, leaf_info: LeafData):
-    info_main_font = ImageFont.truetype("fonts/FiraCode-Regular.ttf", 30)
-    info_sub_font = ImageFont.truetype("fonts/FiraCode-Regular.ttf", 17.5)
-
-    cruising_range_ac_off_miles = leaf_info.cruising_range_ac_off_miles
-    cruising_range_ac_on_miles = leaf_info.cruising_range_ac_on_miles
-
-    image_draw.text(
-        (110, 50),
-        f"Range: {cruising_range_ac_off_miles:.0f} miles",
-        fill=(0, 0, 0),
-        font=info_main_font,
-    )
-    image_draw.text(
-        (110, 90),
-        f"({cruising_range_ac_on_miles:.0f} with climate control)",
-        fill=(0, 0, 0),
-        font=info_sub_font,
-    )
-    leaf_image = Image.open(leaf_info.icon_path)
-    leaf_image = leaf_image.resize((70, 70))
-    image.paste(leaf_image, box=(10, 40))
-
-
-def draw_heading(image: Image, draw: ImageDraw, dashboard_data):
-    heading_font_title = ImageFont.truetype("fonts/FiraCode-Regular.ttf", 17.5)
-    heading_font = ImageFont.truetype("fonts/FiraCode-Regular.ttf", 25)
-
-    title = "Leeks Dashboard"
-    title_width = draw.textlength(title, font=heading_font_title)
-    title_x = (image.width / 2 - title_width) / 2
-    draw.text((title_x, 10), title, fill=(0, 0, 0), font=heading_font_title)
-
-    date_text = dashboard_data.date_string
-    date_width = draw.textlength(date_text, font=heading_font)
-    date_x = image.width - date_width - 10
-    draw.text((date_x, 10), date_text, fill=(0, 0, 0), font=heading_font)
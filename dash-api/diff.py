@@ -0,0 +1,90 @@
+from dataclasses import dataclass
+from io import BytesIO
+import logging
+
+from PIL import Image, ImageChops
+
+from .cache import LruCache
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class FrameDiff:
+    changed_fraction: float
+    boxes: list[tuple[int, int, int, int]]
+
+
+# Greyscale frames keyed on the ETag that was issued for them
+# so that later requests can be diffed against what the client is showing
+frame_cache = LruCache[Image.Image](
+    max_entries=16, size_of=lambda frame: frame.width * frame.height * len(frame.getbands()), name="diff-frames")
+
+
+def diff_frames(
+    old_frame: Image.Image, new_frame: Image.Image, pixel_threshold: int = 32, band_height: int = 16
+) -> FrameDiff:
+    """
+    Compare two greyscale frames.
+    Pixels that differ by more than pixel_threshold count as changed.
+    The changed regions are returned as bounding boxes, computed per horizontal band
+    of the frame with vertically adjacent bands merged together.
+    """
+    if old_frame.size != new_frame.size:
+        width, height = new_frame.size
+        return FrameDiff(changed_fraction=1.0, boxes=[(0, 0, width, height)])
+
+    difference = ImageChops.difference(old_frame, new_frame)
+    mask = difference.point([255 if v > pixel_threshold else 0 for v in range(256)])
+    width, height = mask.size
+    changed_pixels = mask.histogram()[255]
+    if changed_pixels == 0:
+        return FrameDiff(changed_fraction=0.0, boxes=[])
+
+    boxes = []
+    current = None
+    for top in range(0, height, band_height):
+        bottom = min(top + band_height, height)
+        bbox = mask.crop((0, top, width, bottom)).getbbox()
+        if bbox is None:
+            if current:
+                boxes.append(current)
+                current = None
+            continue
+        band_box = (bbox[0], top + bbox[1], bbox[2], top + bbox[3])
+        if current:
+            current = (
+                min(current[0], band_box[0]),
+                current[1],
+                max(current[2], band_box[2]),
+                band_box[3],
+            )
+        else:
+            current = band_box
+    if current:
+        boxes.append(current)
+
+    return FrameDiff(changed_fraction=changed_pixels / (width * height), boxes=boxes)
+
+
+def diff_since(
+    old_etag: str | None, new_etag: str, new_frame: Image.Image, pixel_threshold: int = 32
+) -> FrameDiff:
+    """
+    Compare the frame the client is showing (identified by the ETag it sent) with the new frame.
+    A client that already has the new image has no changes, even if its frame is no longer
+    cached, otherwise if its frame isn't cached the whole frame has changed
+    """
+    if old_etag == new_etag:
+        return FrameDiff(changed_fraction=0.0, boxes=[])
+    old_frame = frame_cache.get(old_etag) if old_etag else None
+    if old_frame is None:
+        # We don't know what the client is showing, so send the whole frame
+        logger.info("diff: No frame for %s, sending full frame", old_etag)
+        return FrameDiff(changed_fraction=1.0, boxes=[(0, 0, new_frame.width, new_frame.height)])
+    return diff_frames(old_frame, new_frame, pixel_threshold=pixel_threshold)
+
+
+def encode_patch(frame: Image.Image, box: tuple[int, int, int, int]) -> bytes:
+    image_buf = BytesIO()
+    frame.crop(box).save(image_buf, "PNG")
+    return image_buf.getvalue()
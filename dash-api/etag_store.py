@@ -0,0 +1,183 @@
+"""
+The dashboard data for each ETag that has been issued.
+
+When a device sends If-None-Match the data that its image was rendered from is
+compared with the current data to decide whether to send a new image. The data
+is kept in a SQLite database (on the dashboard PVC) so that it is shared by all
+of the uvicorn workers and survives restarts, with an in-memory cache in front.
+"""
+
+from datetime import datetime
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from . import config
+from .cache import Cache
+from .dashboard import Action, DashboardData
+from .leaf import LeafData
+from .telemetry import meter
+from .temperature import TemperatureData
+from .weather import WeatherData, WeatherDataPoint
+
+logger = logging.getLogger(__name__)
+
+counter_etag_store_lookups = meter.create_counter(
+    "etag-store-lookups", "count", "ETag lookups by where the data was found (memory, db or miss)"
+)
+
+# Rows written in another format are ignored (i.e. treated as a miss)
+_FORMAT_VERSION = 1
+
+
+def _encode_weather_data_point(point: WeatherDataPoint) -> dict:
+    return {
+        "time": point.time,
+        "description": point.description,
+        "temperature": point.temperature,
+        "feels_like": point.feels_like,
+        "icon_path": point.icon_path,
+        "wind_speed_mph": point.wind_speed_mph,
+        "wind_gust_mph": point.wind_gust_mph,
+        "humidity": point.humidity,
+    }
+
+
+def encode_dashboard_data(data: DashboardData) -> str:
+    leaf = data.leaf
+    weather = data.weather
+    pistat0 = data.pistat0
+    return json.dumps({
+        "leaf": {
+            "is_plugged_in": leaf.is_plugged_in,
+            "is_charging": leaf.is_charging,
+            "cruising_range_ac_off_miles": leaf.cruising_range_ac_off_miles,
+            "cruising_range_ac_on_miles": leaf.cruising_range_ac_on_miles,
+            "icon_path": leaf.icon_path,
+        } if leaf else None,
+        "date_string": data.date_string,
+        "message": data.message,
+        "weather": {
+            "current": _encode_weather_data_point(weather.current),
+            "forecast": [_encode_weather_data_point(w) for w in weather.forecast],
+        } if weather else None,
+        "pistat0": {
+            "reported_at": pistat0.reported_at,
+            "temperature": pistat0.temperature,
+            "humidity": pistat0.humidity,
+        } if pistat0 else None,
+        "actions": [{"id": a.id, "display_text": a.display_text} for a in data.actions] if data.actions else None,
+        "generated_date": data.generated_date.isoformat() if data.generated_date else None,
+        "stale": data.stale,
+    }, separators=(",", ":"))
+
+
+def decode_dashboard_data(text: str) -> DashboardData:
+    value = json.loads(text)
+    leaf = value["leaf"]
+    weather = value["weather"]
+    pistat0 = value["pistat0"]
+    actions = value["actions"]
+    generated_date = value["generated_date"]
+    return DashboardData(
+        leaf=LeafData(**leaf) if leaf else None,
+        date_string=value["date_string"],
+        message=value["message"],
+        weather=WeatherData(
+            current=WeatherDataPoint(**weather["current"]),
+            forecast=[WeatherDataPoint(**w) for w in weather["forecast"]],
+        ) if weather else None,
+        pistat0=TemperatureData(**pistat0) if pistat0 else None,
+        actions=[Action(**a) for a in actions] if actions is not None else None,
+        generated_date=datetime.fromisoformat(generated_date) if generated_date else None,
+        stale=value["stale"],
+    )
+
+
+class EtagStore:
+    """
+    The DashboardData for each ETag, kept for ttl seconds after the ETag was issued
+    (in memory as well as in the database, so that an entry expires at the same time in each).
+    As with the messages the journal is left in the default (rollback) mode rather than
+    WAL as the database may be on a network filesystem. The store is a cache so errors
+    reading or writing the database are logged and treated as a miss
+    """
+
+    _path: str
+    _ttl: float
+    _memory: Cache[DashboardData]
+    _connection: sqlite3.Connection | None
+    _lock: threading.Lock
+
+    def __init__(self, path: str, ttl: float, memory_max_entries: int = 256, name: str | None = None):
+        self._path = path
+        self._ttl = ttl
+        self._memory = Cache[DashboardData](ttl=ttl, max_entries=memory_max_entries, name=name, sliding=False)
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # wait (up to the timeout) for other workers' writes rather than failing
+            connection = sqlite3.connect(self._path, timeout=5, check_same_thread=False)
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS etags ("
+                    "etag TEXT PRIMARY KEY, version INTEGER NOT NULL, "
+                    "expires_at REAL NOT NULL, data TEXT NOT NULL)"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS etags_expires_at ON etags (expires_at)")
+            self._connection = connection
+        return self._connection
+
+    def get(self, etag: str) -> DashboardData | None:
+        data = self._memory.get(etag)
+        if data is not None:
+            counter_etag_store_lookups.add(1, {"result": "memory"})
+            return data
+
+        expires_at = None
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT data, expires_at FROM etags WHERE etag = ? AND version = ? AND expires_at > ?",
+                    (etag, _FORMAT_VERSION, time.time()),
+                ).fetchone()
+            if row:
+                data = decode_dashboard_data(row[0])
+                expires_at = row[1]
+        except sqlite3.Error as e:
+            logger.error("etag-store: failed to read %s: %s", self._path, e)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("etag-store: failed to decode the data for %s: %s", etag, e)
+
+        if data is None:
+            counter_etag_store_lookups.add(1, {"result": "miss"})
+            return None
+        counter_etag_store_lookups.add(1, {"result": "db"})
+        # kept in memory until the row expires (rather than for another ttl)
+        self._memory.set(etag, data, ttl=expires_at - time.time())
+        return data
+
+    def set(self, etag: str, data: DashboardData):
+        self._memory.set(etag, data)
+        now = time.time()
+        try:
+            text = encode_dashboard_data(data)
+            with self._lock:
+                connection = self._connect()
+                with connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO etags (etag, version, expires_at, data) VALUES (?, ?, ?, ?)",
+                        (etag, _FORMAT_VERSION, now + self._ttl, text),
+                    )
+                    connection.execute("DELETE FROM etags WHERE expires_at <= ?", (now,))
+        except sqlite3.Error as e:
+            logger.error("etag-store: failed to write %s: %s", self._path, e)
+        except (TypeError, ValueError) as e:
+            logger.warning("etag-store: failed to encode the data for %s: %s", etag, e)
+
+
+etag_store = EtagStore(config.etag_db, ttl=config.etag_ttl, name="dashboard-data")
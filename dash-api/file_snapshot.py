@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable
+
+try:
+    # orjson is optional (pip install orjson) and is several times faster than json
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+
+def _get_signature(stat: os.stat_result) -> tuple[int, int, int]:
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class JsonFileSnapshot[T]:
+    """
+    The parsed contents of a JSON input file.
+    Each get revalidates with a single os.stat and the file is only re-read and parsed
+    when its mtime, size or inode have changed. While the file is watched (see InputFeed)
+    get doesn't touch the filesystem at all and the watcher calls refresh on changes.
+    If the file can't be parsed (e.g. it is part-way through being written) then the
+    last good value is kept.
+    The returned value is shared so must not be modified
+    """
+
+    _path: str
+    _parse: Callable[[Any], T]
+    _value: T | None
+    _signature: tuple | None
+    _failed_signature: tuple | None
+    _version: int
+    _watched: bool
+    _lock: threading.Lock
+    _hits: int
+    _misses: int
+
+    def __init__(self, path: str, parse: Callable[[Any], T]):
+        self._path = path
+        self._parse = parse
+        self._value = None
+        self._signature = None
+        self._failed_signature = None
+        self._version = 0
+        self._watched = False
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def version(self) -> int:
+        """Incremented each time the value changes"""
+        return self._version
+
+    @property
+    def stale(self) -> bool:
+        """Whether the file has changed but couldn't be parsed (so the value is the last good one)"""
+        return self._failed_signature is not None
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def set_watched(self, watched: bool):
+        self._watched = watched
+
+    def get(self) -> T | None:
+        """Get the parsed contents of the file, or None if the file doesn't exist"""
+        if self._watched or not self.refresh():
+            self._hits += 1
+        return self._value
+
+    def refresh(self) -> bool:
+        """Re-read the file if it has changed. Returns whether the value changed"""
+        try:
+            signature = _get_signature(os.stat(self._path))
+        except FileNotFoundError:
+            signature = None
+        if signature == self._signature or (signature is not None and signature == self._failed_signature):
+            return False
+
+        with self._lock:
+            if signature == self._signature:
+                return False
+            if signature is None:
+                self._set(None, None)
+                return True
+            self._misses += 1
+            try:
+                with open(self._path, "rb") as f:
+                    # stat the open file so that the signature matches the content that was read
+                    signature = _get_signature(os.fstat(f.fileno()))
+                    value = self._parse(_loads(f.read()))
+            except FileNotFoundError:
+                self._set(None, None)
+                return True
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning("file-snapshot: failed to parse %s (keeping last good value): %s", self._path, e)
+                self._failed_signature = signature
+                return False
+            self._set(value, signature)
+            return True
+
+    def _set(self, value: T | None, signature: tuple | None):
+        self._value = value
+        self._signature = signature
+        self._failed_signature = None
+        self._version += 1
+
+    def invalidate(self):
+        """Force the file to be re-read on the next refresh"""
+        with self._lock:
+            self._signature = None
+            self._failed_signature = None
@@ -0,0 +1,163 @@
+from dataclasses import dataclass
+import functools
+import logging
+import os
+import threading
+
+from PIL import ImageFont
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FACE = "FiraCode-Regular"
+
+# Sizes used by the dashboard layout (the message font shrinks from 25 down to 11)
+PRELOAD_SIZES = [15, 17, 17.5, 20, 25, 30] + list(range(11, 26))
+
+
+class FontRegistry:
+    """
+    Process-wide registry of loaded fonts, keyed on face and size.
+    Loading a TrueType font means opening and parsing the file, so
+    fonts are loaded once and then shared by all of the draw_* helpers.
+    """
+
+    _font_dir: str
+    _fonts: dict[tuple[str, float], ImageFont.FreeTypeFont]
+    _lock: threading.Lock
+    _hits: int
+    _misses: int
+
+    def __init__(self, font_dir: str):
+        self._font_dir = font_dir
+        self._fonts = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def _load(self, face: str, size: float) -> ImageFont.FreeTypeFont:
+        font_path = os.path.join(self._font_dir, f"{face}.ttf")
+        return ImageFont.truetype(font_path, size)
+
+    def get(self, size: float, face: str = DEFAULT_FACE) -> ImageFont.FreeTypeFont:
+        key = (face, size)
+        # (the counters are only updated under the lock so that no increments are lost)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._hits += 1
+                return font
+            self._misses += 1
+            logger.info("fonts: loading %s (%s)", face, size)
+            font = self._load(face, size)
+            self._fonts[key] = font
+        return font
+
+    def preload(self, sizes: list[float] = PRELOAD_SIZES, face: str = DEFAULT_FACE):
+        """Load the given sizes up front (e.g. at startup) so that renders don't pay for it"""
+        with self._lock:
+            for size in sizes:
+                key = (face, size)
+                if key not in self._fonts:
+                    self._fonts[key] = self._load(face, size)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "size": len(self._fonts),
+        }
+
+
+fonts = FontRegistry(config.font_dir)
+
+
+@dataclass(frozen=True)
+class FittedText:
+    size: int
+    lines: tuple[str, ...]
+
+
+def _get_line_options(text: str, line_count: int) -> list[tuple[str, ...]]:
+    """Get the ways of splitting text into line_count lines at word boundaries"""
+    if line_count == 1:
+        return [(text,)]
+    words = text.split()
+    if len(words) < line_count:
+        return []
+    if line_count == 2:
+        return [
+            (" ".join(words[:i]), " ".join(words[i:]))
+            for i in range(1, len(words))
+        ]
+    raise ValueError("Only one or two lines are supported")
+
+
+def _get_width(lines: tuple[str, ...], font: ImageFont.FreeTypeFont) -> float:
+    return max(font.getlength(line) for line in lines)
+
+
+def _get_best_lines(options: list[tuple[str, ...]], size: int, max_width: float, face: str):
+    """Get the narrowest of the line options at size, or None if none of them fit"""
+    font = fonts.get(size, face)
+    best = min(options, key=lambda lines: _get_width(lines, font))
+    if _get_width(best, font) < max_width:
+        return best
+    return None
+
+
+@functools.lru_cache(maxsize=128)
+def fit_text(
+    text: str,
+    max_width: float,
+    max_size: int = 25,
+    min_size: int = 11,
+    max_lines: int = 2,
+    face: str = DEFAULT_FACE,
+) -> FittedText:
+    """
+    Find the largest font size (between min_size and max_size) at which text fits in max_width.
+    Wrapping onto more lines (up to max_lines) is tried before shrinking the text.
+    Uses a binary search over sizes and the result is cached per text so repeated
+    renders of the same message don't repeat the layout
+    """
+    for line_count in range(1, max_lines + 1):
+        options = _get_line_options(text, line_count)
+        if not options:
+            break
+        lines = _get_best_lines(options, max_size, max_width, face)
+        if lines:
+            return FittedText(size=max_size, lines=lines)
+
+    best = None
+    for line_count in range(1, max_lines + 1):
+        options = _get_line_options(text, line_count)
+        if not options:
+            break
+        # binary search for the largest size that fits (sizes above max_size - 1 were tried above)
+        low, high = min_size, max_size - 1
+        while low <= high:
+            size = (low + high) // 2
+            lines = _get_best_lines(options, size, max_width, face)
+            if lines:
+                if best is None or size > best.size:
+                    best = FittedText(size=size, lines=lines)
+                low = size + 1
+            else:
+                high = size - 1
+
+    if best is None:
+        # Nothing fits so use the smallest size (the text will be clipped)
+        options = _get_line_options(text, max_lines) or _get_line_options(text, 1)
+        font = fonts.get(min_size, face)
+        best = FittedText(size=min_size, lines=min(options, key=lambda lines: _get_width(lines, font)))
+    return best
@@ -0,0 +1,115 @@
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Callable
+
+from PIL import Image
+
+
+@dataclass(frozen=True)
+class ImageFormat:
+    name: str
+    media_type: str
+    encode: Callable[[Image.Image], bytes]
+    bits_per_pixel: int | None = None  # set for packed framebuffer formats
+
+
+def _encode_jpeg(image: Image.Image) -> bytes:
+    image_buf = BytesIO()
+    image.save(image_buf, "JPEG")
+    return image_buf.getvalue()
+
+
+def _encode_png(image: Image.Image) -> bytes:
+    image_buf = BytesIO()
+    image.save(image_buf, "PNG")
+    return image_buf.getvalue()
+
+
+def _grey_palette(bits: int) -> Image.Image:
+    levels = 2**bits
+    palette = []
+    for i in range(levels):
+        value = round(i * 255 / (levels - 1))
+        palette += [value, value, value]
+    palette_image = Image.new("P", (1, 1))
+    palette_image.putpalette(palette)
+    return palette_image
+
+
+def _packed_encoder(bits: int) -> Callable[[Image.Image], bytes]:
+    """
+    Create an encoder that dithers to 2**bits grey levels and packs the pixels
+    into bytes (most significant bits first, each row padded to a whole byte).
+    Pixel values run from 0 (black) to 2**bits - 1 (white)
+    """
+    if bits == 1:
+        def encode(image: Image.Image) -> bytes:
+            return image.convert("L").convert("1", dither=Image.Dither.FLOYDSTEINBERG).tobytes()
+        return encode
+
+    palette = _grey_palette(bits)
+
+    def encode(image: Image.Image) -> bytes:
+        # convert to grey first so that colours are dithered on luminance
+        grey = image.convert("L").convert("RGB")
+        quantized = grey.quantize(palette=palette, dither=Image.Dither.FLOYDSTEINBERG)
+        return quantized.tobytes("raw", f"P;{bits}")
+    return encode
+
+
+FORMATS = {
+    f.name: f
+    for f in [
+        ImageFormat("jpeg", "image/jpeg", _encode_jpeg),
+        ImageFormat("png", "image/png", _encode_png),
+        ImageFormat("1bpp", "application/vnd.home-dash.1bpp", _packed_encoder(1), bits_per_pixel=1),
+        ImageFormat("2bpp", "application/vnd.home-dash.2bpp", _packed_encoder(2), bits_per_pixel=2),
+        ImageFormat("4bpp", "application/vnd.home-dash.4bpp", _packed_encoder(4), bits_per_pixel=4),
+    ]
+}
+DEFAULT_FORMAT = FORMATS["jpeg"]
+
+
+_FORMATS_BY_MEDIA_TYPE = {f.media_type: f for f in FORMATS.values()}
+
+
+def _parse_accept(accept: str) -> list[str]:
+    """
+    Get the media types from an Accept header in order of preference: highest q-value first
+    and then in the order they are listed. Ranges with q=0 (or an invalid q-value) are left out
+    """
+    media_types = []
+    for media_range in accept.split(","):
+        media_type, *parameters = media_range.split(";")
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            media_types.append((quality, media_type.strip().lower()))
+    # (sorted is stable so types with the same q-value keep their order)
+    return [media_type for _, media_type in sorted(media_types, key=lambda item: -item[0])]
+
+
+def get_image_format(
+    format_name: str | None, accept: str | None, default: ImageFormat = DEFAULT_FORMAT
+) -> ImageFormat | None:
+    """
+    Pick the output format from the format query parameter, falling back to the most preferred
+    format in the Accept header (by q-value) and then to default (e.g. for */*).
+    Returns None if an unknown format was explicitly requested
+    """
+    if format_name:
+        return FORMATS.get(format_name.lower())
+
+    if accept:
+        for media_type in _parse_accept(accept):
+            image_format = _FORMATS_BY_MEDIA_TYPE.get(media_type)
+            if image_format is not None:
+                return image_format
+
+    return default
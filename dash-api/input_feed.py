@@ -0,0 +1,139 @@
+"""
+Change feed for the dashboard input files.
+
+The input folders are watched with inotify (via watchfiles, which falls back to
+polling where inotify isn't available, e.g. set WATCHFILES_FORCE_POLLING=1 for
+network filesystems) and changed files are re-parsed into their JsonFileSnapshot
+as they are written. Request handlers then read the parsed data without any
+filesystem I/O, and the feed's version number gives an O(1) "has anything
+changed since version N" check.
+If watchfiles isn't installed then the files are polled every poll_interval.
+"""
+
+import logging
+import os
+import threading
+
+from . import config
+from .file_snapshot import JsonFileSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class InputFeed:
+    _snapshots: dict[str, JsonFileSnapshot]
+    _poll_interval: float
+    _version: int
+    _changed: threading.Condition
+    _thread: threading.Thread | None
+    _stop: threading.Event
+
+    def __init__(self, poll_interval: float):
+        self._snapshots = {}
+        self._poll_interval = poll_interval
+        self._version = 0
+        self._changed = threading.Condition()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def version(self) -> int:
+        """Incremented each time any of the input files change"""
+        return self._version
+
+    def changed_since(self, version: int) -> bool:
+        return self._version != version
+
+    def register[T](self, snapshot: JsonFileSnapshot[T]) -> JsonFileSnapshot[T]:
+        """Add a file to the feed (returns snapshot for convenience)"""
+        self._snapshots[os.path.abspath(snapshot.path)] = snapshot
+        return snapshot
+
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        """Wait until the version is no longer version (or the timeout expires) and return the current version"""
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version, timeout=timeout)
+            return self._version
+
+    def refresh(self, snapshots) -> bool:
+        """Re-read any of snapshots that have changed. Returns whether anything changed"""
+        changed = False
+        for snapshot in snapshots:
+            try:
+                if snapshot.refresh():
+                    logger.info("input-feed: %s changed (version %d)", snapshot.path, snapshot.version)
+                    changed = True
+            except Exception:
+                logger.exception("input-feed: failed to refresh %s", snapshot.path)
+        if changed:
+            self.notify()
+        return changed
+
+    def notify(self):
+        """Record a change to an input that isn't a watched file (e.g. a message written to the database)"""
+        with self._changed:
+            self._version += 1
+            self._changed.notify_all()
+
+    def refresh_all(self) -> bool:
+        """Re-read any changed files. Returns whether anything changed"""
+        return self.refresh(list(self._snapshots.values()))
+
+    def _watch(self):
+        from watchfiles import watch
+
+        folders = sorted({os.path.dirname(path) for path in self._snapshots})
+        folders = [folder for folder in folders if os.path.isdir(folder)]
+        logger.info("input-feed: watching %s", folders)
+        # yield_on_timeout gives an empty set of changes every poll_interval, which is used
+        # as a safety net to pick up any changes that the watcher missed
+        for changes in watch(
+            *folders,
+            stop_event=self._stop,
+            # the input files are at the top level (e.g. ignore the temperature history folder)
+            recursive=False,
+            rust_timeout=int(self._poll_interval * 1000),
+            yield_on_timeout=True,
+        ):
+            if not changes:
+                self.refresh_all()
+                continue
+            # Files are usually replaced via a rename so the snapshot is matched on the path
+            changed_paths = {os.path.abspath(path) for _, path in changes}
+            self.refresh(
+                snapshot for path, snapshot in self._snapshots.items() if path in changed_paths
+            )
+
+    def _poll(self):
+        logger.info("input-feed: polling every %ss", self._poll_interval)
+        while not self._stop.wait(self._poll_interval):
+            self.refresh_all()
+
+    def _run(self):
+        try:
+            self._watch()
+        except ImportError:
+            logger.warning("input-feed: watchfiles is not installed, falling back to polling")
+            self._poll()
+        except Exception:
+            logger.exception("input-feed: watcher failed, falling back to polling")
+            self._poll()
+        finally:
+            for snapshot in self._snapshots.values():
+                snapshot.set_watched(False)
+
+    def start(self):
+        """Load the files and start watching for changes"""
+        if self._thread is not None:
+            return
+        self.refresh_all()
+        for snapshot in self._snapshots.values():
+            snapshot.set_watched(True)
+        self._thread = threading.Thread(target=self._run, name="input-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+input_feed = InputFeed(poll_interval=config.input_poll_interval)
@@ -0,0 +1,100 @@
+import copy
+from dataclasses import dataclass
+import logging
+import threading
+from typing import Any, Callable
+
+from PIL import Image, ImageDraw
+
+from .telemetry import stage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Tile:
+    """
+    A region of the frame that is rendered independently.
+    key extracts the slice of the data that the tile depends on and
+    draw renders that slice onto an image the size of the box
+    (i.e. draw uses coordinates relative to the top-left of the tile)
+    """
+
+    name: str
+    box: tuple[int, int, int, int]
+    key: Callable[[Any], Any]
+    draw: Callable[[Image.Image, ImageDraw.ImageDraw, Any], None]
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return (self.box[2] - self.box[0], self.box[3] - self.box[1])
+
+
+class _RenderedLayer:
+    key: Any
+    image: Image.Image
+
+    def __init__(self, key: Any, image: Image.Image):
+        self.key = key
+        self.image = image
+
+
+class LayeredRenderer:
+    """
+    Renders a frame from an opaque background layer plus transparent tiles.
+    Each layer is only re-rendered when the slice of the data it depends on changes;
+    the cached layers are then composited to produce the frame.
+    """
+
+    _size: tuple[int, int]
+    _background: Tile
+    _tiles: list[Tile]
+    _layers: dict[str, _RenderedLayer]
+    _lock: threading.Lock
+
+    def __init__(self, size: tuple[int, int], background: Tile, tiles: list[Tile]):
+        self._size = size
+        self._background = background
+        self._tiles = tiles
+        self._layers = {}
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self._size
+
+    @property
+    def tiles(self) -> list[Tile]:
+        """All of the tiles, starting with the background"""
+        return [self._background] + self._tiles
+
+    def _get_layer(self, tile: Tile, data, color) -> Image.Image:
+        key = tile.key(data)
+        layer = self._layers.get(tile.name)
+        if layer is not None and layer.key == key:
+            return layer.image
+
+        logger.debug("layers: rendering %s", tile.name)
+        with stage("render-tile", tile=tile.name):
+            image = Image.new(mode="RGBA", size=tile.size, color=color)
+            tile.draw(image, ImageDraw.Draw(image), key)
+        # copy the key so that later changes to the data objects can't mask a change
+        self._layers[tile.name] = _RenderedLayer(copy.deepcopy(key), image)
+        return image
+
+    def render(self, data) -> Image.Image:
+        """Render the frame for data, returning an RGB image"""
+        with self._lock:
+            background = self._get_layer(self._background, data, (255, 255, 255, 255))
+            layers = [self._get_layer(tile, data, (0, 0, 0, 0)) for tile in self._tiles]
+
+        with stage("composite"):
+            frame = background.copy()
+            for tile, layer in zip(self._tiles, layers):
+                frame.alpha_composite(layer, dest=tile.box[:2])
+            # the background is opaque, so this just drops the alpha channel
+            return frame.convert("RGB")
+
+    def invalidate(self):
+        with self._lock:
+            self._layers.clear()
@@ -0,0 +1,283 @@
+"""
+Declarative dashboard layouts.
+
+A Layout describes a device profile (resolution, colour depth, rotation) and
+the elements to draw, grouped into regions. compile_layout turns a Layout into
+a CompiledLayout: a display list of positioned draw operations per region with
+fonts resolved, backed by a LayeredRenderer (one tile per region) and its own
+image cache.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from PIL import Image, ImageDraw, ImageFont
+
+from .assets import icons
+from .cache import LruCache
+from .fonts import fit_text, fonts
+from .layers import LayeredRenderer, Tile
+
+# Text values are either format strings (formatted with the region's value, and skipped
+# if a field is None) or functions that return the text (or None to skip the element)
+TextValue = str | Callable[[Any], str | None]
+
+
+@dataclass(frozen=True)
+class Text:
+    xy: tuple[float, float]
+    size: float
+    text: TextValue
+    align: str = "left"  # left, centre or right (xy is the left, centre or right of the text)
+
+
+@dataclass(frozen=True)
+class Icon:
+    xy: tuple[int, int]
+    size: tuple[int, int]
+    path: Callable[[Any], str]
+    brightness: float = 1.0
+    # icons that are known up front (e.g. the leaf status icons) and can be loaded by CompiledLayout.preload
+    preload: tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class Line:
+    points: tuple[int, int, int, int]
+
+
+@dataclass(frozen=True)
+class FittedText:
+    """Text that is wrapped/shrunk to fit max_width, centred on centre_x with the last line at bottom_y"""
+    centre_x: float
+    bottom_y: float
+    max_width: float
+    max_size: int = 25
+    min_size: int = 11
+    max_lines: int = 2
+
+
+Element = Text | Icon | Line | FittedText
+
+
+@dataclass(frozen=True)
+class Region:
+    """
+    A group of elements drawn on their own tile.
+    value extracts the slice of the data that the region depends on
+    and element positions are relative to the top-left of box.
+    Regions whose value is None are left blank
+    """
+    name: str
+    box: tuple[int, int, int, int]
+    value: Callable[[Any], Any]
+    elements: list[Element]
+
+
+@dataclass(frozen=True)
+class Layout:
+    name: str
+    size: tuple[int, int]
+    # static elements (value is passed to the element functions)
+    background: list[Element]
+    background_value: Callable[[Any], Any]
+    regions: list[Region]
+    # bits per pixel of the panel: colour panels get JPEG, greyscale panels (1, 2 or 4) a packed framebuffer
+    colour_depth: int = 24
+    # clockwise rotation (0, 90, 180 or 270) applied to the rendered frame to match how the panel is mounted
+    rotation: int = 0
+    fill: tuple[int, int, int] = (0, 0, 0)
+
+
+class _MissingField(Exception):
+    pass
+
+
+class _Fields:
+    """Mapping for str.format_map that reads attributes (so works with slotted classes)"""
+
+    def __init__(self, value):
+        self._value = value
+
+    def __getitem__(self, key):
+        field = getattr(self._value, key)
+        if field is None:
+            raise _MissingField(key)
+        return field
+
+
+def _get_text(text: TextValue, value) -> str | None:
+    if callable(text):
+        return text(value)
+    try:
+        return text.format_map(_Fields(value))
+    except _MissingField:
+        return None
+
+
+# Compiled draw operations
+
+class _TextOp:
+    def __init__(self, element: Text, font: ImageFont.FreeTypeFont, fill):
+        self._x, self._y = element.xy
+        self._text = element.text
+        self._align = element.align
+        self._font = font
+        self._fill = fill
+
+    def execute(self, image: Image.Image, draw: ImageDraw.ImageDraw, value):
+        text = _get_text(self._text, value)
+        if text is None:
+            return
+        x = self._x
+        if self._align == "centre":
+            x = x - draw.textlength(text, font=self._font) / 2
+        elif self._align == "right":
+            x = x - draw.textlength(text, font=self._font)
+        draw.text((x, self._y), text, fill=self._fill, font=self._font)
+
+
+class _IconOp:
+    def __init__(self, element: Icon):
+        self._element = element
+
+    def preload(self):
+        element = self._element
+        for path in element.preload:
+            icons.get(path, element.size, brightness=element.brightness)
+
+    def execute(self, image: Image.Image, draw: ImageDraw.ImageDraw, value):
+        element = self._element
+        icon = icons.get(element.path(value), element.size, brightness=element.brightness)
+        image.paste(icon, box=element.xy)
+
+
+class _LineOp:
+    def __init__(self, element: Line, fill):
+        self._points = element.points
+        self._fill = fill
+
+    def execute(self, image: Image.Image, draw: ImageDraw.ImageDraw, value):
+        draw.line(self._points, fill=self._fill)
+
+
+class _FittedTextOp:
+    def __init__(self, element: FittedText, fill):
+        self._element = element
+        self._fonts = {
+            size: fonts.get(size) for size in range(element.min_size, element.max_size + 1)
+        }
+        self._fill = fill
+
+    def execute(self, image: Image.Image, draw: ImageDraw.ImageDraw, value: str):
+        element = self._element
+        fitted = fit_text(value, element.max_width, element.max_size, element.min_size, element.max_lines)
+        font = self._fonts[fitted.size]
+
+        # the last line is drawn at bottom_y and earlier lines above it
+        line_height = round(fitted.size * 1.2)
+        y = element.bottom_y - line_height * (len(fitted.lines) - 1)
+        for line in fitted.lines:
+            x = element.centre_x - draw.textlength(line, font=font) / 2
+            draw.text((x, y), line, fill=self._fill, font=font)
+            y += line_height
+
+
+def _compile_element(element: Element, fill):
+    if isinstance(element, Text):
+        return _TextOp(element, fonts.get(element.size), fill)
+    if isinstance(element, Icon):
+        return _IconOp(element)
+    if isinstance(element, Line):
+        return _LineOp(element, fill)
+    if isinstance(element, FittedText):
+        return _FittedTextOp(element, fill)
+    raise ValueError(f"Unknown layout element: {element}")
+
+
+def _compile_tile(name: str, box, value: Callable, ops: list, skip_none: bool) -> Tile:
+
+    def draw(image: Image.Image, image_draw: ImageDraw.ImageDraw, region_value):
+        if region_value is None and skip_none:
+            return
+        for op in ops:
+            op.execute(image, image_draw, region_value)
+
+    return Tile(name=name, box=box, key=value, draw=draw)
+
+
+# the bits per pixel of the packed framebuffer formats (see formats.py)
+_PACKED_DEPTHS = (1, 2, 4)
+
+_TRANSPOSES = {
+    90: Image.Transpose.ROTATE_270,  # transpose rotates anti-clockwise
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_90,
+}
+
+
+class CompiledLayout:
+    """A layout compiled to display lists, with a renderer and image cache per profile"""
+
+    def __init__(self, layout: Layout):
+        if layout.rotation not in (0, 90, 180, 270):
+            raise ValueError(f"Invalid rotation for layout {layout.name}: {layout.rotation}")
+        if layout.colour_depth <= 4 and layout.colour_depth not in _PACKED_DEPTHS:
+            raise ValueError(
+                f"Invalid colour depth for layout {layout.name}: {layout.colour_depth} "
+                f"(greyscale panels must be {', '.join(map(str, _PACKED_DEPTHS))} bits per pixel)")
+        self.layout = layout
+        background_ops = [_compile_element(element, layout.fill) for element in layout.background]
+        region_ops = [
+            [_compile_element(element, layout.fill) for element in region.elements]
+            for region in layout.regions
+        ]
+        self._icon_ops = [
+            op for ops in [background_ops, *region_ops] for op in ops if isinstance(op, _IconOp)
+        ]
+        self.renderer = LayeredRenderer(
+            size=layout.size,
+            background=_compile_tile(
+                "background", (0, 0, *layout.size), layout.background_value, background_ops, skip_none=False),
+            tiles=[
+                _compile_tile(region.name, region.box, region.value, ops, skip_none=True)
+                for region, ops in zip(layout.regions, region_ops)
+            ],
+        )
+        # Encoded images for this profile keyed on the data hash and format
+        self.image_cache = LruCache(
+            max_entries=32, max_bytes=16 * 1024 * 1024, size_of=lambda image: len(image.content),
+            name=f"images-{layout.name}")
+
+    @property
+    def name(self) -> str:
+        return self.layout.name
+
+    @property
+    def output_size(self) -> tuple[int, int]:
+        """The size of the rendered frame (after rotation)"""
+        width, height = self.layout.size
+        if self.layout.rotation in (90, 270):
+            return (height, width)
+        return (width, height)
+
+    @property
+    def default_format(self) -> str:
+        depth = self.layout.colour_depth
+        return f"{depth}bpp" if depth in _PACKED_DEPTHS else "jpeg"
+
+    def preload(self):
+        """Load the icons that are known up front into the icon cache"""
+        for op in self._icon_ops:
+            op.preload()
+
+    def render(self, data) -> Image.Image:
+        """Render the frame (RGB) for data"""
+        frame = self.renderer.render(data)
+        if self.layout.rotation:
+            frame = frame.transpose(_TRANSPOSES[self.layout.rotation])
+        return frame
+
+
+def compile_layout(layout: Layout) -> CompiledLayout:
+    return CompiledLayout(layout)
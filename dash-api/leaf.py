@@ -1,15 +1,17 @@
 from dataclasses import dataclass
-import json
 import os
 
 from . import config
+from .file_snapshot import JsonFileSnapshot
+from .input_feed import input_feed
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class LeafData:
     is_plugged_in: bool
     is_charging: bool
-    cruising_range_ac_off_miles: float
-    cruising_range_ac_on_miles: float
+    # the ranges are None when the car didn't report them (e.g. while it is asleep)
+    cruising_range_ac_off_miles: float | None
+    cruising_range_ac_on_miles: float | None
     icon_path: str
 
 
@@ -19,16 +21,12 @@ LEAF_ICON_CHARGING = "charging.png"
 
 def get_leaf_summary():
     # Get the leaf summary content from leaf-summary.json
-    leaf_summary_file = os.path.join(config.dashboard_input_dir, "leaf-summary.json")
-
-    if not os.path.isfile(leaf_summary_file):
+    leaf_summary = leaf_summary_snapshot.get()
+    if leaf_summary is None:
         print("ERROR: leaf-summary.json does not exist")
         return {"error": "leaf-summary.json does not exist"}
 
-    with open(leaf_summary_file) as f:
-        leaf_summary = json.load(f)
-
-    return leaf_summary
+    return leaf_summary.summary
 
 def get_leaf_icon(plugged_in: bool, charging: bool):
     if plugged_in:
@@ -38,18 +36,46 @@ def get_leaf_icon(plugged_in: bool, charging: bool):
     return LEAF_ICON_NOT_PLUGGED_IN
 
 
-def get_leaf_data():
-    leaf_summary = get_leaf_summary()
+def _decode_range(leaf_summary: dict, key: str) -> float | None:
+    value = leaf_summary.get(key)
+    return float(value) if value is not None else None
 
+
+def _decode_leaf_data(leaf_summary: dict) -> LeafData:
     plugged_in = leaf_summary["is_connected"]
+    if not isinstance(plugged_in, bool):
+        raise TypeError(f"Expected a bool for is_connected: {plugged_in!r}")
     charging = leaf_summary["charging_status"] != "NOT_CHARGING"
     leaf_icon = get_leaf_icon(plugged_in, charging)
     leaf_data = LeafData(
-        cruising_range_ac_off_miles=leaf_summary["cruising_range_ac_off_miles"],
-        cruising_range_ac_on_miles=leaf_summary["cruising_range_ac_on_miles"],
+        cruising_range_ac_off_miles=_decode_range(leaf_summary, "cruising_range_ac_off_miles"),
+        cruising_range_ac_on_miles=_decode_range(leaf_summary, "cruising_range_ac_on_miles"),
         is_plugged_in=plugged_in,
         is_charging=charging,
         icon_path=os.path.join(config.leaf_image_dir, leaf_icon),
     )
 
     return leaf_data
+
+
+@dataclass(frozen=True, slots=True)
+class LeafSummary:
+    summary: dict  # as returned by /leaf
+    data: LeafData
+
+
+def _parse_leaf_summary(leaf_summary: dict) -> LeafSummary:
+    return LeafSummary(summary=leaf_summary, data=_decode_leaf_data(leaf_summary))
+
+
+leaf_summary_snapshot = input_feed.register(JsonFileSnapshot[LeafSummary](
+    os.path.join(config.dashboard_input_dir, "leaf-summary.json"), parse=_parse_leaf_summary))
+
+
+def get_leaf_data() -> LeafData | None:
+    leaf_summary = leaf_summary_snapshot.get()
+    if leaf_summary is None:
+        print("ERROR: leaf-summary.json does not exist")
+        return None
+
+    return leaf_summary.data
@@ -1,16 +1,18 @@
+import base64
 from dataclasses import asdict
 import json
-from datetime import date, datetime, timedelta, timezone
+from datetime import date, datetime
 import logging
 import os
 import pathlib
 import sys
 import trace
 
-from azure.monitor.opentelemetry import configure_azure_monitor
-from fastapi import FastAPI, Request, Response
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from opentelemetry import metrics, trace
+from opentelemetry.metrics import CallbackOptions, Observation
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from opentelemetry.trace import (
     get_tracer_provider,
@@ -24,11 +26,21 @@ parent_path = pathlib.Path(__file__).parent
 __package__ = parent_path.name
 sys.path.append(str(parent_path.absolute().parent))
 
-from .cache import Cache
-from .dashboard import generate_dashboard_image, get_dashboard_data, get_image_hash, DashboardData
+from .change_policy import DEFAULT_POLICY, compile_policy
+from .dashboard import get_dashboard_data, get_frame, DashboardData
+from .diff import diff_since, encode_patch, frame_cache
+from .etag_store import etag_store
+from .fonts import fonts
+from .formats import FORMATS, get_image_format
+from .input_feed import input_feed
 from .leaf import get_leaf_summary
-from .messages import get_message, set_message
-from .temperature import get_all_temperature_data, update_temperature_data
+from .messages import import_messages, message_store, set_message
+from .prerender import prerenderer
+from .profiles import DEFAULT_PROFILE, get_profile
+from .render_pool import render_pool
+from .telemetry import configure_telemetry, stage
+from .temperature import get_all_temperature_data, temperature_store, update_temperature_data
+from .temperature_history import STEPS, choose_step, temperature_history
 from . import config
 
 
@@ -39,14 +51,7 @@ logging.basicConfig(
     # level=logging.DEBUG,
     # format="HOME_DASH:%(asctime)s:%(levelname)s: %(message)s",
 )
-if config.app_insights_connection_string:
-    print("Configuring Azure Monitor")
-    print(f"Connection string: {config.app_insights_connection_string}")
-    configure_azure_monitor(
-        connection_string=config.app_insights_connection_string,
-    )
-else:
-    print("No Azure Monitor configuration found")
+configure_telemetry()
 
 tracer = trace.get_tracer(__name__,
                           tracer_provider=get_tracer_provider())
@@ -56,6 +61,7 @@ logger = logging.getLogger(__name__)
 logging.getLogger("azure.core.pipeline.policies").setLevel(logging.ERROR)
 logging.getLogger(
     "azure.monitor.opentelemetry.exporter.export").setLevel(logging.ERROR)
+logging.getLogger("watchfiles.main").setLevel(logging.WARNING)
 # print(json.dumps([name for name in logging.root.manager.loggerDict])) # handy to list loggers :-)
 
 
@@ -63,6 +69,9 @@ meter = metrics.get_meter_provider().get_meter("dash-api")
 histogram_dashboard_image_requests = meter.create_histogram(
     "dashboard-image-requests", "count", "Number of dashboard image requests"
 )
+counter_dashboard_image_responses = meter.create_counter(
+    "dashboard-image-responses", "count", "Dashboard image responses by status and the cache rule that decided them"
+)
 
 if not config.dashboard_input_dir:
     logger.error("ERROR: DASHBOARD_INPUT_DIR not set")
@@ -71,15 +80,60 @@ if not os.path.isdir(config.dashboard_input_dir):
     logger.error("ERROR: DASHBOARD_INPUT_DIR does not exist")
     sys.exit(1)
 
+# Load the fonts up front so that the first render doesn't pay for it
+fonts.preload()
+logger.info("Preloaded fonts: %s", fonts.stats())
+
+
+def _observe_font_hits(options: CallbackOptions):
+    yield Observation(fonts.hits)
+
+
+def _observe_font_misses(options: CallbackOptions):
+    yield Observation(fonts.misses)
+
+
+meter.create_observable_counter(
+    "font-registry-hits", [_observe_font_hits], "count", "Number of font lookups served from the registry"
+)
+meter.create_observable_counter(
+    "font-registry-misses", [_observe_font_misses], "count", "Number of font lookups that loaded a font file"
+)
+
+
+def _observe_render_queue_depth(options: CallbackOptions):
+    yield Observation(render_pool.queue_depth)
+
+
+def _observe_render_utilisation(options: CallbackOptions):
+    yield Observation(render_pool.utilisation)
+
+
+meter.create_observable_gauge(
+    "render-pool-queue-depth", [_observe_render_queue_depth], "count", "Number of renders waiting for a worker process"
+)
+meter.create_observable_gauge(
+    "render-pool-utilisation", [_observe_render_utilisation], "1", "Fraction of the render worker processes that are busy"
+)
+
+# Load the input files and watch them for changes so that requests don't need to touch the filesystem
+input_feed.start()
+# Write the temperature updates in the background
+temperature_store.start()
+
+# Start the render workers before the prerenderer as it renders via the pool
+render_pool.start()
+prerenderer.start()
+
 app = FastAPI()
 
 
-# We will cache the data here using the ETag header as the cache key
+# We cache the data in etag_store using the ETag header as the cache key
 # This allows multiple clients to request data and we can retrieve the
 # data from the cache for that request (unless expired) and use that
 # to decide whether the current data is sufficiently different to
 # generate a new image
-data_cache = Cache[DashboardData](ttl=10*60)
+# (the store is shared by the workers and survives restarts, see etag_store.py)
 
 
 @app.get("/")
@@ -92,55 +146,60 @@ def leaf_summary():
     return get_leaf_summary()
 
 
-def _reuse_cached_data(cached_data: DashboardData, current_data: DashboardData) -> bool:
+# The rules for when a device's image needs replacing (see change_policy.py)
+_check_cached_data = compile_policy(DEFAULT_POLICY)
 
-    print("cached_data", json.dumps(asdict(cached_data), default=str))
-    print("current_data", json.dumps(asdict(current_data), default=str))
+
+def _reuse_cached_data(cached_data: DashboardData, current_data: DashboardData) -> tuple[bool, str]:
+    """
+    Decide whether the client's image (cached_data) is still good enough.
+    Returns whether to reuse it along with the name of the rule that decided it
+    """
     if cached_data is None:
         logger.info("dashboard-image-cache: No cached data")
-        return False
-
-    if datetime.now(timezone.utc) - cached_data.generated_date > timedelta(minutes=30):
-        # The cached data is too old, so we need to generate a new image
-        logger.info("dashboard-image-cache: Cached data is too old")
-        return False
-
-    # Update if charge state etc have changed
-    if cached_data.leaf.is_charging != current_data.leaf.is_charging:
-        logger.info("dashboard-image-cache: Leaf charging state has changed")
-        return False
-    if cached_data.leaf.is_plugged_in != current_data.leaf.is_plugged_in:
-        logger.info("dashboard-image-cache: Leaf plugged in state has changed")
-        return False
-
-    if cached_data.leaf.cruising_range_ac_off_miles - current_data.leaf.cruising_range_ac_off_miles > 3:
-        logger.info("dashboard-image-cache: Leaf range has changed")
-        return False
-
-    # Update if the message has changed
-    if cached_data.message != current_data.message:
-        logger.info("dashboard-image-cache: Message has changed")
-        return False
-
-    if cached_data.pistat0.temperature - current_data.pistat0.temperature > 0.5:
-        logger.info("dashboard-image-cache: Temperature has changed")
-        return False
-
-    if cached_data.pistat0.humidity - current_data.pistat0.humidity > 2:
-        logger.info("dashboard-image-cache: Humidity has changed")
-        return False
+        return False, "no-cached-data"
+
+    rule = _check_cached_data(cached_data, current_data)
+    if rule is not None:
+        logger.info("dashboard-image-cache: Changed (%s)", rule)
+        return False, rule
 
     logger.info("dashboard-image-cache: Using cached data")
-    return True
+    return True, "unchanged"
+
+
+def _get_mins_to_sleep() -> int:
+    now = datetime.now()
+    current_hour = now.hour
+    mins_to_sleep = 5
+    if current_hour < 6 or current_hour > 22:
+        # sleep until 6am
+        mins_to_sleep = (6 - current_hour) * 60
+        if mins_to_sleep < 0:
+            mins_to_sleep += 24 * 60
+    return mins_to_sleep
 
 
 @app.get("/dashboard-image")
-def get_dashboard_image(request: Request):
+async def get_dashboard_image(request: Request, format: str | None = None, profile: str | None = None):
 
     current_span = trace.get_current_span()
     if (current_span is not None) and (not current_span.is_recording()):
         current_span = None  # set to None for simple test later
 
+    device_profile = get_profile(profile)
+    if device_profile is None:
+        return Response(status_code=400, content="Invalid profile")
+
+    # The output format can be set via the format query parameter or the Accept header
+    image_format = get_image_format(
+        format, request.headers.get("Accept", None), default=FORMATS[device_profile.default_format])
+    if image_format is None:
+        return Response(status_code=400, content="Invalid image format")
+    if current_span:
+        current_span.set_attribute("profile", device_profile.name)
+        current_span.set_attribute("image-format", image_format.name)
+
     action_id = request.headers.get("action-id", None)
     if action_id:
         logger.info(f"dashboard-image: Action ID: {action_id}")
@@ -152,53 +211,147 @@ def get_dashboard_image(request: Request):
         logger.info(
             f"dashboard-image: Got IfNoneMatch: '{if_none_match_value}'")
 
-    dashboard_data = get_dashboard_data()
+    # Use the pre-rendered snapshot if it is fresh, otherwise fall back to rendering on demand
+    snapshot = prerenderer.get_snapshot()
+    if snapshot:
+        dashboard_data = snapshot.data
+    else:
+        logger.info("dashboard-image: No pre-rendered snapshot")
+        dashboard_data = await run_in_threadpool(get_dashboard_data)
     logger.debug("dashboard-image: data: %s", dashboard_data)
+    if current_span:
+        current_span.set_attribute("prerendered", snapshot is not None)
 
-    now = datetime.now()
-    current_hour = now.hour
-    mins_to_sleep = 5
-    if current_hour < 6 or current_hour > 22:
-        # sleep until 6am
-        mins_to_sleep = (6 - current_hour) * 60
-        if mins_to_sleep < 0:
-            mins_to_sleep += 24 * 60
+    mins_to_sleep = _get_mins_to_sleep()
     logger.info(f"dashboard-image: Mins to sleep: {mins_to_sleep}")
     if current_span:
         current_span.set_attribute("mins-to-sleep", mins_to_sleep)
 
-    if not action_id and if_none_match_value:
+    if action_id:
+        cache_rule = "action"
+    elif not if_none_match_value:
+        cache_rule = "no-etag"
+    else:
         # Don't cache if we have an action id
         # or if the caller didn't send an If-None-Match header (i.e. they're not trying to cache)
 
         # Get the cached data
-        cached_data = data_cache.get(if_none_match_value)
+        cached_data = await run_in_threadpool(etag_store.get, if_none_match_value)
+        cache_rule = "unknown-etag"
         if cached_data:
             logger.info(
                 f"dashboard-image: Got cached data for {if_none_match_value}")
-            if _reuse_cached_data(cached_data, dashboard_data):
+            with stage("check-cached-data"):
+                reuse, cache_rule = _reuse_cached_data(cached_data, dashboard_data)
+            if reuse:
                 histogram_dashboard_image_requests.record(
                     1, {"status": "304",
                         "user-agent": request.headers.get("User-Agent")}
                 )
+                counter_dashboard_image_responses.add(1, {"status": "304", "rule": cache_rule})
                 return Response(
                     status_code=304, headers={"mins-to-sleep": str(mins_to_sleep)}
                 )
-
-    image_buf = generate_dashboard_image(dashboard_data)
-    image_hash = get_image_hash(image_buf)
+    if current_span:
+        current_span.set_attribute("cache-rule", cache_rule)
+
+    if snapshot and device_profile is DEFAULT_PROFILE and image_format.name == DEFAULT_PROFILE.default_format:
+        rendered_image = snapshot.image
+    else:
+        # render in a worker process so that concurrent renders use all of the cores
+        rendered_image = await render_pool.render(dashboard_data, device_profile, image_format)
+    image_hash = rendered_image.etag
     logger.info(f"dashboard-image: Image hash: {image_hash}")
     if current_span:
         current_span.set_attribute("image-hash", image_hash)
 
-    data_cache.set(str(image_hash), dashboard_data)
+    # (the render pool caches the frame for /dashboard-image-diff)
+    await run_in_threadpool(etag_store.set, str(image_hash), dashboard_data)
 
     histogram_dashboard_image_requests.record(
         1, {"status": "200", "user-agent": request.headers.get("User-Agent")}
     )
-    return StreamingResponse(
-        image_buf,
-        media_type="image/jpeg",
+    counter_dashboard_image_responses.add(1, {"status": "200", "rule": cache_rule})
+    headers = {
+        "ETag": str(image_hash),
+        "Vary": "Accept",
+        "mins-to-sleep": str(mins_to_sleep),
+        "actions": json.dumps([a.id for a in dashboard_data.actions]),
+    }
+    if image_format.bits_per_pixel:
+        # packed framebuffer - the client needs the dimensions to interpret it
+        headers["image-width"] = str(device_profile.output_size[0])
+        headers["image-height"] = str(device_profile.output_size[1])
+        headers["bits-per-pixel"] = str(image_format.bits_per_pixel)
+    return Response(
+        rendered_image.content,
+        media_type=image_format.media_type,
+        headers=headers,
+    )
+
+
+@app.get("/dashboard-image-diff")
+def get_dashboard_image_diff(request: Request, profile: str | None = None):
+    """
+    Get the changes since the image identified by If-None-Match as a list of patches
+    (PNG images with their position) so that the client can do a partial refresh.
+    Returns 304 if too few pixels have changed to be worth refreshing
+    """
+    current_span = trace.get_current_span()
+    if (current_span is not None) and (not current_span.is_recording()):
+        current_span = None  # set to None for simple test later
+
+    device_profile = get_profile(profile)
+    if device_profile is None:
+        return Response(status_code=400, content="Invalid profile")
+
+    if_none_match_value = request.headers.get("If-None-Match", None)
+
+    snapshot = prerenderer.get_snapshot()
+    dashboard_data = snapshot.data if snapshot else get_dashboard_data()
+    mins_to_sleep = _get_mins_to_sleep()
+
+    rendered_image = render_pool.render_sync(
+        dashboard_data, device_profile, FORMATS[device_profile.default_format])
+    image_hash = rendered_image.etag
+    frame = frame_cache.get(image_hash)
+    if frame is None:
+        # the frame has been evicted from the cache since the image was rendered
+        frame = get_frame(dashboard_data, device_profile)
+
+    frame_diff = diff_since(if_none_match_value, image_hash, frame, pixel_threshold=config.diff_pixel_threshold)
+    changed_fraction = frame_diff.changed_fraction
+    boxes = frame_diff.boxes
+    logger.info(f"dashboard-image-diff: Changed fraction: {changed_fraction}")
+    if current_span:
+        current_span.set_attribute("changed-fraction", changed_fraction)
+
+    if changed_fraction < config.diff_changed_fraction_threshold:
+        histogram_dashboard_image_requests.record(
+            1, {"status": "304", "user-agent": request.headers.get("User-Agent"), "endpoint": "dashboard-image-diff"}
+        )
+        return Response(
+            status_code=304, headers={"mins-to-sleep": str(mins_to_sleep)}
+        )
+
+    etag_store.set(str(image_hash), dashboard_data)
+    frame_cache.set(str(image_hash), frame)
+
+    histogram_dashboard_image_requests.record(
+        1, {"status": "200", "user-agent": request.headers.get("User-Agent"), "endpoint": "dashboard-image-diff"}
+    )
+    patches = [
+        {
+            "x": box[0],
+            "y": box[1],
+            "width": box[2] - box[0],
+            "height": box[3] - box[1],
+            "image": base64.b64encode(encode_patch(frame, box)).decode("ascii"),
+        }
+        for box in boxes
+    ]
+    return JSONResponse(
+        {"width": frame.width, "height": frame.height, "patches": patches},
         headers={
             "ETag": str(image_hash),
             "mins-to-sleep": str(mins_to_sleep),
@@ -207,6 +360,17 @@ def get_dashboard_image(request: Request):
     )
 
 
+@app.get("/messages")
+def api_get_messages(from_date: str | None = Query(None, alias="from"), to_date: str | None = Query(None, alias="to")):
+    try:
+        from_date = date.fromisoformat(from_date) if from_date else None
+        to_date = date.fromisoformat(to_date) if to_date else None
+    except ValueError:
+        return Response(status_code=400, content="Invalid date format")
+
+    return {"messages": message_store.get_range(from_date, to_date)}
+
+
 @app.get("/messages/{date_value}")
 def api_get_message(date_value: str):
     try:
@@ -214,7 +378,7 @@ def api_get_message(date_value: str):
     except ValueError:
         return Response(status_code=400, content="Invalid date format")
 
-    message = get_message(date_value=date_value)
+    message = message_store.get(date_value)
     if message is None:
         return Response(status_code=404, content="No message found")
     return {"message": message}
@@ -230,6 +394,21 @@ def api_set_message(date_value: str, data: MessageSetRequest):
     return {"status": "ok"}
 
 
+class MessageImportRequest(BaseModel):
+    messages: dict[str, str]  # keyed on the date (YYYY-MM-DD)
+
+
+@app.post("/messages")
+def api_import_messages(data: MessageImportRequest):
+    try:
+        messages = {date.fromisoformat(date_value): message for date_value, message in data.messages.items()}
+    except ValueError:
+        return Response(status_code=400, content="Invalid date format")
+
+    count = import_messages(messages)
+    return {"status": "ok", "count": count}
+
+
 @app.get("/temperature/{id}")
 def get_temperature(id: str):
     t = get_all_temperature_data()
@@ -238,6 +417,48 @@ def get_temperature(id: str):
     return t.get(id, None)
 
 
+@app.get("/temperature/{id}/history")
+def get_temperature_history(
+    id: str,
+    from_time: str | None = Query(None, alias="from"),
+    to_time: str | None = Query(None, alias="to"),
+    step: str | None = None,
+):
+    """
+    Get the temperature history for a sensor from the pre-aggregated tiers.
+    from/to are ISO dates or datetimes (default: the last 24 hours) and step is
+    raw, 5m, 1h or 1d (default: chosen to give at most 500 points)
+    """
+    try:
+        to_timestamp = datetime.fromisoformat(to_time).timestamp() if to_time else datetime.now().timestamp()
+        from_timestamp = (
+            datetime.fromisoformat(from_time).timestamp() if from_time else to_timestamp - 24 * 60 * 60
+        )
+    except ValueError:
+        return Response(status_code=400, content="Invalid date format")
+    if step is None:
+        step = choose_step(from_timestamp, to_timestamp)
+    elif step not in STEPS:
+        return Response(status_code=400, content=f"Invalid step (expected one of {', '.join(STEPS)})")
+
+    points = temperature_history.query(id, from_timestamp, to_timestamp, step)
+    if points is None:
+        return Response(status_code=404, content="No history found")
+    return {
+        "id": id,
+        "step": step,
+        "points": [
+            {
+                "time": datetime.fromtimestamp(point.time).isoformat(),
+                "count": point.count,
+                "temperature": asdict(point.temperature),
+                "humidity": asdict(point.humidity),
+            }
+            for point in points
+        ],
+    }
+
+
 class TemeratureUpdateRequest(BaseModel):
     temperature: float
     humidity: float
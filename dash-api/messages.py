@@ -1,38 +1,140 @@
 from datetime import datetime, date
 import json
+import logging
 import os
+import sqlite3
+import threading
 
 from . import config
+from .input_feed import input_feed
+
+logger = logging.getLogger(__name__)
+
+
+def _date_key(date_value: date) -> str:
+    return date_value.strftime("%Y-%m-%d")
+
+
+class MessageStore:
+    """
+    The daily messages, stored in a SQLite table indexed on the date.
+    Each write is a transaction so is atomic and (with synchronous=FULL) survives a crash.
+    The journal is left in the default (rollback) mode rather than WAL as the database
+    may be on a network filesystem.
+    The messages in the JSON file (if there is one) are imported whenever it has been
+    modified since it was last imported (replacing the messages for the same dates), and
+    a file that fails to import is tried again once it is modified
+    """
+
+    _path: str
+    _import_path: str | None
+    _connection: sqlite3.Connection | None
+    _checked_mtime: int | None
+    _lock: threading.Lock
+
+    def __init__(self, path: str, import_path: str | None = None):
+        self._path = path
+        self._import_path = import_path
+        self._connection = None
+        self._checked_mtime = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            logger.info("messages: using %s (importing from %s)", self._path, self._import_path)
+            connection = sqlite3.connect(self._path, check_same_thread=False)
+            connection.execute("PRAGMA synchronous=FULL")
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS messages (date TEXT PRIMARY KEY, message TEXT NOT NULL)"
+                )
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS imports (path TEXT PRIMARY KEY, mtime INTEGER NOT NULL)"
+                )
+            self._connection = connection
+        if self._import_path:
+            self._import_json_file(self._connection, self._import_path)
+        return self._connection
+
+    def _import_json_file(self, connection: sqlite3.Connection, path: str):
+        """Import the messages from the JSON file if it has been modified since it was last imported"""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._checked_mtime:
+            return
+        self._checked_mtime = mtime
+        try:
+            with open(path) as f:
+                messages = json.load(f)
+            rows = [(str(date_text), str(message)) for date_text, message in messages.items()]
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning("messages: failed to import %s (it will be imported once it is modified): %s", path, e)
+            return
+        with connection:
+            # (checked in a write transaction so that only one of the workers imports it)
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT mtime FROM imports WHERE path = ?", (path,)).fetchone()
+            if row and row[0] >= mtime:
+                return
+            connection.executemany("INSERT OR REPLACE INTO messages (date, message) VALUES (?, ?)", rows)
+            connection.execute("INSERT OR REPLACE INTO imports (path, mtime) VALUES (?, ?)", (path, mtime))
+        logger.info("messages: imported %d messages from %s", len(rows), path)
+
+    def get(self, date_value: date) -> str | None:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT message FROM messages WHERE date = ?", (_date_key(date_value),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_range(self, from_date: date | None, to_date: date | None) -> dict[str, str]:
+        """Get the messages between from_date and to_date (inclusive, either can be None for no limit)"""
+        query = "SELECT date, message FROM messages WHERE date >= ? AND date <= ? ORDER BY date"
+        with self._lock:
+            rows = self._connect().execute(
+                query,
+                (_date_key(from_date) if from_date else "", _date_key(to_date) if to_date else "9999"),
+            ).fetchall()
+        return dict(rows)
+
+    def set(self, date_value: date, message: str):
+        self.set_many({date_value: message})
+
+    def set_many(self, messages: dict[date, str]):
+        """Set the messages in a single transaction"""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO messages (date, message) VALUES (?, ?)",
+                    [(_date_key(date_value), message) for date_value, message in messages.items()],
+                )
+        # let the prerenderer know that the inputs have changed
+        input_feed.notify()
+
+
+message_store = MessageStore(config.messages_db, import_path=config.messages_file)
 
 
 def get_message(date_value: date | None):
-    if os.path.isfile(config.messages_file):
-        with open(config.messages_file) as f:
-            messages = json.load(f)
-
-        if not date_value:
-            date_value = datetime.now().date()
-        date_string = date_value.strftime("%Y-%m-%d")
-        if date_string in messages:
-            return messages[date_string]
-        else:
-            print("No message for ", date_string, flush=True)
-            return ""
-    else:
-        print("No messages file: ", config.messages_file, flush=True)
+    if not date_value:
+        date_value = datetime.now().date()
+    message = message_store.get(date_value)
+    if message is None:
+        print("No message for ", _date_key(date_value), flush=True)
         return ""
+    return message
 
 
 def set_message(date_value: date, message: str):
-    if os.path.isfile(config.messages_file):
-        with open(config.messages_file) as f:
-            messages = json.load(f)
-    else:
-        messages = {}
-
-    date_string = date_value.strftime("%Y-%m-%d")
-    messages[date_string] = message
-
-    with open(config.messages_file, "w") as f:
-        json.dump(messages, f, indent=4)
-        print("Wrote message for ", date_string, flush=True)
+    message_store.set(date_value, message)
+    print("Wrote message for ", _date_key(date_value), flush=True)
+
+
+def import_messages(messages: dict[date, str]) -> int:
+    """Bulk import messages (replacing any existing messages for the same dates)"""
+    message_store.set_many(messages)
+    print("Imported ", len(messages), " messages", flush=True)
+    return len(messages)
@@ -0,0 +1,108 @@
+from dataclasses import dataclass
+from datetime import datetime
+import logging
+import threading
+import time
+
+from . import config
+from .dashboard import DashboardData, RenderedImage, get_dashboard_data
+from .formats import FORMATS
+from .input_feed import input_feed
+from .profiles import DEFAULT_PROFILE
+from .render_pool import render_pool
+from .telemetry import stage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class DashboardSnapshot:
+    data: DashboardData
+    image: RenderedImage
+    signature: tuple  # see _get_input_signature
+    created_at: float  # time.monotonic()
+
+
+def _get_input_signature() -> tuple:
+    """Get the signature of the inputs (the date plus the input feed version) used to detect changes"""
+    return (datetime.now().date(), input_feed.version)
+
+
+class PreRenderer:
+    """
+    Renders the dashboard in the background whenever the input feed reports a change (or the date rolls over)
+    and publishes the result as an immutable snapshot so that requests don't pay for rendering
+    """
+
+    _interval: float
+    _rebuild_interval: float
+    _snapshot: DashboardSnapshot | None
+    _last_checked: float
+    _thread: threading.Thread | None
+    _stop: threading.Event
+
+    def __init__(self, interval: float, rebuild_interval: float):
+        self._interval = interval
+        self._rebuild_interval = rebuild_interval
+        self._snapshot = None
+        self._last_checked = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    def get_snapshot(self) -> DashboardSnapshot | None:
+        """Get the latest snapshot, or None if there isn't one or it is stale"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        if time.monotonic() - self._last_checked > self._interval * 3:
+            # The background thread has stopped updating (or hasn't started)
+            logger.warning("prerender: snapshot is stale")
+            return None
+        if snapshot.signature[0] != datetime.now().date():
+            # The date has rolled over since the snapshot was rendered
+            return None
+        return snapshot
+
+    def refresh(self):
+        """Rebuild the snapshot if the inputs have changed"""
+        signature = _get_input_signature()
+        snapshot = self._snapshot
+        if (
+            snapshot is None
+            or signature != snapshot.signature
+            or time.monotonic() - snapshot.created_at > self._rebuild_interval
+        ):
+            logger.info("prerender: rendering dashboard")
+            with stage("prerender"):
+                dashboard_data = get_dashboard_data()
+                image = render_pool.render_sync(
+                    dashboard_data, DEFAULT_PROFILE, FORMATS[DEFAULT_PROFILE.default_format])
+            self._snapshot = DashboardSnapshot(
+                data=dashboard_data, image=image, signature=signature, created_at=time.monotonic())
+        self._last_checked = time.monotonic()
+
+    def _run(self):
+        while not self._stop.is_set():
+            version = input_feed.version
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("prerender: failed to render dashboard")
+            # re-render as soon as an input changes
+            input_feed.wait_for_change(version, timeout=self._interval)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="prerender", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+prerenderer = PreRenderer(
+    interval=config.prerender_interval,
+    rebuild_interval=config.prerender_rebuild_interval,
+)
@@ -0,0 +1,200 @@
+from dataclasses import dataclass
+import os
+
+from . import config
+
+from .layout import CompiledLayout, FittedText, Icon, Layout, Line, Region, Text, compile_layout
+from .leaf import LEAF_ICON_CHARGING, LEAF_ICON_NOT_PLUGGED_IN, LEAF_ICON_PLUGGED_IN
+
+# darken the weather icons as light clouds etc are hard to see on the eink display
+WEATHER_ICON_BRIGHTNESS = 0.65
+
+LEAF_ICON_PATHS = tuple(
+    os.path.join(config.leaf_image_dir, icon)
+    for icon in [LEAF_ICON_CHARGING, LEAF_ICON_PLUGGED_IN, LEAF_ICON_NOT_PLUGGED_IN]
+)
+
+
+@dataclass(frozen=True)
+class WeatherSlotStyle:
+    icon_size: int
+    width: int
+    time_size: float
+    temperature_size: float
+    feels_like_size: float
+    description_size: float
+    # vertical offsets from the top of the slot
+    image_offset: int
+    temperature_offset: int
+    feels_like_offset: int
+    description_offset: int
+    wind_offset: int
+
+
+def _get_weather_slot(dashboard_data, idx: int):
+    weather = dashboard_data.weather
+    if not weather:
+        return None
+    if idx == 0:
+        return weather.current
+    if idx <= len(weather.forecast):
+        return weather.forecast[idx - 1]
+    return None
+
+
+def _get_wind_text(weather) -> str:
+    wind_speed_text = f"{weather.wind_speed_mph:.0f}" if weather.wind_speed_mph else "n/a"
+    wind_gust_text = f"{weather.wind_gust_mph:.0f}" if weather.wind_gust_mph else "n/a"
+    return f"{wind_speed_text} mph ({wind_gust_text} mph gusts)"
+
+
+def _get_action_text(idx: int):
+    def get_text(actions):
+        if actions and len(actions) > idx:
+            return actions[idx].display_text
+        return None
+    return get_text
+
+
+def _get_stale_text(stale: str) -> str:
+    return f"Stale data: {stale}"
+
+
+def _get_stale_sources(dashboard_data):
+    """The stale sources (or None to leave the indicator blank)"""
+    if dashboard_data.stale:
+        return ", ".join(dashboard_data.stale)
+    return None
+
+
+def _action_buttons(xs: list[int], label_y: int, line_top: int, line_bottom: int, size: float):
+    """The separator lines and labels for the buttons along the bottom of the InkyFrame"""
+    elements = []
+    for i, x in enumerate(xs):
+        elements.append(Line((x, line_top, x, line_bottom)))
+        elements.append(Text((x + 5, label_y), size, _get_action_text(i), align="centre"))
+    return elements
+
+
+def _weather_region(idx: int, left: int, top: int, style: WeatherSlotStyle, frame_width: int) -> Region:
+    # The region extends beyond the slot as long descriptions overflow the slot width
+    box = (max(0, left - 100), top - 10, min(frame_width, left + style.width + 100), top + 190)
+    x = left - box[0]
+    y = top - box[1]
+    centre_x = x + style.width / 2
+    return Region(
+        name=f"weather-{idx}",
+        box=box,
+        value=lambda d: _get_weather_slot(d, idx),
+        elements=[
+            Icon((x, y + style.image_offset), (style.icon_size, style.icon_size),
+                 path=lambda w: w.icon_path, brightness=WEATHER_ICON_BRIGHTNESS),
+            Text((centre_x, y), style.time_size, "{time}", align="centre"),
+            Text((x + style.icon_size, y + style.temperature_offset),
+                 style.temperature_size, "{temperature:.0f}°C"),
+            Text((x + style.icon_size, y + style.feels_like_offset),
+                 style.feels_like_size, "{feels_like:.0f}°C, {humidity}%"),
+            Text((centre_x, y + style.description_offset),
+                 style.description_size, "{description}", align="centre"),
+            Text((centre_x, y + style.wind_offset),
+                 style.description_size, _get_wind_text, align="centre"),
+        ],
+    )
+
+
+# InkyFrame 7.3" (800x480)
+INKY_FRAME_7_3 = Layout(
+    name="inky-frame-7.3",
+    size=(800, 480),
+    background=[
+        Text((200, 10), 17.5, "Leeks Dashboard", align="centre"),
+        *_action_buttons([80, 240, 400, 560, 720], label_y=440, line_top=460, line_bottom=490, size=15),
+    ],
+    background_value=lambda d: d.actions,
+    regions=[
+        Region("date", (280, 0, 800, 45), lambda d: d.date_string, [
+            Text((510, 10), 25, str, align="right"),
+        ]),
+        Region("leaf", (10, 40, 530, 125), lambda d: d.leaf, [
+            Text((100, 10), 30, "Range: {cruising_range_ac_off_miles:.0f} miles"),
+            Text((100, 50), 17.5, "({cruising_range_ac_on_miles:.0f} with climate control)"),
+            Icon((0, 0), (70, 70), path=lambda leaf: leaf.icon_path, preload=LEAF_ICON_PATHS),
+        ]),
+        _weather_region(0, 30, 130, WeatherSlotStyle(
+            icon_size=150, width=250,
+            time_size=20, temperature_size=30, feels_like_size=20, description_size=20,
+            image_offset=-5, temperature_offset=35, feels_like_offset=70, description_offset=120, wind_offset=145,
+        ), frame_width=800),
+        *[
+            _weather_region(idx, left, 130, WeatherSlotStyle(
+                icon_size=85, width=200,
+                time_size=17, temperature_size=25, feels_like_size=17.5, description_size=15,
+                image_offset=5, temperature_offset=25, feels_like_offset=60, description_offset=90, wind_offset=110,
+            ), frame_width=800)
+            for idx, left in [(1, 330), (2, 540)]
+        ],
+        Region("pistat", (330, 275, 800, 300), lambda d: d.pistat0, [
+            Text((0, 0), 15, "pistat-0: {temperature}°C ({humidity}%)"),
+        ]),
+        Region("stale", (330, 300, 800, 325), _get_stale_sources, [
+            Text((0, 0), 15, _get_stale_text),
+        ]),
+        # the message region has room above the line at y=400 for a message that wraps onto two lines
+        Region("message", (0, 360, 800, 440), lambda d: d.message, [
+            FittedText(centre_x=400, bottom_y=40, max_width=780),
+        ]),
+    ],
+)
+
+# InkyFrame 5.7" (600x448) - shows the current weather and one forecast
+INKY_FRAME_5_7 = Layout(
+    name="inky-frame-5.7",
+    size=(600, 448),
+    background=[
+        Text((150, 8), 15, "Leeks Dashboard", align="centre"),
+        *_action_buttons([60, 180, 300, 420, 540], label_y=412, line_top=430, line_bottom=448, size=13),
+    ],
+    background_value=lambda d: d.actions,
+    regions=[
+        Region("date", (200, 0, 600, 40), lambda d: d.date_string, [
+            Text((390, 8), 20, str, align="right"),
+        ]),
+        Region("leaf", (8, 36, 420, 105), lambda d: d.leaf, [
+            Text((72, 6), 24, "Range: {cruising_range_ac_off_miles:.0f} miles"),
+            Text((72, 38), 15, "({cruising_range_ac_on_miles:.0f} with climate control)"),
+            Icon((0, 0), (56, 56), path=lambda leaf: leaf.icon_path, preload=LEAF_ICON_PATHS),
+        ]),
+        _weather_region(0, 20, 115, WeatherSlotStyle(
+            icon_size=110, width=190,
+            time_size=17, temperature_size=25, feels_like_size=17, description_size=15,
+            image_offset=-5, temperature_offset=28, feels_like_offset=58, description_offset=105, wind_offset=125,
+        ), frame_width=600),
+        _weather_region(1, 320, 115, WeatherSlotStyle(
+            icon_size=80, width=200,
+            time_size=15, temperature_size=22, feels_like_size=15, description_size=13,
+            image_offset=5, temperature_offset=22, feels_like_offset=52, description_offset=85, wind_offset=103,
+        ), frame_width=600),
+        Region("pistat", (320, 250, 600, 272), lambda d: d.pistat0, [
+            Text((0, 0), 13, "pistat-0: {temperature}°C ({humidity}%)"),
+        ]),
+        Region("stale", (320, 272, 600, 294), _get_stale_sources, [
+            Text((0, 0), 13, _get_stale_text),
+        ]),
+        Region("message", (0, 330, 600, 405), lambda d: d.message, [
+            FittedText(centre_x=300, bottom_y=45, max_width=580, max_size=22),
+        ]),
+    ],
+)
+
+PROFILES: dict[str, CompiledLayout] = {
+    layout.name: compile_layout(layout)
+    for layout in [INKY_FRAME_7_3, INKY_FRAME_5_7]
+}
+DEFAULT_PROFILE = PROFILES[INKY_FRAME_7_3.name]
+
+
+def get_profile(name: str | None) -> CompiledLayout | None:
+    """Get the device profile by name (or the default profile if name is None)"""
+    if not name:
+        return DEFAULT_PROFILE
+    return PROFILES.get(name)
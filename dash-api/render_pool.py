@@ -0,0 +1,286 @@
+"""
+Renders dashboard images in a pool of worker processes.
+
+Rendering and encoding hold the GIL, so when several devices wake at the same
+time the renders would otherwise run one at a time on a single core.
+Workers are pre-warmed (fonts and known icons loaded) and take the picklable
+DashboardData along with the names of the profile and format, returning the
+encoded image and the greyscale frame.
+"""
+
+import asyncio
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import multiprocessing
+import os
+import threading
+
+from . import config
+from .dashboard import (
+    DashboardData,
+    RenderedImage,
+    RenderResult,
+    get_image_cache_key,
+    render_image,
+)
+from .diff import frame_cache
+from .fonts import fonts
+from .formats import FORMATS, ImageFormat
+from .layout import CompiledLayout
+from .profiles import PROFILES
+from .telemetry import meter, stage
+
+logger = logging.getLogger(__name__)
+
+# spawn rather than fork as the app has background threads (prerender, telemetry export)
+_mp_context = multiprocessing.get_context("spawn")
+
+counter_collapsed_renders = meter.create_counter(
+    "render-requests-collapsed", "count", "Number of render requests that waited for an identical render in flight"
+)
+
+
+# how long start waits for all of the workers to load the fonts and icons
+WARM_UP_TIMEOUT = 120
+
+_warm_up_barrier: threading.Barrier | None = None
+
+
+def _init_worker(warm_up_barrier: threading.Barrier | None = None):
+    global _warm_up_barrier
+    _warm_up_barrier = warm_up_barrier
+    fonts.preload()
+    for profile in PROFILES.values():
+        profile.preload()
+
+
+def _warm_up() -> int:
+    # waits for the other workers, so that a worker that starts quickly can't take all of
+    # the warm-up tasks and leave the others to start on the first renders
+    if _warm_up_barrier is not None:
+        _warm_up_barrier.wait(WARM_UP_TIMEOUT)
+    return os.getpid()
+
+
+def _render(dashboard_data: DashboardData, profile_name: str, format_name: str) -> RenderResult:
+    return render_image(dashboard_data, FORMATS[format_name], PROFILES[profile_name])
+
+
+def _copy_result(source: Future, target: Future):
+    try:
+        target.set_result(source.result())
+    except BaseException as e:
+        target.set_exception(e)
+
+
+class RenderPool:
+    """
+    A bounded pool of render processes. With max_workers=0 (or before start is called, or if
+    the workers can't be started) images are rendered in the API process on a render thread
+    (so that the event loop isn't blocked). If a worker dies the pool is replaced and the
+    renders that were lost are rendered in the API process instead.
+    Encoded images are cached in the profile's image cache and frames in the diff frame cache.
+    Concurrent requests for the same image (same profile, format and data digest) are coalesced
+    into a single render
+    """
+
+    _max_workers: int
+    _executor: ProcessPoolExecutor | None
+    _local_executor: ThreadPoolExecutor
+    _pending: int
+    _in_flight: dict[str, Future[RenderResult]]
+    _collapsed: int
+    _lock: threading.Lock
+
+    def __init__(self, max_workers: int):
+        self._max_workers = max_workers
+        self._executor = None
+        self._local_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+        self._pending = 0
+        self._in_flight = {}
+        self._collapsed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def max_workers(self) -> int:
+        return self._max_workers
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of renders waiting for a worker"""
+        return max(0, self._pending - self._max_workers)
+
+    @property
+    def busy_workers(self) -> int:
+        return min(self._pending, self._max_workers)
+
+    @property
+    def utilisation(self) -> float:
+        """The fraction of the workers that are rendering"""
+        if not self._max_workers:
+            return 0.0
+        return self.busy_workers / self._max_workers
+
+    @property
+    def collapsed(self) -> int:
+        """The number of requests that were served by another request's render"""
+        return self._collapsed
+
+    def _create_executor(self, warm_up_barrier: threading.Barrier | None = None) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self._max_workers,
+            mp_context=_mp_context,
+            initializer=_init_worker,
+            initargs=(warm_up_barrier,),
+        )
+
+    def start(self):
+        """
+        Start the worker processes and wait for them to load the fonts and icons
+        (if they fail to start then images are rendered in the API process)
+        """
+        if self._executor is not None or not self._max_workers:
+            return
+        # (the barrier is passed to the workers when they start, as it can't be sent with a task)
+        executor = self._create_executor(_mp_context.Barrier(self._max_workers))
+        try:
+            # a task per worker starts all of the workers, and each task waits for the others
+            # so that every worker takes one
+            warm_ups = [executor.submit(_warm_up) for _ in range(self._max_workers)]
+            pids = {f.result() for f in warm_ups}
+        except Exception:
+            logger.exception("render-pool: failed to start the workers, rendering in the API process")
+            executor.shutdown(wait=False, cancel_futures=True)
+            return
+        self._executor = executor
+        logger.info("render-pool: started %d workers: %s", self._max_workers, sorted(pids))
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _replace_executor(self, broken: ProcessPoolExecutor):
+        """Replace the pool after a worker has died (unless another render has already replaced it)"""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            logger.error("render-pool: a worker process died, restarting the workers")
+            # (the new workers start on their first render)
+            self._executor = self._create_executor()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _render_locally(
+        self, dashboard_data: DashboardData, profile: CompiledLayout, image_format: ImageFormat
+    ) -> Future[RenderResult]:
+        return self._local_executor.submit(render_image, dashboard_data, image_format, profile)
+
+    def _on_done(self, future: Future):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(
+        self, dashboard_data: DashboardData, profile: CompiledLayout, image_format: ImageFormat
+    ) -> Future[RenderResult]:
+        """Render the image for the data in a worker process (bypassing the caches)"""
+        executor = self._executor
+        if executor is None:
+            return self._render_locally(dashboard_data, profile, image_format)
+
+        try:
+            worker_future = executor.submit(_render, dashboard_data, profile.name, image_format.name)
+        except BrokenProcessPool:
+            self._replace_executor(executor)
+            return self._render_locally(dashboard_data, profile, image_format)
+        with self._lock:
+            self._pending += 1
+        worker_future.add_done_callback(self._on_done)
+
+        future = Future()
+
+        def on_rendered(rendered: Future[RenderResult]):
+            try:
+                future.set_result(rendered.result())
+            except BrokenProcessPool:
+                # the worker died (e.g. it was killed for using too much memory) so render here instead
+                self._replace_executor(executor)
+                self._render_locally(dashboard_data, profile, image_format).add_done_callback(
+                    lambda local: _copy_result(local, future))
+            except BaseException as e:
+                future.set_exception(e)
+
+        worker_future.add_done_callback(on_rendered)
+        return future
+
+    def _get_render(
+        self, dashboard_data: DashboardData, profile: CompiledLayout, image_format: ImageFormat
+    ) -> RenderedImage | Future[RenderResult]:
+        """
+        Get the cached image, or a future for the render of it
+        (joining the render already in flight for the same image if there is one)
+        """
+        cache_key = get_image_cache_key(dashboard_data, image_format)
+        rendered_image = profile.image_cache.get(cache_key)
+        if rendered_image is not None:
+            return rendered_image
+
+        flight_key = f"{profile.name}:{cache_key}"
+        with self._lock:
+            future = self._in_flight.get(flight_key)
+            if future is not None:
+                self._collapsed += 1
+                counter_collapsed_renders.add(1, {"profile": profile.name, "format": image_format.name})
+                return future
+            # registered before submitting so that requests arriving during the render join it
+            future = Future()
+            self._in_flight[flight_key] = future
+
+        def on_rendered(render_future: Future[RenderResult]):
+            try:
+                result = render_future.result()
+            except Exception as e:
+                logger.exception("render-pool: failed to render %s", flight_key)
+                future.set_exception(e)
+            else:
+                profile.image_cache.set(cache_key, result.image)
+                frame_cache.set(result.image.etag, result.frame)
+                future.set_result(result)
+            finally:
+                with self._lock:
+                    del self._in_flight[flight_key]
+
+        try:
+            render_future = self.submit(dashboard_data, profile, image_format)
+        except Exception as e:
+            # (otherwise the requests that joined the render would wait on it forever)
+            future.set_exception(e)
+            with self._lock:
+                del self._in_flight[flight_key]
+            raise
+        render_future.add_done_callback(on_rendered)
+        return future
+
+    async def render(
+        self, dashboard_data: DashboardData, profile: CompiledLayout, image_format: ImageFormat
+    ) -> RenderedImage:
+        """Get the encoded image for the data from the profile's image cache or render it in a worker"""
+        rendered = self._get_render(dashboard_data, profile, image_format)
+        if isinstance(rendered, RenderedImage):
+            return rendered
+        with stage("render-pool", profile=profile.name, format=image_format.name):
+            result = await asyncio.wrap_future(rendered)
+        return result.image
+
+    def render_sync(
+        self, dashboard_data: DashboardData, profile: CompiledLayout, image_format: ImageFormat
+    ) -> RenderedImage:
+        """As render, but blocks the calling thread"""
+        rendered = self._get_render(dashboard_data, profile, image_format)
+        if isinstance(rendered, RenderedImage):
+            return rendered
+        with stage("render-pool", profile=profile.name, format=image_format.name):
+            result = rendered.result()
+        return result.image
+
+render_pool = RenderPool(max_workers=config.render_workers)
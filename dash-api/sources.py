@@ -0,0 +1,113 @@
+"""
+Concurrent loading of the dashboard data sources.
+
+Each source is loaded on a small thread pool with its own deadline so that one
+slow or missing file (e.g. on a busy shared PVC) doesn't hold up the others.
+If a source times out, fails or has no data then its last-known-good value is
+used instead and the source is reported as stale.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+import contextvars
+from dataclasses import dataclass
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+from .file_snapshot import JsonFileSnapshot
+from .telemetry import meter, stage
+
+logger = logging.getLogger(__name__)
+
+counter_stale_sources = meter.create_counter(
+    "dashboard-stale-sources", "count", "Number of times a data source fell back to its last-known-good value"
+)
+
+
+@dataclass(frozen=True)
+class DataSource:
+    name: str
+    load: Callable[[], Any]
+    timeout: float  # seconds
+    # the files the source is parsed from (a file that failed to parse makes the source stale)
+    snapshots: tuple[JsonFileSnapshot, ...] = ()
+
+
+@dataclass(frozen=True)
+class LoadedValue:
+    """
+    A source's value along with the files it was actually parsed from, for a source that only reads
+    some of its files (these replace the DataSource's snapshots when checking whether it is stale)
+    """
+    value: Any
+    snapshots: tuple[JsonFileSnapshot, ...]
+
+
+@dataclass(frozen=True)
+class GatheredData:
+    values: dict[str, Any]
+    stale: list[str]  # the names of the sources that are using their last-known-good value
+
+
+class SourceGatherer:
+    _sources: list[DataSource]
+    _executor: ThreadPoolExecutor
+    _in_flight: dict[str, Future]
+    _last_good: dict[str, Any]
+    _lock: threading.Lock
+
+    def __init__(self, sources: list[DataSource]):
+        self._sources = sources
+        self._executor = ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="data-source")
+        self._in_flight = {}
+        self._last_good = {}
+        self._lock = threading.Lock()
+
+    def _submit(self, source: DataSource) -> Future:
+        """
+        Start loading the source, or join the load that is already running
+        (so that a source that is hanging doesn't tie up more threads)
+        """
+        with self._lock:
+            future = self._in_flight.get(source.name)
+            if future is None or future.done():
+                # run in a copy of the context so that the source's span is a child of the current span
+                context = contextvars.copy_context()
+                future = self._executor.submit(context.run, self._load, source)
+                self._in_flight[source.name] = future
+            return future
+
+    def _load(self, source: DataSource):
+        with stage(f"load-{source.name}"):
+            return source.load()
+
+    def gather(self) -> GatheredData:
+        start = time.monotonic()
+        futures = {source.name: self._submit(source) for source in self._sources}
+        values = {}
+        stale = []
+        for source in self._sources:
+            future = futures[source.name]
+            remaining = max(0, source.timeout - (time.monotonic() - start))
+            value = None
+            snapshots = source.snapshots
+            try:
+                value = future.result(timeout=remaining)
+                if isinstance(value, LoadedValue):
+                    value, snapshots = value.value, value.snapshots
+                if value is None:
+                    logger.warning("sources: %s has no data", source.name)
+            except TimeoutError:
+                logger.warning("sources: %s timed out after %ss", source.name, source.timeout)
+            except Exception:
+                logger.exception("sources: failed to load %s", source.name)
+
+            if value is not None and not any(snapshot.stale for snapshot in snapshots):
+                self._last_good[source.name] = value
+            else:
+                value = self._last_good.get(source.name, value)
+                stale.append(source.name)
+                counter_stale_sources.add(1, {"source": source.name})
+            values[source.name] = value
+        return GatheredData(values=values, stale=stale)
@@ -0,0 +1,92 @@
+from contextlib import contextmanager
+import logging
+import time
+
+from opentelemetry import metrics, trace
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# These are proxies until configure_telemetry sets the providers
+# so they are safe to use at import time
+tracer = trace.get_tracer("dash-api")
+meter = metrics.get_meter("dash-api")
+
+histogram_stage_duration = meter.create_histogram(
+    "dashboard-stage-duration", "ms", "Duration of the stages of loading data for and rendering the dashboard"
+)
+
+
+def configure_telemetry():
+    """
+    Configure Azure Monitor if there is a connection string,
+    otherwise use the exporter set in TELEMETRY_EXPORTER (console or otlp) if any
+    """
+    if config.app_insights_connection_string:
+        from azure.monitor.opentelemetry import configure_azure_monitor
+
+        print("Configuring Azure Monitor")
+        print(f"Connection string: {config.app_insights_connection_string}")
+        configure_azure_monitor(
+            connection_string=config.app_insights_connection_string,
+        )
+        return
+
+    print("No Azure Monitor configuration found")
+    exporter = (config.telemetry_exporter or "").lower()
+    if not exporter:
+        return
+
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    if exporter == "console":
+        from opentelemetry.sdk.metrics.export import ConsoleMetricExporter
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+        span_exporter = ConsoleSpanExporter()
+        metric_exporter = ConsoleMetricExporter()
+    elif exporter == "otlp":
+        try:
+            # The OTLP exporter is optional: pip install opentelemetry-exporter-otlp
+            # (the endpoint is set via the standard OTEL_EXPORTER_OTLP_ENDPOINT env var)
+            from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            logger.error("TELEMETRY_EXPORTER=otlp but opentelemetry-exporter-otlp is not installed")
+            return
+
+        span_exporter = OTLPSpanExporter()
+        metric_exporter = OTLPMetricExporter()
+    else:
+        logger.error("Unknown TELEMETRY_EXPORTER: %s", exporter)
+        return
+
+    print(f"Configuring {exporter} telemetry exporter")
+    resource = Resource.create({"service.name": "dash-api"})
+    tracer_provider = TracerProvider(resource=resource)
+    tracer_provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    trace.set_tracer_provider(tracer_provider)
+    metrics.set_meter_provider(
+        MeterProvider(
+            resource=resource,
+            metric_readers=[PeriodicExportingMetricReader(
+                metric_exporter, export_interval_millis=config.telemetry_export_interval_ms)],
+        )
+    )
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Trace a stage of the pipeline as a child span and record its duration"""
+    with tracer.start_as_current_span(name, attributes=attributes) as span:
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            histogram_stage_duration.record(duration_ms, {"stage": name, **attributes})
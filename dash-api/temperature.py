@@ -1,58 +1,214 @@
+import atexit
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
+import fcntl
 import json
+import logging
 import os
+import threading
 
 from . import config
+from .file_snapshot import JsonFileSnapshot
+from .input_feed import input_feed
+from .temperature_history import temperature_history
 
+logger = logging.getLogger(__name__)
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class TemperatureData:
     reported_at: datetime
     temperature: float
     humidity: float
 
 
-def get_all_temperature_data() -> dict[str, TemperatureData]:
+def _parse_temperatures(temperature_data) -> dict[str, TemperatureData]:
+    result = {}
+    for temp in temperature_data["temperatures"]:
+        temp_data = temperature_data["temperatures"][temp]
+        temperature = TemperatureData(
+            reported_at=temp_data["reported_at"],
+            temperature=temp_data["temperature"], humidity=temp_data["humidity"])
+        result[temp] = temperature
+    return result
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Hold an exclusive lock on path (shared by all of the processes using the file)"""
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class TemperatureStore:
     """
-    Get the temperature data
-    Returns a dict keyed on the temperature name
+    The latest reading for each sensor, stored in temperatures.json.
+    Reads come from the (watched) file snapshot plus this process's updates that haven't
+    been written yet, so an update is seen straight away by the worker that handled it and
+    by the other uvicorn workers once it has been written.
+    Updates are written (along with the history) by a background flusher every flush_interval
+    seconds or once flush_batch_size updates are pending. Each flush holds an exclusive lock
+    on lock_path and merges the pending updates into the current contents of the file (the
+    latest reading for each sensor wins) so the workers don't overwrite each other's updates,
+    then writes the file atomically (temp file, fsync, rename)
     """
-    temperature_data_file = os.path.join(
-        config.dashboard_input_dir, "temperatures.json")
 
-    if not os.path.isfile(temperature_data_file):
-        print("ERROR: temperatures.json does not exist")
-        return None
+    _snapshot: JsonFileSnapshot[dict[str, TemperatureData]]
+    _lock_path: str
+    _flush_interval: float
+    _flush_batch_size: int
+    _pending: dict[str, TemperatureData]
+    _readings: list[tuple[str, float, float, float]]
+    _lock: threading.Lock
+    _flush_lock: threading.Lock
+    _wake: threading.Event
+    _stop: threading.Event
+    _thread: threading.Thread | None
 
-    result = {}
-    with open(temperature_data_file) as f:
-        temperature_data = json.load(f)
-        print(temperature_data)
-        for temp in temperature_data["temperatures"]:
-            temp_data = temperature_data["temperatures"][temp]
-            temperature = TemperatureData(
-                reported_at=temp_data["reported_at"],
-                temperature=temp_data["temperature"], humidity=temp_data["humidity"])
-            result[temp] = temperature
-    return result
+    def __init__(
+        self, snapshot: JsonFileSnapshot[dict[str, TemperatureData]], lock_path: str,
+        flush_interval: float, flush_batch_size: int,
+    ):
+        self._snapshot = snapshot
+        self._lock_path = lock_path
+        self._flush_interval = flush_interval
+        self._flush_batch_size = flush_batch_size
+        self._pending = {}
+        self._readings = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get_all(self) -> dict[str, TemperatureData]:
+        """Get the latest readings keyed on the sensor name (shared, so don't modify it)"""
+        table = self._snapshot.get()
+        if table is None:
+            table = {}
+        with self._lock:
+            if not self._pending:
+                return table
+            return {**table, **self._pending}
+
+    def update(self, name: str, temperature: float, humidity: float):
+        now = datetime.now()
+        reading = TemperatureData(reported_at=now.isoformat(), temperature=temperature, humidity=humidity)
+        with self._lock:
+            self._pending[name] = reading
+            self._readings.append((name, now.timestamp(), temperature, humidity))
+            pending = len(self._readings)
+        input_feed.notify()
+
+        if self._thread is None:
+            # no flusher running (e.g. in a script) so write straight away
+            self.flush()
+        elif pending >= self._flush_batch_size:
+            self._wake.set()
+
+    def flush(self):
+        """Write any pending updates"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._readings:
+                    return
+                pending = dict(self._pending)
+                readings = list(self._readings)
+            with _file_lock(self._lock_path):
+                table = dict(self._read())
+                for name, reading in pending.items():
+                    current = table.get(name)
+                    if current is None or current.reported_at <= reading.reported_at:
+                        table[name] = reading
+                self._write(table)
+                temperature_history.add_readings(readings)
+            with self._lock:
+                # (keep any updates made while writing)
+                for name, reading in pending.items():
+                    if self._pending.get(name) is reading:
+                        del self._pending[name]
+                del self._readings[:len(readings)]
+            # pick up the change now rather than waiting for the watcher
+            input_feed.refresh([self._snapshot])
+            logger.debug("temperature: flushed %d updates", len(readings))
+
+    def _read(self) -> dict[str, TemperatureData]:
+        """Read the current contents of the file (falling back to the last good contents)"""
+        path = self._snapshot.path
+        if not os.path.isfile(path):
+            return {}
+        try:
+            with open(path) as f:
+                return _parse_temperatures(json.load(f))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error("temperature: failed to parse %s (using the last good readings): %s", path, e)
+            return self._snapshot.get() or {}
+
+    def _write(self, table: dict[str, TemperatureData]):
+        temperatures = {
+            "temperatures": {
+                name: {
+                    "reported_at": reading.reported_at,
+                    "temperature": reading.temperature,
+                    "humidity": reading.humidity,
+                }
+                for name, reading in table.items()
+            }
+        }
+        path = self._snapshot.path
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(temperatures, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self._flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("temperature: failed to write %s", self._snapshot.path)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="temperature-flush", daemon=True)
+        self._thread.start()
+        # don't lose the pending updates on shutdown
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self.flush()
+
+
+temperatures_snapshot = input_feed.register(JsonFileSnapshot[dict[str, TemperatureData]](
+    os.path.join(config.dashboard_input_dir, "temperatures.json"), parse=_parse_temperatures))
+
+temperature_store = TemperatureStore(
+    temperatures_snapshot,
+    lock_path=os.path.join(config.dashboard_input_dir, "temperatures.json.lock"),
+    flush_interval=config.temperature_flush_interval,
+    flush_batch_size=config.temperature_flush_batch_size,
+)
+
+
+def get_all_temperature_data() -> dict[str, TemperatureData]:
+    """
+    Get the temperature data
+    Returns a dict keyed on the temperature name (shared, so don't modify it)
+    """
+    return temperature_store.get_all()
 
 
 def update_temperature_data(name: str, temperature: float, humidity: float):
-    temperature_data_file = os.path.join(
-        config.dashboard_input_dir, "temperatures.json")
-
-    if os.path.isfile(temperature_data_file):
-        with open(temperature_data_file) as f:
-            temperatures = json.load(f)
-    else:
-        temperatures = {"temperatures": {}}
-
-    temperature_data = temperatures["temperatures"]
-    temperature_data[name] = {
-        "reported_at": datetime.now().isoformat(),
-        "temperature": temperature,
-        "humidity": humidity,
-    }
-    with open(temperature_data_file, "w") as f:
-        json.dump(temperatures, f, indent=4)
+    temperature_store.update(name, temperature, humidity)
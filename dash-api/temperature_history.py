@@ -0,0 +1,423 @@
+"""
+Temperature history.
+
+Each sensor has a fixed-size ring buffer of raw readings plus 5 minute, hourly
+and daily tiers of aggregates (min/max/mean of the temperature and humidity) so
+that history queries are served from the pre-aggregated tier rather than by
+scanning raw readings.
+Each tier is a ring of buckets indexed on the bucket number (time // step) so a
+reading is added to its bucket in O(1). The buckets are stored in typed arrays,
+which are written to a compact binary file per sensor.
+New readings are appended to a journal next to the file, which is compacted into
+the file once it is full (rather than rewriting all of the tiers for a few readings,
+as the history is usually on an SD card).
+"""
+
+from array import array
+from dataclasses import dataclass
+import json
+import logging
+import math
+import os
+import re
+import struct
+import threading
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# sensor ids are used in file names
+_VALID_SENSOR_ID = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+_FILE_FORMAT_VERSION = 1
+
+# The journal starts with the generation of the file that it follows (so a journal that
+# has already been compacted into the file isn't replayed) and then has a record per reading
+_JOURNAL_HEADER = struct.Struct("<Q")
+_JOURNAL_RECORD = struct.Struct("<dff")  # time, temperature, humidity
+# the number of readings in the journal before it is compacted into the file
+JOURNAL_CAPACITY = 1024
+
+
+@dataclass(frozen=True)
+class TierSpec:
+    name: str
+    step: int  # seconds
+    capacity: int  # number of buckets
+
+
+TIERS = [
+    TierSpec("5m", 5 * 60, 7 * 24 * 12),  # 7 days
+    TierSpec("1h", 60 * 60, 90 * 24),  # 90 days
+    TierSpec("1d", 24 * 60 * 60, 5 * 366),  # 5 years
+]
+RAW_CAPACITY = 2048
+
+
+@dataclass(frozen=True)
+class Aggregate:
+    min: float
+    max: float
+    mean: float
+
+
+@dataclass(frozen=True)
+class HistoryPoint:
+    time: float  # start of the bucket (epoch seconds)
+    count: int
+    temperature: Aggregate
+    humidity: Aggregate
+
+
+def _aggregate(minimum: float, maximum: float, mean: float) -> Aggregate:
+    # the values are stored as 32-bit floats so round off the noise
+    return Aggregate(round(minimum, 2), round(maximum, 2), round(mean, 2))
+
+
+class _RawRing:
+    """The most recent readings"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.next = 0
+        self.count = 0
+        self.times = array("d", bytes(8 * capacity))
+        self.temperatures = array("f", bytes(4 * capacity))
+        self.humidities = array("f", bytes(4 * capacity))
+
+    def arrays(self) -> list[array]:
+        return [self.times, self.temperatures, self.humidities]
+
+    def add(self, time: float, temperature: float, humidity: float):
+        i = self.next
+        self.times[i] = time
+        self.temperatures[i] = temperature
+        self.humidities[i] = humidity
+        self.next = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def query(self, from_time: float, to_time: float) -> list[HistoryPoint]:
+        points = []
+        start = (self.next - self.count) % self.capacity
+        for n in range(self.count):
+            i = (start + n) % self.capacity
+            time = self.times[i]
+            if from_time <= time <= to_time:
+                temperature = self.temperatures[i]
+                humidity = self.humidities[i]
+                points.append(HistoryPoint(
+                    time=time,
+                    count=1,
+                    temperature=_aggregate(temperature, temperature, temperature),
+                    humidity=_aggregate(humidity, humidity, humidity),
+                ))
+        points.sort(key=lambda p: p.time)
+        return points
+
+
+class _Tier:
+    """Aggregates for fixed-size time buckets"""
+
+    def __init__(self, spec: TierSpec):
+        self.spec = spec
+        capacity = spec.capacity
+        self.starts = array("q", bytes(8 * capacity))  # bucket start time (0 if unused)
+        self.counts = array("I", bytes(4 * capacity))
+        self.temperature_min = array("f", bytes(4 * capacity))
+        self.temperature_max = array("f", bytes(4 * capacity))
+        self.temperature_sum = array("d", bytes(8 * capacity))
+        self.humidity_min = array("f", bytes(4 * capacity))
+        self.humidity_max = array("f", bytes(4 * capacity))
+        self.humidity_sum = array("d", bytes(8 * capacity))
+
+    def arrays(self) -> list[array]:
+        return [
+            self.starts, self.counts,
+            self.temperature_min, self.temperature_max, self.temperature_sum,
+            self.humidity_min, self.humidity_max, self.humidity_sum,
+        ]
+
+    def add(self, time: float, temperature: float, humidity: float):
+        bucket = int(time // self.spec.step)
+        start = bucket * self.spec.step
+        i = bucket % self.spec.capacity
+        if self.starts[i] == start and self.counts[i]:
+            self.counts[i] += 1
+            self.temperature_min[i] = min(self.temperature_min[i], temperature)
+            self.temperature_max[i] = max(self.temperature_max[i], temperature)
+            self.temperature_sum[i] += temperature
+            self.humidity_min[i] = min(self.humidity_min[i], humidity)
+            self.humidity_max[i] = max(self.humidity_max[i], humidity)
+            self.humidity_sum[i] += humidity
+        elif start > self.starts[i]:
+            # a new bucket (replacing the bucket from capacity * step ago)
+            self.starts[i] = start
+            self.counts[i] = 1
+            self.temperature_min[i] = self.temperature_max[i] = self.temperature_sum[i] = temperature
+            self.humidity_min[i] = self.humidity_max[i] = self.humidity_sum[i] = humidity
+        # else the reading is older than the tier holds
+
+    def query(self, from_time: float, to_time: float) -> list[HistoryPoint]:
+        step = self.spec.step
+        first = int(from_time // step)
+        last = int(to_time // step)
+        # only the last capacity buckets can be in the ring
+        first = max(first, last - self.spec.capacity + 1)
+        points = []
+        for bucket in range(first, last + 1):
+            i = bucket % self.spec.capacity
+            count = self.counts[i]
+            if count and self.starts[i] == bucket * step:
+                points.append(HistoryPoint(
+                    time=self.starts[i],
+                    count=count,
+                    temperature=_aggregate(
+                        self.temperature_min[i], self.temperature_max[i], self.temperature_sum[i] / count),
+                    humidity=_aggregate(
+                        self.humidity_min[i], self.humidity_max[i], self.humidity_sum[i] / count),
+                ))
+        return points
+
+
+class TemperatureSeries:
+    """The history for one sensor"""
+
+    def __init__(self):
+        self.raw = _RawRing(RAW_CAPACITY)
+        self.tiers = {spec.name: _Tier(spec) for spec in TIERS}
+        # incremented each time the journal is compacted into the file
+        self.generation = 0
+
+    def add(self, time: float, temperature: float, humidity: float):
+        self.raw.add(time, temperature, humidity)
+        for tier in self.tiers.values():
+            tier.add(time, temperature, humidity)
+
+    def query(self, from_time: float, to_time: float, step: str) -> list[HistoryPoint]:
+        if step == "raw":
+            return self.raw.query(from_time, to_time)
+        return self.tiers[step].query(from_time, to_time)
+
+    def _arrays(self) -> list[array]:
+        return self.raw.arrays() + [a for tier in self.tiers.values() for a in tier.arrays()]
+
+    def save(self, path: str):
+        """Write the series to path (atomically, via a temp file)"""
+        header = {
+            "version": _FILE_FORMAT_VERSION,
+            "generation": self.generation,
+            "raw": {"capacity": self.raw.capacity, "next": self.raw.next, "count": self.raw.count},
+            "tiers": {name: [tier.spec.step, tier.spec.capacity] for name, tier in self.tiers.items()},
+            "arrays": [[a.typecode, len(a)] for a in self._arrays()],
+        }
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            for a in self._arrays():
+                a.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "TemperatureSeries":
+        series = cls()
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            layout = {name: [tier.spec.step, tier.spec.capacity] for name, tier in series.tiers.items()}
+            if (
+                header["version"] != _FILE_FORMAT_VERSION
+                or header["raw"]["capacity"] != series.raw.capacity
+                or header["tiers"] != layout
+            ):
+                # The tiers have been reconfigured since the file was written
+                raise ValueError(f"Temperature history layout has changed: {path}")
+            for a, (typecode, length) in zip(series._arrays(), header["arrays"]):
+                if a.typecode != typecode or len(a) != length:
+                    raise ValueError(f"Temperature history layout has changed: {path}")
+                del a[:]
+                a.fromfile(f, length)
+        series.raw.next = header["raw"]["next"]
+        series.raw.count = header["raw"]["count"]
+        series.generation = header.get("generation", 0)
+        return series
+
+
+def choose_step(from_time: float, to_time: float, max_points: int = 500) -> str:
+    """Choose the finest tier that gives at most max_points for the range"""
+    for spec in TIERS:
+        if (to_time - from_time) / spec.step <= max_points:
+            return spec.name
+    return TIERS[-1].name
+
+
+STEPS = ["raw"] + [spec.name for spec in TIERS]
+
+
+def _get_signature(path: str) -> tuple[int, int, int] | None:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+@dataclass
+class _JournalPosition:
+    inode: int
+    offset: int  # the end of the last record that has been added to the series
+
+
+class TemperatureHistory:
+    """
+    The history for all sensors, loaded from history_dir.
+    The files are shared by the API workers, so a series is re-loaded whenever its
+    file has been written by another worker (and the readings that another worker has
+    added to its journal are added to the series), and add_readings must be called while
+    holding the temperatures file lock (see TemperatureStore.flush) so that the
+    workers' writes don't overwrite each other
+    """
+
+    _history_dir: str
+    _series: dict[str, TemperatureSeries]
+    _signatures: dict[str, tuple | None]
+    _journals: dict[str, _JournalPosition]
+    _lock: threading.Lock
+
+    def __init__(self, history_dir: str):
+        self._history_dir = history_dir
+        self._series = {}
+        self._signatures = {}
+        self._journals = {}
+        self._lock = threading.Lock()
+
+    def _get_path(self, sensor_id: str) -> str:
+        return os.path.join(self._history_dir, f"{sensor_id}.bin")
+
+    def _get_journal_path(self, sensor_id: str) -> str:
+        return os.path.join(self._history_dir, f"{sensor_id}.journal")
+
+    def _get_series(self, sensor_id: str, create: bool) -> TemperatureSeries | None:
+        path = self._get_path(sensor_id)
+        signature = _get_signature(path)
+        series = self._series.get(sensor_id)
+        if series is None or signature != self._signatures.get(sensor_id):
+            series = None
+            if signature is not None:
+                try:
+                    series = TemperatureSeries.load(path)
+                except (ValueError, OSError, EOFError) as e:
+                    logger.error("temperature-history: failed to load %s: %s", path, e)
+            if series is None:
+                if not create:
+                    return None
+                # (so that add_readings writes the file rather than a journal for it)
+                series = TemperatureSeries()
+                signature = None
+            self._series[sensor_id] = series
+            self._signatures[sensor_id] = signature
+            self._journals.pop(sensor_id, None)
+        if signature is not None:
+            self._replay_journal(sensor_id, series)
+        return series
+
+    def _replay_journal(self, sensor_id: str, series: TemperatureSeries):
+        """Add the readings in the journal that haven't been added to the series yet"""
+        path = self._get_journal_path(sensor_id)
+        try:
+            with open(path, "rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                position = self._journals.get(sensor_id)
+                if position is None or position.inode != inode:
+                    header = f.read(_JOURNAL_HEADER.size)
+                    if len(header) < _JOURNAL_HEADER.size or _JOURNAL_HEADER.unpack(header)[0] != series.generation:
+                        # (written before the last compaction, so its readings are already in the file)
+                        self._journals.pop(sensor_id, None)
+                        return
+                    position = _JournalPosition(inode, _JOURNAL_HEADER.size)
+                    self._journals[sensor_id] = position
+                f.seek(position.offset)
+                data = f.read()
+        except FileNotFoundError:
+            self._journals.pop(sensor_id, None)
+            return
+        # (ignoring a record that is part-way through being written)
+        length = len(data) - len(data) % _JOURNAL_RECORD.size
+        for time, temperature, humidity in _JOURNAL_RECORD.iter_unpack(data[:length]):
+            series.add(time, temperature, humidity)
+        position.offset += length
+
+    def _append_journal(self, sensor_id: str, series: TemperatureSeries, readings: list[tuple[float, float, float]]):
+        path = self._get_journal_path(sensor_id)
+        position = self._journals.get(sensor_id)
+        if position is None:
+            # start a journal for the current file (replacing one from before the last compaction)
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(_JOURNAL_HEADER.pack(series.generation))
+            os.replace(temp_path, path)
+            position = _JournalPosition(os.stat(path).st_ino, _JOURNAL_HEADER.size)
+            self._journals[sensor_id] = position
+        with open(path, "r+b") as f:
+            # (overwriting a record that was only partly written, e.g. if the API was killed)
+            f.seek(position.offset)
+            f.write(b"".join(_JOURNAL_RECORD.pack(*reading) for reading in readings))
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+            position.offset = f.tell()
+
+    def _compact(self, sensor_id: str, series: TemperatureSeries):
+        """Write the series to its file and remove the journal (as its readings are now in the file)"""
+        series.generation += 1
+        path = self._get_path(sensor_id)
+        series.save(path)
+        self._signatures[sensor_id] = _get_signature(path)
+        try:
+            os.remove(self._get_journal_path(sensor_id))
+        except FileNotFoundError:
+            pass
+        self._journals.pop(sensor_id, None)
+
+    def add_readings(self, readings: list[tuple[str, float, float, float]]):
+        """
+        Add the (sensor id, time, temperature, humidity) readings and append them to the
+        journals of the series they are for
+        """
+        by_sensor: dict[str, list[tuple[float, float, float]]] = {}
+        for sensor_id, time, temperature, humidity in readings:
+            if not _VALID_SENSOR_ID.match(sensor_id):
+                logger.warning("temperature-history: not recording history for invalid id: %s", sensor_id)
+                continue
+            if math.isnan(temperature) or math.isnan(humidity):
+                continue
+            by_sensor.setdefault(sensor_id, []).append((time, temperature, humidity))
+        if not by_sensor:
+            return
+
+        with self._lock:
+            os.makedirs(self._history_dir, exist_ok=True)
+            for sensor_id, sensor_readings in sorted(by_sensor.items()):
+                series = self._get_series(sensor_id, create=True)
+                for time, temperature, humidity in sensor_readings:
+                    series.add(time, temperature, humidity)
+                position = self._journals.get(sensor_id)
+                journal_length = (position.offset - _JOURNAL_HEADER.size) // _JOURNAL_RECORD.size if position else 0
+                if self._signatures.get(sensor_id) is None or journal_length + len(sensor_readings) > JOURNAL_CAPACITY:
+                    self._compact(sensor_id, series)
+                else:
+                    self._append_journal(sensor_id, series, sensor_readings)
+
+    def query(self, sensor_id: str, from_time: float, to_time: float, step: str) -> list[HistoryPoint] | None:
+        """Get the history for the sensor (or None if there is no history for it)"""
+        if not _VALID_SENSOR_ID.match(sensor_id):
+            return None
+        with self._lock:
+            series = self._get_series(sensor_id, create=False)
+            if series is None:
+                return None
+            return series.query(from_time, to_time, step)
+
+
+temperature_history = TemperatureHistory(config.temperature_history_dir)
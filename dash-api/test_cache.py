@@ -0,0 +1,236 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from dash_api.cache import Cache, CacheStats, cache_for
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_cache_expiry_slides_with_use():
+    cache = Cache[int](ttl=0.2)
+    cache.set("key", 1)
+
+    for _ in range(3):
+        time.sleep(0.1)
+        assert cache.get("key") == 1
+    time.sleep(0.25)
+
+    assert cache.get("key") is None
+    assert (cache.hits, cache.misses, cache.expirations) == (3, 1, 1)
+
+
+def test_cache_expiry_is_fixed_when_not_sliding():
+    cache = Cache[int](ttl=0.2, sliding=False)
+    cache.set("key", 1)
+    cache.set("short", 2, ttl=0.1)
+    cache.set("other", 3)
+
+    time.sleep(0.12)
+    # (expired out of order, as "short" isn't the oldest item)
+    assert cache.get("short") is None
+    assert cache.get("key") == 1
+    time.sleep(0.1)
+
+    assert cache.get("key") is None
+    assert cache.get("other") is None
+    assert cache.expirations == 3
+    assert len(cache) == 0
+
+
+def test_results_are_cached_on_the_arguments():
+    calls = []
+
+    @cache_for(ttl=60)
+    def add(a, b=0):
+        calls.append((a, b))
+        return a + b
+
+    assert [add(1), add(1), add(1, b=2), add(1, b=2), add(2)] == [1, 1, 3, 3, 2]
+    assert calls == [(1, 0), (1, 2), (2, 0)]
+    assert add.cache_stats() == CacheStats(hits=2, stale_hits=0, waits=0, misses=3, entries=3)
+
+
+def test_skip_cache_and_clear():
+    calls = []
+
+    @cache_for(ttl=60)
+    def get():
+        calls.append(1)
+        return len(calls)
+
+    assert get() == 1
+    assert get(skip_cache=True) == 2
+    # the result of the skip_cache call replaces the cached one
+    assert get() == 2
+    get.cache_clear()
+    assert get() == 3
+
+
+def test_max_entries():
+    @cache_for(ttl=60, max_entries=2)
+    def identity(value):
+        return value
+
+    for value in range(5):
+        identity(value)
+
+    assert identity.cache_stats().entries == 2
+
+
+def test_exceptions_are_not_cached():
+    calls = []
+
+    @cache_for(ttl=60)
+    def fail():
+        calls.append(1)
+        raise ValueError(len(calls))
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            fail()
+    assert len(calls) == 2
+
+
+def test_concurrent_calls_wait_for_the_first():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    @cache_for(ttl=60)
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "value"
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(slow()))
+    first.start()
+    started.wait(5)
+    others = [threading.Thread(target=lambda: results.append(slow())) for _ in range(3)]
+    for thread in others:
+        thread.start()
+    wait_until(lambda: slow.cache_stats().waits == 3)
+    release.set()
+    for thread in [first] + others:
+        thread.join(5)
+
+    assert results == ["value"] * 4
+    assert len(calls) == 1
+    assert slow.cache_stats() == CacheStats(hits=0, stale_hits=0, waits=3, misses=1, entries=1)
+
+
+def test_expired_result_is_served_while_it_is_updated():
+    started = threading.Event()
+    release = threading.Event()
+    values = iter(["old", "new"])
+
+    # (with a ttl of 0 the result has expired as soon as it is cached)
+    @cache_for(ttl=0)
+    def get():
+        value = next(values)
+        if value == "new":
+            started.set()
+            release.wait(5)
+        return value
+
+    assert get() == "old"
+    results = []
+    updater = threading.Thread(target=lambda: results.append(get()))
+    updater.start()
+    started.wait(5)
+
+    assert get() == "old"
+    release.set()
+    updater.join(5)
+    assert results == ["new"]
+    assert get.cache_stats().stale_hits == 1
+
+
+def test_async_calls_share_one_update():
+    calls = []
+
+    @cache_for(ttl=60)
+    async def get(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key * 2
+
+    async def run():
+        return await asyncio.gather(*[get(3) for _ in range(5)]), await get(3)
+
+    results, cached = asyncio.run(run())
+
+    assert results == [6] * 5 and cached == 6
+    assert calls == [3]
+    assert get.cache_stats() == CacheStats(hits=1, stale_hits=0, waits=4, misses=1, entries=1)
+
+
+def test_async_update_survives_the_first_call_being_cancelled():
+    calls = []
+
+    @cache_for(ttl=60)
+    async def get():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "value"
+
+    async def run():
+        first = asyncio.ensure_future(get())
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(get()) for _ in range(3)]
+        await asyncio.sleep(0)
+        first.cancel()
+        results = await asyncio.gather(*waiters)
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return results, await get()
+
+    results, cached = asyncio.run(run())
+
+    assert results == ["value"] * 3
+    assert cached == "value"
+    assert len(calls) == 1
+
+
+def test_async_exceptions_are_raised_in_every_call_and_not_cached():
+    calls = []
+
+    @cache_for(ttl=60)
+    async def fail():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise KeyError("missing")
+
+    async def run():
+        results = await asyncio.gather(*[fail() for _ in range(3)], return_exceptions=True)
+        with pytest.raises(KeyError):
+            await fail()
+        return results
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, KeyError) for result in results)
+    assert len(calls) == 2
+
+
+def test_item_larger_than_max_bytes_isnt_kept():
+    cache = Cache[bytes](ttl=None, max_bytes=10)
+    cache.set("a", b"1234")
+    cache.set("b", b"5678")
+    cache.set("c", b"ol")
+
+    cache.set("c", b"much too large")
+
+    assert cache.get("c") is None
+    # the other items aren't evicted to make room for it
+    assert (cache.get("a"), cache.get("b")) == (b"1234", b"5678")
+    assert (cache.bytes, cache.evictions, cache.rejections) == (8, 0, 1)
@@ -0,0 +1,101 @@
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from dash_api.change_policy import DEFAULT_POLICY, Changed, MaxAge, Threshold, compile_policy
+from dash_api.dashboard import DashboardData
+from dash_api.leaf import LeafData
+from dash_api.temperature import TemperatureData
+
+check = compile_policy(DEFAULT_POLICY)
+
+
+def create_data(**changes) -> DashboardData:
+    data = DashboardData(
+        leaf=LeafData(
+            is_plugged_in=True,
+            is_charging=False,
+            cruising_range_ac_off_miles=100.0,
+            cruising_range_ac_on_miles=80.0,
+            icon_path="plugged_in.png",
+        ),
+        date_string="Saturday, 17 October 2026",
+        message="Bins out tonight",
+        weather=None,
+        pistat0=TemperatureData(reported_at="2026-10-17T09:30:00+00:00", temperature=20.0, humidity=50.0),
+        generated_date=datetime.now(timezone.utc),
+    )
+    return replace(data, **changes)
+
+
+def with_leaf(**changes) -> DashboardData:
+    data = create_data()
+    return replace(data, leaf=replace(data.leaf, **changes))
+
+
+def with_pistat0(**changes) -> DashboardData:
+    data = create_data()
+    return replace(data, pistat0=replace(data.pistat0, **changes))
+
+
+def test_unchanged_data_reuses_the_image():
+    assert check(create_data(), create_data()) is None
+
+
+@pytest.mark.parametrize("current, expected", [
+    (create_data(stale=["weather"]), "stale"),
+    (with_leaf(is_charging=True), "leaf-charging"),
+    (with_leaf(is_plugged_in=False), "leaf-plugged-in"),
+    (with_leaf(cruising_range_ac_off_miles=103.5), "leaf-range"),
+    (with_leaf(cruising_range_ac_off_miles=97.0), None),
+    (create_data(message="Recycling out tonight"), "message"),
+    (with_pistat0(temperature=20.6), "temperature"),
+    (with_pistat0(temperature=19.6), None),
+    (with_pistat0(humidity=53.0), "humidity"),
+    # the date isn't compared, as it changes along with the max age
+    (create_data(date_string="Sunday, 18 October 2026"), None),
+])
+def test_rules(current, expected):
+    assert check(create_data(), current) == expected
+
+
+def test_image_is_replaced_once_it_is_too_old():
+    old = datetime.now(timezone.utc) - timedelta(hours=1)
+
+    assert check(create_data(generated_date=old), create_data()) == "too-old"
+    assert check(create_data(generated_date=None), create_data()) == "too-old"
+
+
+def test_first_matching_rule_wins():
+    current = replace(with_leaf(is_charging=True), message="Recycling out tonight")
+
+    assert check(create_data(), current) == "leaf-charging"
+
+
+def test_missing_sources_dont_match():
+    # a source that hasn't loaded (or a range the car didn't report) can't be compared
+    assert check(create_data(), create_data(leaf=None, pistat0=None)) is None
+    assert check(create_data(leaf=None), create_data()) is None
+    assert check(create_data(), with_leaf(cruising_range_ac_off_miles=None)) is None
+
+
+def test_custom_policy():
+    policy = compile_policy([
+        Changed("date", ("date_string",)),
+        Threshold("range", "leaf.cruising_range_ac_on_miles", 10),
+        MaxAge("old", "generated_date", timedelta(minutes=5)),
+    ])
+
+    assert policy(create_data(), create_data()) is None
+    assert policy(create_data(), create_data(date_string="Sunday")) == "date"
+    assert policy(create_data(), with_leaf(cruising_range_ac_on_miles=91.0)) == "range"
+    six_minutes_ago = datetime.now(timezone.utc) - timedelta(minutes=6)
+    assert policy(create_data(generated_date=six_minutes_ago), create_data()) == "old"
+
+
+def test_unknown_fields_are_rejected_when_compiling():
+    with pytest.raises(ValueError):
+        compile_policy([Changed("typo", ("mesage",))])
+    with pytest.raises(ValueError):
+        compile_policy(["not a rule"])
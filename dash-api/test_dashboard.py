@@ -0,0 +1,96 @@
+"""
+The layered renderer is compared with testdata/dashboard-inky-frame-7.3.png, which was
+rendered from the same data by the full redraw in generate_dashboard_image that it replaced
+(before the JPEG encoding). If Pillow or FreeType are upgraded the text may be rasterised
+differently, in which case the reference needs to be re-rendered
+"""
+
+from dataclasses import replace
+from datetime import datetime, timezone
+import os
+
+from PIL import Image, ImageChops, ImageDraw
+import pytest
+
+from dash_api import config
+from dash_api.dashboard import Action, DashboardData, generate_dashboard_image
+from dash_api.fonts import DEFAULT_FACE
+from dash_api.layout import compile_layout
+from dash_api.leaf import LEAF_ICON_CHARGING, LeafData
+from dash_api.profiles import DEFAULT_PROFILE, INKY_FRAME_7_3
+from dash_api.temperature import TemperatureData
+from dash_api.weather import WeatherData, WeatherDataPoint
+
+REFERENCE_FILE = os.path.join(config.script_dir, "testdata", "dashboard-inky-frame-7.3.png")
+
+pytestmark = pytest.mark.skipif(
+    not os.path.isfile(os.path.join(config.font_dir, f"{DEFAULT_FACE}.ttf")), reason="the fonts aren't installed"
+)
+
+
+def create_icon(path: str, seed: int):
+    """A stand-in weather icon (same size and mode as the OpenWeatherMap @2x icons)"""
+    image = Image.new("RGBA", (100, 100), (0, 0, 0, 0))
+    ImageDraw.Draw(image).ellipse((10 + seed, 10, 90, 90 - seed), fill=(120 + seed * 5, 120, 200, 220))
+    image.save(path)
+
+
+def create_dashboard_data(icon_dir: str) -> DashboardData:
+    points = []
+    slots = [("Now", "light rain"), ("15:00", "overcast clouds"), ("18:00", "snow")]
+    for seed, (time_text, description) in enumerate(slots):
+        icon_path = os.path.join(icon_dir, f"{seed}.png")
+        create_icon(icon_path, seed)
+        points.append(WeatherDataPoint(
+            time=time_text,
+            description=description,
+            temperature=11.6 - seed,
+            feels_like=9.2 - seed,
+            icon_path=icon_path,
+            wind_speed_mph=12.4 + seed,
+            wind_gust_mph=None if seed == 2 else 24.8,
+            humidity=81 - seed,
+        ))
+    return DashboardData(
+        leaf=LeafData(
+            is_plugged_in=True,
+            is_charging=True,
+            cruising_range_ac_off_miles=123.4,
+            cruising_range_ac_on_miles=98.7,
+            icon_path=os.path.join(config.leaf_image_dir, LEAF_ICON_CHARGING),
+        ),
+        date_string="Saturday, 17 October 2026",
+        message="Bins out tonight (green and black)",
+        weather=WeatherData(current=points[0], forecast=points[1:]),
+        pistat0=TemperatureData(
+            reported_at=datetime(2026, 10, 17, 9, 30, tzinfo=timezone.utc), temperature=19.5, humidity=48.2
+        ),
+        actions=[Action(id="refresh", display_text="Refresh")],
+        generated_date=datetime(2026, 10, 17, 9, 31, tzinfo=timezone.utc),
+    )
+
+
+def test_render_matches_the_full_redraw(tmp_path):
+    frame = DEFAULT_PROFILE.render(create_dashboard_data(str(tmp_path)))
+
+    with Image.open(REFERENCE_FILE) as reference:
+        assert frame.size == reference.size
+        assert ImageChops.difference(frame, reference.convert("RGB")).getbbox() is None
+
+
+def test_layers_are_reused_when_the_data_changes(tmp_path):
+    data = create_dashboard_data(str(tmp_path))
+    DEFAULT_PROFILE.render(data)
+    changed = replace(data, message="Recycling out tonight")
+
+    # re-rendering only the message tile gives the same frame as rendering every tile
+    frame = DEFAULT_PROFILE.render(changed)
+    assert ImageChops.difference(frame, compile_layout(INKY_FRAME_7_3).render(changed)).getbbox() is None
+
+
+def test_generate_dashboard_image_is_a_jpeg(tmp_path):
+    image_buf = generate_dashboard_image(create_dashboard_data(str(tmp_path)))
+
+    with Image.open(image_buf) as image:
+        assert image.format == "JPEG"
+        assert image.size == (800, 480)
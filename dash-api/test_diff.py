@@ -0,0 +1,38 @@
+from PIL import Image, ImageDraw
+
+from dash_api.diff import FrameDiff, diff_frames, diff_since, frame_cache
+
+
+def create_frame(box: tuple[int, int, int, int] | None = None) -> Image.Image:
+    frame = Image.new("L", (64, 48), 255)
+    if box:
+        ImageDraw.Draw(frame).rectangle(box, fill=0)
+    return frame
+
+
+def test_diff_frames():
+    frame_diff = diff_frames(create_frame(), create_frame((8, 20, 15, 23)))
+
+    assert frame_diff.boxes == [(8, 20, 16, 24)]
+    assert frame_diff.changed_fraction == 32 / (64 * 48)
+    assert diff_frames(create_frame(), create_frame()) == FrameDiff(changed_fraction=0.0, boxes=[])
+
+
+def test_diff_since_the_clients_frame():
+    frame_cache.set("old", create_frame())
+
+    assert diff_since("old", "new", create_frame((0, 0, 3, 3))).boxes == [(0, 0, 4, 4)]
+
+
+def test_client_with_the_current_image_has_no_changes_without_its_frame():
+    # e.g. the frame has been evicted from the cache or the API has restarted
+    frame_cache.clear()
+
+    assert diff_since("current", "current", create_frame()) == FrameDiff(changed_fraction=0.0, boxes=[])
+
+
+def test_full_frame_is_sent_when_the_clients_frame_is_unknown():
+    frame_cache.clear()
+
+    for old_etag in [None, "unknown"]:
+        assert diff_since(old_etag, "new", create_frame()) == FrameDiff(changed_fraction=1.0, boxes=[(0, 0, 64, 48)])
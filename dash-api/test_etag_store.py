@@ -0,0 +1,140 @@
+from dataclasses import replace
+from datetime import datetime, timezone
+import sqlite3
+import time
+
+from dash_api.dashboard import Action, DashboardData
+from dash_api.etag_store import EtagStore, decode_dashboard_data, encode_dashboard_data
+from dash_api.leaf import LeafData
+from dash_api.temperature import TemperatureData
+from dash_api.weather import WeatherData, WeatherDataPoint
+
+
+def create_weather_point(time_text: str, wind_gust_mph: float | None) -> WeatherDataPoint:
+    return WeatherDataPoint(
+        time=time_text,
+        description="light rain",
+        temperature=11.6,
+        feels_like=9.2,
+        icon_path="/weather-icons/10d.png",
+        wind_speed_mph=12.4,
+        wind_gust_mph=wind_gust_mph,
+        humidity=81,
+    )
+
+
+def create_data(message: str = "Bins out tonight") -> DashboardData:
+    return DashboardData(
+        leaf=LeafData(
+            is_plugged_in=True,
+            is_charging=False,
+            cruising_range_ac_off_miles=None,
+            cruising_range_ac_on_miles=80.0,
+            icon_path="plugged_in.png",
+        ),
+        date_string="Saturday, 17 October 2026",
+        message=message,
+        weather=WeatherData(
+            current=create_weather_point("Now", 24.8),
+            forecast=[create_weather_point("15:00", None), create_weather_point("18:00", 20.1)],
+        ),
+        # (reported_at is kept as the ISO string from temperatures.json)
+        pistat0=TemperatureData(reported_at="2026-10-17T09:30:00+00:00", temperature=19.5, humidity=48.2),
+        actions=[Action(id="refresh", display_text="Refresh")],
+        generated_date=datetime(2026, 10, 17, 9, 31, tzinfo=timezone.utc),
+        stale=["weather"],
+    )
+
+
+def test_encode_and_decode():
+    data = create_data()
+
+    assert decode_dashboard_data(encode_dashboard_data(data)) == data
+
+
+def test_encode_and_decode_missing_sources():
+    data = DashboardData(
+        leaf=None, date_string="Saturday", message="", weather=None, pistat0=None, actions=None, generated_date=None
+    )
+
+    assert decode_dashboard_data(encode_dashboard_data(data)) == data
+
+
+def test_get_and_set(tmp_path):
+    store = EtagStore(str(tmp_path / "etags.db"), ttl=60)
+    store.set("etag-1", create_data())
+    store.set("etag-2", create_data("Recycling out tonight"))
+
+    assert store.get("etag-1") == create_data()
+    assert store.get("etag-2").message == "Recycling out tonight"
+    assert store.get("unknown") is None
+
+
+def test_shared_between_workers(tmp_path):
+    # each API worker has its own store (and memory cache) for the shared database
+    first = EtagStore(str(tmp_path / "etags.db"), ttl=60)
+    second = EtagStore(str(tmp_path / "etags.db"), ttl=60)
+
+    first.set("etag-1", create_data())
+
+    assert second.get("etag-1") == create_data()
+
+
+def test_entries_expire_with_their_row(tmp_path):
+    first = EtagStore(str(tmp_path / "etags.db"), ttl=0.3)
+    second = EtagStore(str(tmp_path / "etags.db"), ttl=0.3)
+    first.set("etag-1", create_data())
+    time.sleep(0.2)
+
+    # loaded into the second store's memory with the time left on the row rather than another ttl
+    assert second.get("etag-1") is not None
+    time.sleep(0.15)
+
+    assert first.get("etag-1") is None
+    assert second.get("etag-1") is None
+
+
+def test_using_an_entry_doesnt_extend_it(tmp_path):
+    store = EtagStore(str(tmp_path / "etags.db"), ttl=0.3)
+    store.set("etag-1", create_data())
+
+    for _ in range(4):
+        time.sleep(0.1)
+        store.get("etag-1")
+
+    assert store.get("etag-1") is None
+
+
+def test_rows_in_another_format_or_that_fail_to_decode_are_misses(tmp_path):
+    path = str(tmp_path / "etags.db")
+    EtagStore(path, ttl=60).set("etag-1", create_data())
+    with sqlite3.connect(path) as connection:
+        connection.execute("INSERT INTO etags VALUES ('old-format', 0, ?, '{}')", (time.time() + 60,))
+        connection.execute("INSERT INTO etags VALUES ('corrupt', 1, ?, '{\"leaf\": 1}')", (time.time() + 60,))
+
+    store = EtagStore(path, ttl=60)
+
+    assert store.get("old-format") is None
+    assert store.get("corrupt") is None
+    assert store.get("etag-1") == create_data()
+
+
+def test_database_errors_are_misses(tmp_path):
+    store = EtagStore(str(tmp_path / "missing" / "etags.db"), ttl=60)
+
+    store.set("etag-1", create_data())
+
+    # (still in memory)
+    assert store.get("etag-1") == create_data()
+    assert store.get("etag-2") is None
+
+
+def test_data_that_fails_to_encode_is_only_kept_in_memory(tmp_path):
+    path = str(tmp_path / "etags.db")
+    data = replace(create_data(), message=object())
+    store = EtagStore(path, ttl=60)
+
+    store.set("etag-1", data)
+
+    assert store.get("etag-1") is data
+    assert EtagStore(path, ttl=60).get("etag-1") is None
@@ -0,0 +1,73 @@
+from io import BytesIO
+
+from PIL import Image
+import pytest
+
+from dash_api.formats import DEFAULT_FORMAT, FORMATS, get_image_format
+
+
+def grey_row(values: list[int]) -> Image.Image:
+    image = Image.new("L", (len(values), 1))
+    image.putdata(values)
+    return image.convert("RGB")
+
+
+@pytest.mark.parametrize("format_name, expected", [
+    ("1bpp", bytes([0b10100000])),
+    ("2bpp", bytes([0b11001100])),
+    ("4bpp", bytes([0xF0, 0xF0])),
+])
+def test_packed_formats_pack_msb_first(format_name, expected):
+    # white is the highest value and black is 0
+    assert FORMATS[format_name].encode(grey_row([255, 0, 255, 0])) == expected
+
+
+def test_packed_grey_levels():
+    assert FORMATS["2bpp"].encode(grey_row([0, 85, 170, 255])) == bytes([0b00011011])
+    assert FORMATS["4bpp"].encode(grey_row([0, 17, 238, 255])) == bytes([0x01, 0xEF])
+
+
+@pytest.mark.parametrize("format_name", ["1bpp", "2bpp", "4bpp"])
+def test_packed_rows_are_padded_to_whole_bytes(format_name):
+    image_format = FORMATS[format_name]
+    image = Image.new("RGB", (10, 3), (255, 255, 255))
+
+    data = image_format.encode(image)
+
+    bytes_per_row = -(-10 * image_format.bits_per_pixel // 8)
+    assert len(data) == bytes_per_row * 3
+
+
+@pytest.mark.parametrize("format_name, pil_format", [("jpeg", "JPEG"), ("png", "PNG")])
+def test_image_formats(format_name, pil_format):
+    data = FORMATS[format_name].encode(Image.new("RGB", (16, 8), (255, 255, 255)))
+
+    with Image.open(BytesIO(data)) as image:
+        assert image.format == pil_format
+        assert image.size == (16, 8)
+
+
+def test_format_parameter_overrides_accept():
+    assert get_image_format("PNG", "application/vnd.home-dash.1bpp") is FORMATS["png"]
+    assert get_image_format("gif", "image/png") is None
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, "jpeg"),
+    ("*/*", "jpeg"),
+    ("image/png", "png"),
+    ("image/png, application/vnd.home-dash.2bpp", "png"),
+    ("image/png;q=0.5, application/vnd.home-dash.2bpp", "2bpp"),
+    ("application/vnd.home-dash.2bpp;q=0.8, image/png;q=0.9, */*;q=0.1", "png"),
+    ("image/png;q=0, application/vnd.home-dash.4bpp;q=0.2", "4bpp"),
+    ("image/png;q=0", "jpeg"),
+    ("image/png;q=high, image/jpeg;q=0.1", "jpeg"),
+    ("IMAGE/PNG ; Q=0.3, text/html", "png"),
+])
+def test_accept_header_q_values(accept, expected):
+    assert get_image_format(None, accept) is FORMATS[expected]
+
+
+def test_default_when_nothing_matches():
+    assert get_image_format(None, "text/html", default=FORMATS["1bpp"]) is FORMATS["1bpp"]
+    assert get_image_format(None, "text/html") is DEFAULT_FORMAT
@@ -0,0 +1,20 @@
+import pytest
+
+from dash_api.layout import Layout, compile_layout
+
+
+def create_layout(**changes) -> Layout:
+    return Layout(
+        name="test", size=(64, 48), background=[], background_value=lambda d: None, regions=[], **changes
+    )
+
+
+@pytest.mark.parametrize("colour_depth, expected", [(1, "1bpp"), (2, "2bpp"), (4, "4bpp"), (24, "jpeg")])
+def test_default_format(colour_depth, expected):
+    assert compile_layout(create_layout(colour_depth=colour_depth)).default_format == expected
+
+
+@pytest.mark.parametrize("colour_depth", [0, 3])
+def test_invalid_colour_depth_is_rejected_when_compiling(colour_depth):
+    with pytest.raises(ValueError):
+        compile_layout(create_layout(colour_depth=colour_depth))
@@ -0,0 +1,83 @@
+from datetime import date
+import json
+import logging
+import os
+
+from dash_api.messages import MessageStore
+
+
+def write_messages(path, messages: dict[str, str], mtime_ns: int):
+    path.write_text(json.dumps(messages))
+    # (explicit mtimes so that the changes are seen however coarse the filesystem's timestamps are)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_get_and_set(tmp_path):
+    store = MessageStore(str(tmp_path / "messages.db"))
+
+    assert store.get(date(2026, 10, 17)) is None
+    store.set(date(2026, 10, 17), "Bins out tonight")
+    store.set_many({date(2026, 10, 17): "Recycling out tonight", date(2026, 10, 18): "Boiler service"})
+
+    assert store.get(date(2026, 10, 17)) == "Recycling out tonight"
+    # the messages are kept in the database
+    assert MessageStore(str(tmp_path / "messages.db")).get(date(2026, 10, 18)) == "Boiler service"
+
+
+def test_get_range(tmp_path):
+    store = MessageStore(str(tmp_path / "messages.db"))
+    store.set_many({date(2026, 10, day): f"message {day}" for day in range(1, 6)})
+
+    assert list(store.get_range(date(2026, 10, 2), date(2026, 10, 4))) == ["2026-10-02", "2026-10-03", "2026-10-04"]
+    assert list(store.get_range(None, date(2026, 10, 2))) == ["2026-10-01", "2026-10-02"]
+    assert list(store.get_range(date(2026, 10, 5), None)) == ["2026-10-05"]
+    assert len(store.get_range(None, None)) == 5
+
+
+def test_json_file_is_imported(tmp_path):
+    json_path = tmp_path / "messages.json"
+    write_messages(json_path, {"2026-10-17": "Bins out tonight"}, 1_000_000_000)
+
+    store = MessageStore(str(tmp_path / "messages.db"), import_path=str(json_path))
+
+    assert store.get(date(2026, 10, 17)) == "Bins out tonight"
+
+
+def test_json_file_is_imported_again_when_it_changes(tmp_path):
+    json_path = tmp_path / "messages.json"
+    write_messages(json_path, {"2026-10-17": "Bins out tonight"}, 1_000_000_000)
+    store = MessageStore(str(tmp_path / "messages.db"), import_path=str(json_path))
+    store.set(date(2026, 10, 17), "Set by the API")
+    store.set(date(2026, 10, 18), "Also set by the API")
+
+    # unchanged, so it isn't imported again (by this worker or another one)
+    other_worker = MessageStore(str(tmp_path / "messages.db"), import_path=str(json_path))
+    assert store.get(date(2026, 10, 17)) == "Set by the API"
+    assert other_worker.get(date(2026, 10, 17)) == "Set by the API"
+
+    write_messages(json_path, {"2026-10-17": "Edited in the file"}, 2_000_000_000)
+
+    assert store.get(date(2026, 10, 17)) == "Edited in the file"
+    assert store.get(date(2026, 10, 18)) == "Also set by the API"
+
+
+def test_invalid_json_file_is_retried_once_it_changes(tmp_path, caplog):
+    json_path = tmp_path / "messages.json"
+    json_path.write_text("{not json")
+    os.utime(json_path, ns=(1_000_000_000, 1_000_000_000))
+    store = MessageStore(str(tmp_path / "messages.db"), import_path=str(json_path))
+
+    with caplog.at_level(logging.WARNING):
+        assert store.get(date(2026, 10, 17)) is None
+        assert store.get(date(2026, 10, 17)) is None
+    assert len([r for r in caplog.records if "failed to import" in r.getMessage()]) == 1
+
+    write_messages(json_path, {"2026-10-17": "Fixed"}, 2_000_000_000)
+
+    assert store.get(date(2026, 10, 17)) == "Fixed"
+
+
+def test_missing_json_file(tmp_path):
+    store = MessageStore(str(tmp_path / "messages.db"), import_path=str(tmp_path / "missing.json"))
+
+    assert store.get(date(2026, 10, 17)) is None
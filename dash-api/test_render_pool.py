@@ -0,0 +1,24 @@
+import pytest
+
+from dash_api.dashboard import DashboardData
+from dash_api.formats import FORMATS
+from dash_api.profiles import DEFAULT_PROFILE
+from dash_api.render_pool import RenderPool
+
+
+def test_failed_submit_isnt_left_in_flight(monkeypatch):
+    pool = RenderPool(max_workers=0)
+    data = DashboardData(
+        leaf=None, date_string="Saturday", message="", weather=None, pistat0=None, actions=None, generated_date=None
+    )
+
+    def fail(*args):
+        raise RuntimeError("cannot schedule new futures after shutdown")
+
+    monkeypatch.setattr(pool, "submit", fail)
+
+    # the second request would join (and wait forever on) the first's render if it was still in flight
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            pool.render_sync(data, DEFAULT_PROFILE, FORMATS["png"])
+    assert pool.collapsed == 0
@@ -0,0 +1,48 @@
+import json
+import os
+
+from dash_api.file_snapshot import JsonFileSnapshot
+from dash_api.sources import DataSource, LoadedValue, SourceGatherer
+
+
+def create_snapshot(path, value, mtime_ns: int) -> JsonFileSnapshot:
+    path.write_text(json.dumps(value))
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    snapshot = JsonFileSnapshot(str(path), parse=lambda value: value)
+    snapshot.get()
+    return snapshot
+
+
+def break_snapshot(snapshot: JsonFileSnapshot, mtime_ns: int):
+    # (as if it was part-way through being written)
+    with open(snapshot.path, "w") as f:
+        f.write('{"value":')
+    os.utime(snapshot.path, ns=(mtime_ns, mtime_ns))
+    snapshot.get()
+
+
+def test_source_uses_its_last_good_value_when_its_file_fails_to_parse(tmp_path):
+    snapshot = create_snapshot(tmp_path / "source.json", {"value": 1}, 1_000_000_000)
+    gatherer = SourceGatherer([DataSource("source", lambda: snapshot.get()["value"], 5, (snapshot,))])
+
+    assert gatherer.gather().stale == []
+    break_snapshot(snapshot, 2_000_000_000)
+    gathered = gatherer.gather()
+
+    assert gathered.stale == ["source"]
+    assert gathered.values == {"source": 1}
+
+
+def test_source_is_only_stale_if_a_file_it_read_is_stale(tmp_path):
+    used = create_snapshot(tmp_path / "used.json", {"value": 1}, 1_000_000_000)
+    unused = create_snapshot(tmp_path / "unused.json", {"value": 2}, 1_000_000_000)
+    break_snapshot(unused, 2_000_000_000)
+
+    gathered = SourceGatherer([
+        # e.g. the weather, which only reads the summary when there is no projection
+        DataSource("used", lambda: LoadedValue(used.get()["value"], (used,)), 5, (used, unused)),
+        DataSource("declared", lambda: used.get()["value"], 5, (used, unused)),
+    ]).gather()
+
+    assert gathered.values == {"used": 1, "declared": 1}
+    assert gathered.stale == ["declared"]
@@ -0,0 +1,185 @@
+import json
+
+import pytest
+
+from dash_api import temperature_history
+from dash_api.temperature_history import (
+    RAW_CAPACITY,
+    TIERS,
+    Aggregate,
+    TemperatureHistory,
+    TemperatureSeries,
+    choose_step,
+)
+
+# the start of a day (so also of a 5 minute and an hour bucket)
+DAY = 1_760_659_200
+
+
+def test_readings_are_aggregated_into_buckets():
+    series = TemperatureSeries()
+    for offset, temperature, humidity in [(0, 20.0, 40.0), (60, 22.0, 50.0), (299, 21.0, 45.0), (300, 25.0, 60.0)]:
+        series.add(DAY + offset, temperature, humidity)
+
+    five_minutes = series.query(DAY, DAY + 600, "5m")
+    assert [(p.time, p.count) for p in five_minutes] == [(DAY, 3), (DAY + 300, 1)]
+    assert five_minutes[0].temperature == Aggregate(20.0, 22.0, 21.0)
+    assert five_minutes[0].humidity == Aggregate(40.0, 50.0, 45.0)
+
+    (hour,) = series.query(DAY, DAY + 3600, "1h")
+    assert hour.count == 4
+    assert hour.temperature == Aggregate(20.0, 25.0, 22.0)
+
+    (day,) = series.query(DAY, DAY + 86400, "1d")
+    assert (day.time, day.count) == (DAY, 4)
+
+
+def test_query_is_limited_to_the_range():
+    series = TemperatureSeries()
+    for hour in range(5):
+        series.add(DAY + hour * 3600, 20.0 + hour, 50.0)
+
+    points = series.query(DAY + 3600, DAY + 3 * 3600, "1h")
+
+    assert [p.time for p in points] == [DAY + 3600, DAY + 2 * 3600, DAY + 3 * 3600]
+    assert [len(series.query(DAY, DAY + 86400, step)) for step in ["raw", "5m", "1h", "1d"]] == [5, 5, 5, 1]
+
+
+def test_raw_ring_keeps_the_latest_readings():
+    series = TemperatureSeries()
+    for n in range(RAW_CAPACITY + 10):
+        series.add(DAY + n, float(n), 50.0)
+
+    points = series.query(0, DAY * 2, "raw")
+
+    assert len(points) == RAW_CAPACITY
+    assert points[0].time == DAY + 10
+    assert points[-1].time == DAY + RAW_CAPACITY + 9
+    assert points[-1].temperature == Aggregate(RAW_CAPACITY + 9, RAW_CAPACITY + 9, RAW_CAPACITY + 9)
+
+
+def test_tier_ring_replaces_the_oldest_bucket():
+    spec = TIERS[0]
+    wrapped = DAY + spec.step * spec.capacity
+    series = TemperatureSeries()
+    series.add(DAY, 10.0, 50.0)
+    series.add(wrapped, 30.0, 50.0)
+    # older than the tier holds (its slot now has the newer bucket)
+    series.add(DAY + 1, 99.0, 50.0)
+
+    assert series.query(DAY, DAY + spec.step, spec.name) == []
+    (point,) = series.query(wrapped, wrapped, spec.name)
+    assert (point.count, point.temperature.max) == (1, 30.0)
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "sensor.bin")
+    series = TemperatureSeries()
+    for n in range(100):
+        series.add(DAY + n * 120, 20.0 + n / 10, 50.0 - n / 10)
+
+    series.save(path)
+    loaded = TemperatureSeries.load(path)
+
+    for step in ["raw", "5m", "1h", "1d"]:
+        assert loaded.query(DAY, DAY + 86400, step) == series.query(DAY, DAY + 86400, step)
+    loaded.add(DAY + 100 * 120, 1.0, 1.0)
+    assert len(loaded.query(DAY, DAY + 86400, "raw")) == 101
+
+
+def test_load_rejects_a_changed_layout(tmp_path):
+    path = tmp_path / "sensor.bin"
+    TemperatureSeries().save(str(path))
+    header, data = path.read_bytes().split(b"\n", 1)
+    changed = json.loads(header)
+    changed["tiers"]["5m"][1] += 1
+    path.write_bytes(json.dumps(changed).encode("utf-8") + b"\n" + data)
+
+    with pytest.raises(ValueError):
+        TemperatureSeries.load(str(path))
+
+
+@pytest.mark.parametrize("seconds, expected", [
+    (3600, "5m"),
+    (7 * 86400, "1h"),
+    (20 * 86400, "1h"),
+    (30 * 86400, "1d"),
+    (365 * 86400, "1d"),
+    (10 * 365 * 86400, "1d"),
+])
+def test_choose_step(seconds, expected):
+    assert choose_step(DAY, DAY + seconds) == expected
+
+
+def test_history_skips_invalid_readings(tmp_path):
+    history = TemperatureHistory(str(tmp_path))
+
+    history.add_readings([
+        ("pistat-0", DAY, 20.0, 50.0),
+        ("../escape", DAY, 20.0, 50.0),
+        ("pistat-0", DAY + 1, float("nan"), 50.0),
+    ])
+
+    assert len(history.query("pistat-0", DAY, DAY + 10, "raw")) == 1
+    assert history.query("../escape", DAY, DAY + 10, "raw") is None
+    assert history.query("unknown", DAY, DAY + 10, "raw") is None
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["pistat-0.bin"]
+
+
+def test_history_sees_other_workers_readings(tmp_path):
+    # each API worker has its own TemperatureHistory for the shared folder
+    first = TemperatureHistory(str(tmp_path))
+    second = TemperatureHistory(str(tmp_path))
+
+    first.add_readings([("pistat-0", DAY, 20.0, 50.0)])
+    second.add_readings([("pistat-0", DAY + 60, 22.0, 50.0)])
+
+    for history in [first, second]:
+        (point,) = history.query("pistat-0", DAY, DAY + 300, "5m")
+        assert (point.count, point.temperature.mean) == (2, 21.0)
+
+
+def test_readings_are_appended_to_the_journal(tmp_path):
+    history = TemperatureHistory(str(tmp_path))
+    history.add_readings([("pistat-0", DAY, 20.0, 50.0)])
+    series_file = tmp_path / "pistat-0.bin"
+    written = series_file.stat()
+
+    history.add_readings([("pistat-0", DAY + 60, 22.0, 50.0)])
+    history.add_readings([("pistat-0", DAY + 120, 24.0, 50.0)])
+
+    # the series file isn't rewritten for a few readings
+    assert series_file.stat().st_mtime_ns == written.st_mtime_ns
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["pistat-0.bin", "pistat-0.journal"]
+    (point,) = TemperatureHistory(str(tmp_path)).query("pistat-0", DAY, DAY + 300, "5m")
+    assert (point.count, point.temperature.mean) == (3, 22.0)
+
+
+def test_journal_is_compacted_into_the_file_once_it_is_full(tmp_path, monkeypatch):
+    monkeypatch.setattr(temperature_history, "JOURNAL_CAPACITY", 3)
+    history = TemperatureHistory(str(tmp_path))
+    for n in range(5):
+        history.add_readings([("pistat-0", DAY + n * 60, 20.0 + n, 50.0)])
+
+    # (the first reading was written to the file, then three to the journal and the fifth compacted them)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["pistat-0.bin"]
+    history.add_readings([("pistat-0", DAY + 300, 30.0, 50.0)])
+
+    for other_worker in [history, TemperatureHistory(str(tmp_path))]:
+        assert len(other_worker.query("pistat-0", DAY, DAY + 3600, "raw")) == 6
+
+
+def test_part_written_journal_record_is_ignored_and_overwritten(tmp_path):
+    history = TemperatureHistory(str(tmp_path))
+    history.add_readings([("pistat-0", DAY, 20.0, 50.0)])
+    history.add_readings([("pistat-0", DAY + 60, 22.0, 50.0)])
+    with open(tmp_path / "pistat-0.journal", "ab") as f:
+        # (as if the API was killed part-way through appending a reading)
+        f.write(b"\x01\x02\x03")
+
+    other_worker = TemperatureHistory(str(tmp_path))
+    assert len(other_worker.query("pistat-0", DAY, DAY + 300, "raw")) == 2
+    other_worker.add_readings([("pistat-0", DAY + 120, 24.0, 50.0)])
+
+    points = TemperatureHistory(str(tmp_path)).query("pistat-0", DAY, DAY + 300, "raw")
+    assert [p.temperature.mean for p in points] == [20.0, 22.0, 24.0]
@@ -1,10 +1,15 @@
+import bisect
+from collections.abc import Sequence
 from dataclasses import dataclass
-import json
 import os
+import time
 
 from . import config
+from .file_snapshot import JsonFileSnapshot
+from .input_feed import input_feed
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class WeatherDataPoint:
     time: str
     description: str
@@ -15,31 +20,178 @@ class WeatherDataPoint:
     wind_gust_mph: float | None
     humidity: float | None
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class WeatherData:
     current: WeatherDataPoint
-    forecast: list[WeatherDataPoint]
+    forecast: Sequence[WeatherDataPoint]
+
+
+def _get_str(value: dict, key: str) -> str:
+    item = value[key]
+    if not isinstance(item, str):
+        raise TypeError(f"Expected a string for {key}: {item!r}")
+    return item
+
+
+def _get_number(value: dict, key: str) -> float:
+    item = value[key]
+    if isinstance(item, bool) or not isinstance(item, (int, float)):
+        raise TypeError(f"Expected a number for {key}: {item!r}")
+    return item
+
+
+def _get_optional_number(value: dict, key: str) -> float | None:
+    if value.get(key) is None:
+        return None
+    return _get_number(value, key)
+
+
+def _decode_weather_data_point(value: dict) -> WeatherDataPoint:
+    return WeatherDataPoint(
+        time=_get_str(value, "time"),
+        description=_get_str(value, "description"),
+        temperature=_get_number(value, "temperature"),
+        feels_like=_get_number(value, "feels_like"),
+        icon_path=_get_str(value, "icon_path"),
+        wind_speed_mph=_get_number(value, "wind_speed_mph"),
+        wind_gust_mph=_get_optional_number(value, "wind_gust_mph"),
+        humidity=_get_optional_number(value, "humidity"),
+    )
+
+
+class _LazyForecast(Sequence[WeatherDataPoint]):
+    """The forecast entries, decoded from the JSON the first time each one is used"""
+
+    __slots__ = ("_values", "_points")
+
+    def __init__(self, values: list[dict]):
+        self._values = values
+        self._points: list[WeatherDataPoint | None] = [None] * len(values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        point = self._points[index]
+        if point is None:
+            point = _decode_weather_data_point(self._values[index])
+            self._points[index] = point
+        return point
+
+
+class WeatherSummary:
+    """
+    The parsed weather-summary.json.
+    The forecast (usually ~40 entries) is only decoded as entries are used
+    and the rounded data for the dashboard is cached until the file changes
+    """
 
-def get_weather_data():
-    # Get the leaf summary content from leaf-summary.json
-    weather_summary_file = os.path.join(
-        config.dashboard_input_dir, "weather-summary.json")
+    __slots__ = ("weather", "_display")
 
-    if not os.path.isfile(weather_summary_file):
+    def __init__(self, weather_summary_json: dict):
+        forecast = weather_summary_json["forecast"]
+        if not isinstance(forecast, list):
+            raise TypeError("Expected a list for forecast")
+        self.weather = WeatherData(
+            current=_decode_weather_data_point(weather_summary_json["current"]),
+            forecast=_LazyForecast(forecast),
+        )
+        self._display: dict[int, WeatherData] = {}
+
+    def get_display_weather(self, forecast_count: int) -> WeatherData:
+        """The current weather and the first forecast_count forecasts, rounded for display"""
+        display = self._display.get(forecast_count)
+        if display is None:
+            display = WeatherData(
+                current=get_rounded_weather_data(self.weather.current),
+                forecast=[get_rounded_weather_data(w) for w in self.weather.forecast[:forecast_count]],
+            )
+            self._display[forecast_count] = display
+        return display
+
+
+weather_summary_snapshot = input_feed.register(JsonFileSnapshot[WeatherSummary](
+    os.path.join(config.dashboard_input_dir, "weather-summary.json"), parse=WeatherSummary))
+
+
+WEATHER_PROJECTION_VERSION = 1
+
+
+class WeatherProjection:
+    """
+    The parsed weather-dashboard.json: the weather pre-rounded for the dashboard by
+    fetch-weather, with the time of each forecast so the upcoming forecasts can be
+    found with a binary search
+    """
+
+    __slots__ = ("current", "forecast_times", "forecast", "_display")
+
+    def __init__(self, projection_json: dict):
+        if projection_json["version"] != WEATHER_PROJECTION_VERSION:
+            raise ValueError(f"Unsupported weather-dashboard.json version: {projection_json['version']}")
+        forecast_times = projection_json["forecast_times"]
+        forecast = projection_json["forecast"]
+        if not isinstance(forecast_times, list) or not isinstance(forecast, list):
+            raise TypeError("Expected lists for forecast_times and forecast")
+        if len(forecast_times) != len(forecast):
+            raise ValueError("forecast_times and forecast have different lengths")
+        for t in forecast_times:
+            if isinstance(t, bool) or not isinstance(t, (int, float)):
+                raise TypeError(f"Expected a number for forecast_times: {t!r}")
+        if any(a > b for a, b in zip(forecast_times, forecast_times[1:])):
+            raise ValueError("forecast_times is not sorted")
+
+        self.current = _decode_weather_data_point(projection_json["current"])
+        self.forecast_times: list[float] = forecast_times
+        self.forecast = _LazyForecast(forecast)
+        self._display: dict[tuple[int, int], WeatherData] = {}
+
+    def get_display_weather(self, forecast_count: int, now: float) -> WeatherData:
+        """The current weather and the next forecast_count forecasts after now (epoch seconds)"""
+        start = bisect.bisect_right(self.forecast_times, now)
+        display = self._display.get((start, forecast_count))
+        if display is None:
+            display = WeatherData(current=self.current, forecast=self.forecast[start:start + forecast_count])
+            self._display[(start, forecast_count)] = display
+        return display
+
+
+weather_projection_snapshot = input_feed.register(JsonFileSnapshot[WeatherProjection](
+    os.path.join(config.dashboard_input_dir, "weather-dashboard.json"), parse=WeatherProjection))
+
+
+def get_weather_data() -> WeatherData | None:
+    # Get the weather summary content from weather-summary.json
+    weather_summary = weather_summary_snapshot.get()
+    if weather_summary is None:
         print("ERROR: weather-summary.json does not exist")
         return None
 
-    with open(weather_summary_file) as f:
-        weather_summary_json = json.load(f)
-        # parse the json into a list of WeatherData objects
-        weather_data = []
-        for weather in weather_summary_json["forecast"]:
-            weather_data.append(WeatherDataPoint(**weather))
+    return weather_summary.weather
+
+
+def read_display_weather_data(forecast_count: int) -> tuple[WeatherData | None, JsonFileSnapshot]:
+    """As get_display_weather_data, along with the snapshot that the weather was read from"""
+    projection = weather_projection_snapshot.get()
+    if projection is not None:
+        return projection.get_display_weather(forecast_count, time.time()), weather_projection_snapshot
+
+    # fetch-weather hasn't written weather-dashboard.json (yet) so use the full summary
+    # (which has no forecast times so the first forecasts are used even if they are past)
+    weather_summary = weather_summary_snapshot.get()
+    if weather_summary is None:
+        print("ERROR: weather-summary.json does not exist")
+        return None, weather_summary_snapshot
 
-        current = WeatherDataPoint(**weather_summary_json["current"])
+    return weather_summary.get_display_weather(forecast_count), weather_summary_snapshot
 
-    return WeatherData(current=current, forecast=weather_data)
 
+def get_display_weather_data(forecast_count: int) -> WeatherData | None:
+    """Get the weather rounded for display with up to forecast_count upcoming forecasts"""
+    return read_display_weather_data(forecast_count)[0]
 
 
 def get_rounded_weather_data(weather_data: WeatherDataPoint) -> WeatherDataPoint:
@@ -54,4 +206,4 @@ def get_rounded_weather_data(weather_data: WeatherDataPoint) -> WeatherDataPoint
             round(weather_data.wind_gust_mph) if weather_data.wind_gust_mph else None
         ),
         humidity=round(weather_data.humidity) if weather_data.humidity else None,
-    )
\ No newline at end of file
+    )
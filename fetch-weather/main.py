@@ -30,6 +30,11 @@ if not output_dir:
 if not os.path.isdir(output_dir):
     os.makedirs(output_dir)
 output_file = os.path.join(output_dir, "weather-summary.json")
+# the data shown on the dashboard (see write_dashboard_projection)
+dashboard_output_file = os.path.join(output_dir, "weather-dashboard.json")
+DASHBOARD_PROJECTION_VERSION = 1
+# the forecasts for the next day (in case later fetches fail)
+DASHBOARD_FORECAST_COUNT = 8
 
 
 def download_icon(icon_name: str) -> str:
@@ -40,8 +45,12 @@ def download_icon(icon_name: str) -> str:
     icon_path = os.path.join(icon_folder, f"{icon_name}.png")
     if not os.path.isfile(icon_path):
         icon_response = requests.get(icon_url)
-        with open(icon_path, "wb") as f:
+        # write to a temp file and rename so that dash-api never reads a partial icon
+        # (the rename also gives the icon a new mtime which invalidates dash-api's icon cache)
+        temp_path = f"{icon_path}.tmp"
+        with open(temp_path, "wb") as f:
             f.write(icon_response.content)
+        os.replace(temp_path, icon_path)
     return icon_path
 
 
@@ -123,7 +132,8 @@ def parse_forecast_data(forecast: dict) -> WeatherData:
     )
 
 
-def get_weather_forecast() -> list[WeatherData]:
+def get_weather_forecast() -> list[tuple[int, WeatherData]]:
+    """Get the forecast as (time of the forecast in epoch seconds, forecast) in time order"""
     url = f"https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lng}&appid={openweather_api_key}&units=metric"
     response = requests.get(url)
     if response.status_code != 200:
@@ -132,15 +142,59 @@ def get_weather_forecast() -> list[WeatherData]:
         exit(1)
 
     list = response.json()["list"]
-    return [parse_forecast_data(forecast) for forecast in list]
+    forecast = [(entry["dt"], parse_forecast_data(entry)) for entry in list]
+    forecast.sort(key=lambda f: f[0])
+    return forecast
+
+
+def get_rounded_weather_data(weather_data: WeatherData) -> dict:
+    """The weather as shown on the dashboard (rounded to whole numbers)"""
+    return asdict(WeatherData(
+        time=weather_data.time,
+        description=weather_data.description,
+        temperature=round(weather_data.temperature),
+        feels_like=round(weather_data.feels_like),
+        icon_path=weather_data.icon_path,
+        wind_speed_mph=round(weather_data.wind_speed_mph),
+        wind_gust_mph=(
+            round(weather_data.wind_gust_mph) if weather_data.wind_gust_mph else None
+        ),
+        humidity=round(weather_data.humidity) if weather_data.humidity else None,
+    ))
+
+
+def write_json(path: str, value: dict, **kwargs):
+    # write to a temp file and rename so that dash-api never reads a partial file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(value, f, **kwargs)
+    os.replace(temp_path, path)
+
+
+def write_dashboard_projection(current: WeatherData, forecast: list[tuple[int, WeatherData]]):
+    """
+    Write the compact, pre-rounded weather for the dashboard.
+    forecast_times is the (sorted) time of each forecast entry so that dash-api
+    can pick the upcoming entries with a binary search
+    """
+    forecast = forecast[:DASHBOARD_FORECAST_COUNT]
+    projection = {
+        "version": DASHBOARD_PROJECTION_VERSION,
+        "current": get_rounded_weather_data(current),
+        "forecast_times": [dt for dt, _ in forecast],
+        "forecast": [get_rounded_weather_data(w) for _, w in forecast],
+    }
+    write_json(dashboard_output_file, projection, separators=(",", ":"))
 
 
 weather_data = get_weather_forecast()
+current_weather = get_current_weather()
 
 summary = {
-    "current": asdict(get_current_weather()),
-    "forecast": [asdict(w) for w in weather_data],
+    "current": asdict(current_weather),
+    "forecast": [asdict(w) for _, w in weather_data],
 }
 # print(summary)
 
-json.dump(summary, open(output_file, "w"), indent=2)
+write_json(output_file, summary, indent=2)
+write_dashboard_projection(current_weather, weather_data)